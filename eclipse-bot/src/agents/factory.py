@@ -7,10 +7,16 @@ Supports per-agent model and API key overrides.
 from deepagents import create_deep_agent
 from deepagents.backends import StateBackend
 # Use custom checkpointer to avoid version issues
-from src.core.checkpointer import CustomSqliteSaver
-import sqlite3
+from src.core.checkpointer import CustomSqliteSaver, CheckpointWriteBuffer
+from src.core.checkpoint_serde import get_serializer
+from src.core.checkpoint_cache import CheckpointCache
+from src.core.sqlite_pool import SqliteConnectionManager
 import os
+import hashlib
 import logging
+import threading
+import time
+import weakref
 from src.core.model_registry import get_context_window
 from src.config import get_settings
 from src.agents.subagents import get_subagents
@@ -21,39 +27,282 @@ from src.tools.slack_tools import ALL_SLACK_TOOLS
 from src.tools.opensearch_tools import ALL_OPENSEARCH_TOOLS
 from src.skills.code_review import code_review
 
+def _open_db(path: str) -> SqliteConnectionManager:
+    """Writer thread + read pool with tuned PRAGMAs (see Settings.persistence_*)."""
+    settings = get_settings()
+    return SqliteConnectionManager(
+        path,
+        pool_size=settings.persistence_read_pool_size,
+        mmap_size=settings.persistence_mmap_size,
+        cache_size_kb=settings.persistence_cache_size_kb,
+        synchronous=settings.persistence_synchronous,
+    )
+
+
+def _open_redis():
+    """Shared Redis client for multi-replica deployments (Settings.persistence_redis_*)."""
+    import redis
+    settings = get_settings()
+    client = redis.Redis.from_url(settings.persistence_redis_url, health_check_interval=30)
+    logging.getLogger(__name__).info(f"Using Redis persistence at: {settings.persistence_redis_url} (codec: {settings.persistence_codec})")
+    return client
+
+
 # Global checkpointer for conversation state persistence
-try:
+settings = get_settings()
+_serializer = get_serializer(settings.persistence_codec)
+_conn = _write_buffer = _checkpoint_cache = _redis = _pg_pool = None
+
+if settings.persistence_backend == "redis":
+    _redis = _open_redis()
+elif settings.persistence_backend == "postgres":
+    from src.core.postgres_checkpointer import create_pool
+    # Opened on the app's event loop in open_persistence()
+    _pg_pool = create_pool(
+        settings.persistence_postgres_dsn,
+        min_size=settings.persistence_postgres_pool_min,
+        max_size=settings.persistence_postgres_pool_max,
+    )
+else:
+    try:
+        db_dir = os.path.dirname(settings.persistence_db_path)
+        os.makedirs(db_dir, exist_ok=True)
+        db_path = settings.persistence_db_path
+        _conn = _open_db(db_path)
+    except PermissionError:
+        settings = get_settings() # Re-fetch to be safe
+        logging.getLogger(__name__).error(f"Permission denied for {settings.persistence_db_path}. Falling back to {settings.persistence_fallback_path}.")
+        
+        db_dir = os.path.dirname(settings.persistence_fallback_path)
+        os.makedirs(db_dir, exist_ok=True)
+        db_path = settings.persistence_fallback_path
+        _conn = _open_db(db_path)
+
+    logging.getLogger(__name__).info(f"Using persistence DB at: {db_path} (codec: {settings.persistence_codec})")
+    # Write-behind queue shared by every saver on _conn (None = commit each put)
+    _write_buffer = (
+        CheckpointWriteBuffer(_conn, window_seconds=settings.persistence_write_behind_window_ms / 1000)
+        if settings.persistence_write_behind else None
+    )
+    # Latest checkpoint per thread, shared so every saver writes through the same LRU.
+    # SQLite only: with Redis, other replicas write the same threads.
+    _checkpoint_cache = (
+        CheckpointCache(max_bytes=settings.persistence_hot_cache_mb * 1024 * 1024)
+        if settings.persistence_hot_cache_mb > 0 else None
+    )
+
+
+# Every live saver, so turn-scoped state can be dropped when a turn ends
+_savers: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def _make_saver(context_manager=None):
+    """Checkpointer for the configured backend (Settings.persistence_backend)."""
+    saver = _new_saver(context_manager)
+    _savers.add(saver)
+    return saver
+
+
+def _new_saver(context_manager=None):
     settings = get_settings()
-    db_dir = os.path.dirname(settings.persistence_db_path)
-    os.makedirs(db_dir, exist_ok=True)
-    db_path = settings.persistence_db_path
-    _conn = sqlite3.connect(db_path, check_same_thread=False)
-except PermissionError:
-    settings = get_settings() # Re-fetch to be safe
-    logging.getLogger(__name__).error(f"Permission denied for {settings.persistence_db_path}. Falling back to {settings.persistence_fallback_path}.")
-    
-    db_dir = os.path.dirname(settings.persistence_fallback_path)
-    os.makedirs(db_dir, exist_ok=True)
-    db_path = settings.persistence_fallback_path
-    _conn = sqlite3.connect(db_path, check_same_thread=False)
+    if _pg_pool is not None:
+        from src.core.postgres_checkpointer import PostgresCheckpointSaver
+        return PostgresCheckpointSaver(_pg_pool, context_manager=context_manager, serializer=_serializer)
+    if _redis is not None:
+        from src.core.redis_checkpointer import RedisCheckpointSaver
+        return RedisCheckpointSaver(
+            _redis,
+            context_manager=context_manager,
+            serializer=_serializer,
+            prefix=settings.persistence_redis_prefix,
+            ttl_seconds=int(settings.persistence_redis_ttl_days * 86400) or None,
+            keep_last=settings.persistence_redis_keep_last,
+        )
+    return CustomSqliteSaver(
+        _conn,
+        context_manager=context_manager,
+        serializer=_serializer,
+        delta_mode=settings.persistence_delta_checkpoints,
+        keyframe_interval=settings.persistence_keyframe_interval,
+        message_store=settings.persistence_message_store,
+        blob_threshold=settings.persistence_blob_threshold,
+        write_buffer=_write_buffer,
+        cache=_checkpoint_cache,
+        # Threads archived by retention come back when a user returns to them
+        archive_dir=settings.retention_archive_dir if settings.retention_enabled else None,
+    )
+
+
+_checkpointer = _make_saver()
+
+_summary_cache = None
+if settings.compaction_summary_cache_size > 0:
+    from src.core.compactor import SummaryCache
+    _summary_cache = SummaryCache(max_entries=settings.compaction_summary_cache_size)
+
+_compaction_scheduler = None
+if settings.compaction_background:
+    from src.core.compaction_scheduler import CompactionScheduler
+    _compaction_scheduler = CompactionScheduler(max_concurrency=settings.compaction_background_concurrency)
+
+
+def get_checkpoint_cache():
+    return _checkpoint_cache
+
+
+def create_retention_worker():
+    """Background retention job for the global persistence DB (SQLite or PostgreSQL)."""
+    settings = get_settings()
+    if _pg_pool is not None:
+        from src.core.retention import PostgresRetentionWorker
+        return PostgresRetentionWorker(
+            _checkpointer,
+            keep_last=settings.retention_keep_last,
+            interval_seconds=settings.retention_interval_seconds,
+        )
+    if _conn is None:
+        return None  # Redis threads expire by TTL and are trimmed to keep_last on put
+    from src.core.retention import RetentionWorker
+    return RetentionWorker(
+        _checkpointer,
+        keep_last=settings.retention_keep_last,
+        idle_days=settings.retention_idle_days,
+        archive_dir=settings.retention_archive_dir,
+        interval_seconds=settings.retention_interval_seconds,
+        vacuum_pages=settings.retention_vacuum_pages,
+    )
+
+
+async def flush_checkpoints(thread_id: str):
+    """Commit the write-behind queue of a thread at the end of its turn and drop its turn state."""
+    from src.core import token_counter
+    try:
+        if _write_buffer:
+            await _write_buffer.aflush(thread_id)
+    finally:
+        # Cached agents keep their saver (and the shared token counters) for the life of the process
+        for saver in list(_savers):
+            release = getattr(saver, "release_thread", None)
+            if release:
+                release(thread_id)
+        token_counter.release_thread(thread_id)
 
-logging.getLogger(__name__).info(f"Using persistence DB at: {db_path}")
-_checkpointer = CustomSqliteSaver(_conn)
+
+async def _load_messages(thread_id: str) -> list:
+    """Latest uncompacted messages of a thread (background compaction input).
+
+    Reads through the shared saver, which has no context manager: no per-call
+    schema setup, and Postgres loads run on the pool's loop.
+    """
+    loaded = await _checkpointer.aget_tuple({"configurable": {"thread_id": thread_id}})
+    if loaded is None:
+        return []
+    return loaded.checkpoint.get("channel_values", {}).get("messages") or []
+
+
+def schedule_compaction(thread_id: str):
+    """Start the thread's background summary if its last load crossed the soft threshold.
+
+    Returns the summary task (None if nothing was scheduled); callers need not await it.
+    """
+    if _compaction_scheduler:
+        async def load_messages():
+            return await _load_messages(thread_id)
+
+        return _compaction_scheduler.run_after_turn(thread_id, load_messages)
+    return None
+
+
+async def open_persistence():
+    """Open pools that need the running event loop and create their schema."""
+    if _pg_pool is not None:
+        from src.core.postgres_checkpointer import open_pool
+        await open_pool(_pg_pool, toast_compression=get_settings().persistence_postgres_toast_compression or None)
+
+
+async def close_persistence():
+    """Drain queued checkpoint writes and close the persistence connections."""
+    if _compaction_scheduler:
+        await _compaction_scheduler.aclose()
+    if _write_buffer:
+        _write_buffer.flush()
+    if _conn is not None:
+        _conn.close()
+    if _redis is not None:
+        _redis.close()
+    if _pg_pool is not None:
+        await _pg_pool.close()
+
+
+# Compiled agents per (persona, model config). A graph holds no per-request
+# state (thread_id lives in `configurable`, Slack context in a ContextVar),
+# so one instance serves every event of its persona.
+_agent_cache: dict[tuple, object] = {}
+_agent_cache_settings = None  # fingerprint of the settings the cached agents were built with
+_agent_cache_lock = threading.Lock()
+_agent_cache_stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+
+def _settings_fingerprint(settings) -> str:
+    return hashlib.sha256(settings.model_dump_json().encode()).hexdigest()
+
+
+def clear_agent_cache():
+    """Drop compiled agents; the next create_agent rebuilds them."""
+    with _agent_cache_lock:
+        _agent_cache.clear()
+
+
+def get_agent_cache_stats() -> dict:
+    with _agent_cache_lock:
+        return {"agents": len(_agent_cache), **_agent_cache_stats}
 
 
 def create_agent(persona_type: str = "general"):
-    """Create a dynamic Deep Agent orchestrator.
-    
+    """Get the Deep Agent orchestrator for a persona, compiling it on first use.
+
+    Agents are cached per (persona, model, api key) and rebuilt when the
+    settings change (e.g. after get_settings.cache_clear()).
+
     Args:
         persona_type: 'general', 'code_review' (deprecated), 'automation', etc.
     """
+    global _agent_cache_settings
     settings = get_settings()
     # Fallback to general if persona not found (e.g. code_review which is now a skill)
     cfg = PERSONA_CONFIGS.get(persona_type, PERSONA_CONFIGS["general"])
-    
     model_name = cfg.get("model") or settings.main_agent_model
     api_key = cfg.get("api_key") or settings.openrouter_api_key
-    
+    key = (persona_type if persona_type in PERSONA_CONFIGS else "general", model_name, api_key)
+
+    fingerprint = _settings_fingerprint(settings)
+    with _agent_cache_lock:
+        if fingerprint != _agent_cache_settings:
+            if _agent_cache:
+                _agent_cache_stats["invalidations"] += 1
+                logging.getLogger(__name__).info("Settings changed, dropping cached agents")
+            _agent_cache.clear()
+            _agent_cache_settings = fingerprint
+        agent = _agent_cache.get(key)
+        if agent is not None:
+            _agent_cache_stats["hits"] += 1
+            return agent
+
+    # Built outside the lock (may fetch the model registry); a concurrent build of the same key keeps the first
+    start = time.perf_counter()
+    agent = _build_agent(cfg, model_name, api_key)
+    logging.getLogger(__name__).info(f"Compiled agent for persona={key[0]} model={model_name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+    with _agent_cache_lock:
+        if _agent_cache_settings == fingerprint:
+            agent = _agent_cache.setdefault(key, agent)
+        _agent_cache_stats["builds"] += 1
+    return agent
+
+
+def _build_agent(cfg: dict, model_name: str, api_key: str):
+    """Compile a Deep Agent orchestrator for a persona config."""
+    settings = get_settings()
+
     # Pre-instantiate model instance to handle API keys and providers safely
     model_instance = get_chat_model(model_name, api_key)
     
@@ -73,17 +322,25 @@ def create_agent(persona_type: str = "general"):
     # Context Management Strategy
     # User Request: "Auto Compact" instead of simple Trimming
     from src.core.compactor import AutoCompactor
+    from src.core.token_counter import get_token_counter
     
-    # We use a secondary model instance (or the same one) for summarization
-    # Ideally, use a cheaper/faster model for summary if possible, but reusing main model is fine for consistency.
+    # Summaries run on the cheaper compaction_model when configured
+    summary_model = get_chat_model(settings.compaction_model, api_key) if settings.compaction_model else model_instance
     compactor = AutoCompactor(
-        model=model_instance,
+        model=summary_model,
         max_tokens=safe_limit,
-        recent_messages_buffer=20  # Keep last 20 messages intact
+        recent_messages_buffer=20,  # Keep last 20 messages intact
+        soft_ratio=settings.compaction_soft_ratio,
+        scheduler=_compaction_scheduler,
+        token_counter=get_token_counter(model_name),
+        elide_min_chars=settings.compaction_elide_min_chars,
+        chunk_tokens=settings.compaction_chunk_tokens,
+        max_parallel=settings.compaction_max_parallel,
+        summary_cache=_summary_cache,
     )
 
     # Pass compactor to checkpointer for load-time optimization
-    checkpointer_instance = CustomSqliteSaver(_conn, context_manager=compactor)
+    checkpointer_instance = _make_saver(context_manager=compactor)
 
     return create_deep_agent(
         model=model_instance,
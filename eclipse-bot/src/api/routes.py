@@ -3,7 +3,8 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any
 
 from src.core.context import get_context
-from src.core.dispatcher import handle_event_trigger
+from src.core.dispatcher import handle_event_trigger, get_session_scheduler, get_admission_controller
+from src.agents.factory import get_checkpoint_cache
 
 router = APIRouter()
 
@@ -50,3 +51,42 @@ async def trigger_workflow(req: TriggerRequest, background_tasks: BackgroundTask
     )
 
     return {"status": "accepted", "message": "Workflow queued in background"}
+
+
+@router.get("/retention")
+async def retention_stats():
+    """Checkpoint retention stats (rows deleted, bytes reclaimed, time spent)."""
+    ctx = get_context()
+    if not ctx.retention:
+        raise HTTPException(status_code=404, detail="Retention is disabled")
+    return ctx.retention.get_stats()
+
+
+@router.get("/checkpoint-cache")
+async def checkpoint_cache_stats():
+    """Hot checkpoint cache stats (entries, bytes, hit/miss counters)."""
+    cache = get_checkpoint_cache()
+    if not cache:
+        raise HTTPException(status_code=404, detail="Checkpoint cache is disabled")
+    return cache.get_stats()
+
+
+@router.get("/sessions")
+async def session_stats():
+    """Session actor stats (active sessions, queued/merged/rejected events)."""
+    return get_session_scheduler().get_stats()
+
+
+@router.get("/admission")
+async def admission_stats():
+    """Agent run admission stats (active/waiting runs, shed count, average wait)."""
+    return get_admission_controller().get_stats()
+
+
+@router.get("/slack-dedup")
+async def slack_dedup_stats():
+    """Slack event dedup stats (events checked, duplicates and retries dropped)."""
+    ctx = get_context()
+    if not ctx.slack:
+        raise HTTPException(status_code=404, detail="Slack is not initialized")
+    return ctx.slack.get_dedup_stats()
@@ -23,9 +23,63 @@ class Settings(BaseSettings):
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
     
     # Persistence Configuration
+    persistence_backend: str = "sqlite"         # sqlite | redis | postgres (redis/postgres: shared state for multiple replicas)
     persistence_db_path: str = "/data4/db/eclipse_bot.db"
     persistence_fallback_path: str = "/tmp/db/eclipse_bot.db"
+    persistence_codec: str = "zstd"  # zstd | lz4 | zlib | none | pickle (legacy)
+    persistence_delta_checkpoints: bool = True  # Store only changed channels per step
+    persistence_keyframe_interval: int = 20     # Full checkpoint every N steps
+    persistence_message_store: bool = True      # Messages stored once in an append-only table, checkpoints keep seq ranges
+    persistence_blob_threshold: int = 2048      # Tool outputs this long stored once per content hash (message store only, 0 = off)
+    persistence_read_pool_size: int = 4         # Read-only WAL connections
+    persistence_mmap_size: int = 268435456      # PRAGMA mmap_size (bytes)
+    persistence_cache_size_kb: int = 65536      # PRAGMA cache_size (KiB per connection)
+    persistence_synchronous: str = "NORMAL"     # PRAGMA synchronous: OFF | NORMAL | FULL | EXTRA
+    persistence_write_behind: bool = False      # Queue puts and commit them per thread in one transaction
+    persistence_write_behind_window_ms: int = 250  # Max delay before a queued put is committed (0 = turn end only)
+    persistence_hot_cache_mb: int = 128         # In-process LRU of latest checkpoints (0 = disabled)
+    persistence_redis_url: str = "redis://localhost:6379/0"
+    persistence_redis_prefix: str = "eclipse:ckpt"
+    persistence_redis_ttl_days: float = 30.0    # Thread keys expire after this much inactivity (0 = never)
+    persistence_redis_keep_last: int = 20       # Checkpoints kept per thread (0 = all)
+    persistence_postgres_dsn: str = "postgresql://eclipse@localhost:5432/eclipse"
+    persistence_postgres_pool_min: int = 1
+    persistence_postgres_pool_max: int = 10     # Bounded: sessions wait for a connection beyond this
+    persistence_postgres_toast_compression: str = ""     # "" = store EXTERNAL (codec already compresses) | pglz | lz4 (with persistence_codec=none)
+
+    # Checkpoint Retention
+    retention_enabled: bool = True
+    retention_keep_last: int = 20               # Checkpoints kept per thread
+    retention_idle_days: float = 30.0           # Archive threads idle longer than this (restored on their next read)
+    retention_archive_dir: str = "/data4/db/archive"
+    retention_interval_seconds: int = 3600
+    retention_vacuum_pages: int = 2000          # Pages released per incremental_vacuum
     
+    # Context Compaction
+    compaction_background: bool = True          # Summarize past the soft threshold after the turn, swap in at next load
+    compaction_soft_ratio: float = 0.8          # Soft threshold as a fraction of the model's safe limit
+    compaction_background_concurrency: int = 2  # Background summaries running at once
+    compaction_elide_min_chars: int = 2000      # Old tool outputs this long become stubs before any LLM summary (0 = off)
+    compaction_chunk_tokens: int = 24000        # Summarizer input per call; longer histories are summarized map-reduce
+    compaction_max_parallel: int = 4            # Chunk summaries running concurrently
+    compaction_model: str = ""                  # Cheaper model for summaries (empty = the agent's own model)
+    compaction_summary_cache_size: int = 256    # Summaries cached by hash of input + model + prompt version (0 = off)
+
+    # Slack Events
+    slack_dedup_backend: str = "memory"         # memory | redis (persistence_redis_url; shared by replicas)
+    slack_dedup_ttl_seconds: float = 600.0      # Seen event ids / message ts kept this long
+    slack_drop_retries: bool = True             # Ignore x-slack-retry redeliveries (the original is already running)
+
+    # Dispatcher
+    session_max_backlog: int = 8                # Events queued per session while a run is in flight
+    session_idle_seconds: float = 300.0         # Session actors exit after this long without events
+    agent_max_concurrency: int = 8              # Agent runs streaming at once; the rest wait by priority (DM > mention > API)
+    agent_max_queue: int = 32                   # Runs waiting for a slot; beyond this the lowest priority is shed
+
+    # Startup
+    prewarm_enabled: bool = True                # Load model registry, compile agents, check p4/OpenSearch before connecting
+    prewarm_timeout_seconds: float = 60.0       # Per component; slow components are left to warm lazily
+
     # Models
     default_model: str = "moonshotai/kimi-k2.5" 
     
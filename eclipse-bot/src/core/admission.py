@@ -0,0 +1,132 @@
+"""Admission control for agent runs.
+
+Each admitted run holds one LLM stream (plus its sub-agents) for its whole
+duration. Without a cap a burst of mentions or API triggers opens dozens of
+streams at once, trips OpenRouter 429s and starves the event loop. Runs take
+a slot here first:
+
+- at most `max_concurrency` runs execute at once,
+- the rest wait in a priority queue (lower value first, FIFO within a
+  class), and are told their position whenever it changes,
+- a full queue sheds load: the newest lowest-priority waiter is rejected,
+  or the incoming run itself if nothing queued ranks below it.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run is shed because the wait queue is full."""
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded priority wait queue."""
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 32):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max(max_queue, 0)
+        self._active = 0
+        # heap of [priority, seq, future, on_position, last reported position]
+        self._waiters: list[list] = []
+        self._seq = itertools.count()
+        self._notifications: set[asyncio.Task] = set()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self, priority: int, on_position: Optional[PositionCallback] = None):
+        """Hold a run slot for the duration of the block. Raises AdmissionRejected when shed."""
+        await self._acquire(priority, on_position)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int, on_position: Optional[PositionCallback]):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            worst = max(self._waiters) if self._waiters else None
+            if worst is None or worst[0] <= priority:
+                self.shed += 1
+                raise AdmissionRejected(f"wait queue full ({self.max_queue})")
+            # Make room by shedding a lower-priority waiter instead
+            self._waiters.remove(worst)
+            heapq.heapify(self._waiters)
+            worst[2].set_exception(AdmissionRejected("preempted by a higher-priority run"))
+            self.shed += 1
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), future, on_position, None]
+        heapq.heappush(self._waiters, entry)
+        self.queued += 1
+        self._notify_positions()
+
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()  # slot was handed over just before the cancellation
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._notify_positions()
+            raise
+        finally:
+            self.wait_seconds += time.monotonic() - start
+        self.admitted += 1
+
+    def _release(self):
+        # Hand the slot straight to the best waiter so nothing can jump the queue
+        while self._waiters:
+            entry = heapq.heappop(self._waiters)
+            if not entry[2].done():
+                entry[2].set_result(None)
+                self._notify_positions()
+                return
+        self._active -= 1
+
+    def _notify_positions(self):
+        for position, entry in enumerate(sorted(self._waiters), start=1):
+            on_position = entry[3]
+            if on_position is None or entry[4] == position:
+                continue
+            entry[4] = position
+            task = asyncio.create_task(self._report(on_position, position))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    @staticmethod
+    async def _report(on_position: PositionCallback, position: int):
+        try:
+            await on_position(position)
+        except Exception as e:
+            logger.warning(f"Failed to report queue position {position}: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "avg_wait_seconds": round(self.wait_seconds / self.queued, 3) if self.queued else 0.0,
+        }
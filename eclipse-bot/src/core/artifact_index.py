@@ -0,0 +1,90 @@
+"""Deterministic artifact index kept across compaction.
+
+Asking the summarizer to "preserve file paths" is unreliable and makes every
+summary longer. Instead, the references that matter for follow-up questions
+are pulled out of each message with compiled regexes (and from tool call
+arguments): depot paths, changelist numbers, function names and OpenSearch
+queries. The index of everything summarized so far travels with the summary
+message (response_metadata) and is rendered as a compact block in it.
+"""
+
+import json
+import re
+from typing import Iterable, Optional
+
+from langchain_core.messages import BaseMessage
+
+ARTIFACTS_MARKER = "[ARTIFACT INDEX]"
+
+# kind -> (label, max entries kept; the most recently seen win)
+KINDS = {
+    "depot_paths": ("Depot paths", 80),
+    "changelists": ("CLs", 50),
+    "functions": ("Functions", 80),
+    "queries": ("OpenSearch queries", 20),
+}
+
+DEPOT_PATH = re.compile(r"//[A-Za-z0-9_.\-]+(?:/[A-Za-z0-9_.\-@#%*]+)+")
+CHANGELIST = re.compile(r"\b(?:CL|changelist|change)\s*[#:]?\s*(\d{4,9})\b", re.IGNORECASE)
+# Qualified C++ names (UInventory::FindChecked) and Python/C-style definitions
+QUALIFIED_FUNCTION = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*(?:::~?[A-Za-z_][A-Za-z0-9_]*)+)\s*\(")
+DEFINED_FUNCTION = re.compile(r"\bdef\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+
+# Tool arguments that are artifacts themselves
+_ARG_KINDS = {"path": "depot_paths", "changelist": "changelists"}
+_QUERY_TOOLS = {"search_logs"}
+
+
+def empty_index() -> dict[str, list[str]]:
+    return {kind: [] for kind in KINDS}
+
+
+def extract(message: BaseMessage) -> dict[str, list[str]]:
+    """Artifacts referenced by one message (content and tool call arguments)."""
+    index = empty_index()
+    content = message.content if isinstance(message.content, str) else " ".join(
+        block.get("text", "") if isinstance(block, dict) else str(block) for block in message.content or []
+    )
+    index["depot_paths"] += [p.rstrip(".,;:") for p in DEPOT_PATH.findall(content) if p != "//..."]
+    index["changelists"] += CHANGELIST.findall(content)
+    index["functions"] += QUALIFIED_FUNCTION.findall(content) + DEFINED_FUNCTION.findall(content)
+
+    for call in getattr(message, "tool_calls", None) or []:
+        args = call.get("args") or {}
+        for arg, kind in _ARG_KINDS.items():
+            value = args.get(arg)
+            if isinstance(value, str) and value and value != "//...":
+                index[kind].append(value)
+        if call.get("name") in _QUERY_TOOLS and isinstance(args.get("query"), str):
+            index["queries"].append(args["query"])
+    return merge(index)
+
+
+def merge(*indexes: Optional[dict]) -> dict[str, list[str]]:
+    """Ordered union; later occurrences move to the end and the oldest are capped off."""
+    merged = empty_index()
+    for index in indexes:
+        for kind, values in (index or {}).items():
+            if kind in merged:
+                merged[kind] += values
+    for kind, (_, limit) in KINDS.items():
+        seen = dict.fromkeys(reversed(merged[kind]))  # keep each value's last occurrence
+        merged[kind] = list(reversed(list(seen)))[-limit:]
+    return merged
+
+
+def index_messages(messages: Iterable[BaseMessage]) -> dict[str, list[str]]:
+    """Index a batch of messages; stubs of elided tool outputs carry their own index."""
+    return merge(*(m.response_metadata.get("artifacts") or extract(m) for m in messages))
+
+
+def render(index: Optional[dict]) -> str:
+    """Compact block appended to the summary message ('' when empty)."""
+    lines = []
+    for kind, (label, _) in KINDS.items():
+        values = (index or {}).get(kind)
+        if values:
+            # Queries may contain commas; quote them
+            rendered = [json.dumps(v, ensure_ascii=False) for v in values] if kind == "queries" else values
+            lines.append(f"- {label}: {', '.join(rendered)}")
+    return f"{ARTIFACTS_MARKER}\n" + "\n".join(lines) if lines else ""
@@ -0,0 +1,144 @@
+"""In-process LRU of the latest checkpoint per thread.
+
+Follow-up messages in an active Slack thread reload the same checkpoint the
+previous turn just wrote. Keeping the deserialized state of each thread's
+latest checkpoint in memory skips the SQLite read and the decode entirely.
+
+The cache is write-through: every `put` replaces the thread's entry, so it is
+only correct if all savers on the DB share one instance (see factory).
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+def approx_size(value: Any, _depth: int = 0) -> int:
+    """Rough in-memory footprint in bytes; dominated by message contents."""
+    if _depth > 6:
+        return 64
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value) + 48
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 56 + sum(approx_size(v, _depth + 1) for v in value)
+    if hasattr(value, "content"):  # LangChain messages
+        size = 200 + approx_size(value.content, _depth + 1)
+        tool_calls = getattr(value, "tool_calls", None)
+        if tool_calls:
+            size += approx_size(tool_calls, _depth + 1)
+        return size
+    return 32
+
+
+def copy_state(checkpoint: dict) -> dict:
+    """Copy down to the channel lists so callers can't mutate the cached state."""
+    channel_values = {
+        k: list(v) if isinstance(v, list) else v
+        for k, v in checkpoint.get("channel_values", {}).items()
+    }
+    return {**checkpoint, "channel_values": channel_values}
+
+
+@dataclass
+class CachedCheckpoint:
+    thread_ts: str
+    parent_ts: Optional[str]
+    checkpoint: dict
+    metadata: dict
+    depth: int
+    # None = unknown, read them from the writes table on the next hit
+    pending_writes: Optional[list]
+    size: int
+    # Seqs of the messages in the message store (None = inline messages)
+    message_seqs: Optional[list] = None
+
+
+class CheckpointCache:
+    """Thread-safe LRU keyed by thread_id, bounded by approximate bytes."""
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedCheckpoint]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, thread_id: str, thread_ts: Optional[str] = None) -> Optional[CachedCheckpoint]:
+        """Latest entry of the thread; with `thread_ts`, only if that is the cached one."""
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is None or (thread_ts and entry.thread_ts != thread_ts):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(thread_id)
+            self.hits += 1
+            return entry
+
+    def put(
+        self,
+        thread_id: str,
+        thread_ts: str,
+        parent_ts: Optional[str],
+        checkpoint: dict,
+        metadata: dict,
+        depth: int,
+        pending_writes: Optional[list] = None,
+        message_seqs: Optional[list] = None,
+    ):
+        """Store a checkpoint unless a newer one of the thread is already cached."""
+        size = approx_size(checkpoint.get("channel_values", {}))
+        if size > self.max_bytes:
+            self.invalidate(thread_id)
+            return
+        entry = CachedCheckpoint(
+            thread_ts, parent_ts, copy_state(checkpoint), dict(metadata), depth, pending_writes, size, message_seqs
+        )
+        with self._lock:
+            old = self._entries.get(thread_id)
+            if old is not None:
+                # Checkpoint ids are time-ordered; never replace the latest with an older one
+                if old.thread_ts > thread_ts:
+                    return
+                self._bytes -= old.size
+            self._entries[thread_id] = entry
+            self._entries.move_to_end(thread_id)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def set_pending_writes(self, thread_id: str, thread_ts: str, pending_writes: Optional[list]):
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is not None and entry.thread_ts == thread_ts:
+                entry.pending_writes = pending_writes
+
+    def invalidate(self, thread_id: Optional[str] = None):
+        """Drop one thread, or everything."""
+        with self._lock:
+            if thread_id is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            entry = self._entries.pop(thread_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+            }
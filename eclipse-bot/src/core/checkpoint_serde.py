@@ -0,0 +1,154 @@
+"""Checkpoint serialization for CustomSqliteSaver.
+
+Every row written by a compact serializer starts with a format version byte:
+
+    [FORMAT_V1][codec id][type length][type tag][compressed payload]
+
+The payload is LangGraph's msgpack encoding (JsonPlusSerializer), which stores
+LangChain messages as compact constructor records instead of pickled objects.
+Legacy rows written with plain ``pickle.dumps`` start with the pickle PROTO
+opcode (0x80) and are still read transparently.
+"""
+
+import logging
+import pickle
+import zlib
+from typing import Any, Optional
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional codec
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover - optional codec
+    lz4_frame = None
+
+# Format version bytes (first byte of every stored blob)
+FORMAT_V1 = 0x01
+PICKLE_PROTO = 0x80  # Legacy rows: pickle protocol >= 2 always starts with PROTO
+
+# Codec ids (second byte of a FORMAT_V1 blob)
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_LZ4 = 3
+
+CODEC_IDS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD, "lz4": CODEC_LZ4}
+
+
+class CheckpointSerializer:
+    """Converts checkpoint objects to bytes and back."""
+
+    name = "base"
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class PickleSerializer(CheckpointSerializer):
+    """Legacy format: plain pickle, no header, no compression."""
+
+    name = "pickle"
+
+    def dumps(self, obj: Any) -> bytes:
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        # Still able to read compact rows if the codec is switched back
+        return loads_any(data)
+
+
+class CompactSerializer(CheckpointSerializer):
+    """Msgpack encoding + block compression, with a format version byte per row."""
+
+    def __init__(self, codec: str = "zstd", level: Optional[int] = None):
+        """
+        Args:
+            codec: 'zstd', 'lz4', 'zlib' or 'none'. Falls back to zlib if the
+                   requested library is not installed.
+            level: Compression level (codec specific, None = codec default).
+        """
+        if codec == "zstd" and zstandard is None:
+            logger.warning("zstandard not installed. Falling back to zlib checkpoint compression.")
+            codec = "zlib"
+        if codec == "lz4" and lz4_frame is None:
+            logger.warning("lz4 not installed. Falling back to zlib checkpoint compression.")
+            codec = "zlib"
+        if codec not in CODEC_IDS:
+            raise ValueError(f"Unknown checkpoint codec: {codec}")
+
+        self.name = codec
+        self.codec_id = CODEC_IDS[codec]
+        self.level = level
+        self.serde = JsonPlusSerializer(pickle_fallback=True)
+
+    def _compress(self, payload: bytes) -> bytes:
+        # zstd contexts are not thread-safe, so build one per call (cheap)
+        if self.codec_id == CODEC_ZSTD:
+            return zstandard.ZstdCompressor(level=self.level if self.level is not None else 3).compress(payload)
+        if self.codec_id == CODEC_LZ4:
+            return lz4_frame.compress(payload, compression_level=self.level or 0)
+        if self.codec_id == CODEC_ZLIB:
+            return zlib.compress(payload, self.level if self.level is not None else 6)
+        return payload
+
+    def dumps(self, obj: Any) -> bytes:
+        type_, payload = self.serde.dumps_typed(obj)
+        tag = type_.encode()
+        header = bytes([FORMAT_V1, self.codec_id, len(tag)]) + tag
+        return header + self._compress(payload)
+
+    def loads(self, data: bytes) -> Any:
+        return loads_any(data, self.serde)
+
+
+def _decompress(codec_id: int, payload: bytes) -> bytes:
+    if codec_id == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Checkpoint row is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if codec_id == CODEC_LZ4:
+        if lz4_frame is None:
+            raise RuntimeError("Checkpoint row is lz4-compressed but lz4 is not installed")
+        return lz4_frame.decompress(payload)
+    if codec_id == CODEC_ZLIB:
+        return zlib.decompress(payload)
+    if codec_id == CODEC_NONE:
+        return payload
+    raise ValueError(f"Unknown checkpoint codec id: {codec_id}")
+
+
+_default_serde = JsonPlusSerializer(pickle_fallback=True)
+
+
+def loads_any(data: bytes, serde: Optional[JsonPlusSerializer] = None) -> Any:
+    """Decode a blob written by any known format (FORMAT_V1 or legacy pickle)."""
+    if not data:
+        return None
+    version = data[0]
+    if version == PICKLE_PROTO:
+        return pickle.loads(data)
+    if version != FORMAT_V1:
+        raise ValueError(f"Unknown checkpoint format version: {version:#x}")
+
+    codec_id = data[1]
+    tag_len = data[2]
+    type_ = data[3:3 + tag_len].decode()
+    payload = _decompress(codec_id, data[3 + tag_len:])
+    return (serde or _default_serde).loads_typed((type_, payload))
+
+
+def get_serializer(name: str) -> CheckpointSerializer:
+    """Build a serializer from its config name ('pickle', 'zstd', 'lz4', 'zlib', 'none')."""
+    if name == "pickle":
+        return PickleSerializer()
+    return CompactSerializer(codec=name)
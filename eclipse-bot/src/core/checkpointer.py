@@ -3,47 +3,489 @@
 This module implements a persistent checkpointer using sqlite3,
 compatible with LangGraph's BaseCheckpointSaver interface.
 It avoids dependency issues with missing 'langgraph.checkpoint.sqlite'.
+Row encoding is delegated to a pluggable serializer (see checkpoint_serde).
+
+Delta mode: instead of rewriting every channel value on every LangGraph step,
+a 'delta' row stores only the channels that changed since its parent (and
+only the appended tail for list channels such as `messages`). Every
+`keyframe_interval` steps a 'full' row is written, and reads rebuild the state
+from the nearest keyframe.
+
+Compaction: when the context manager (AutoCompactor) rewrites the messages of
+the latest checkpoint at load time, the result is stored as a new checkpoint
+(metadata `compaction: True`) whose parent is the uncompacted one, so the same
+history is summarized only once instead of on every load.
+
+Message store: with `message_store`, messages are appended to an event-sourced
+`messages` table (thread_id, seq, message_id, role, compressed payload) and a
+checkpoint keeps only ranges of seqs in place of the list. A step writes only
+its new messages, and loading a compacted checkpoint range-scans the kept tail
+without ever decoding the summarized prefix.
+
+Blobs: tool outputs of at least `blob_threshold` characters (p4 diffs, file
+bodies) are kept once in a `blobs` table keyed by the SHA-256 of the content;
+the message row stores the message without its content plus the digest. A CL
+reviewed in several threads is stored once. When compaction elides an old
+tool output, its stub row pins the full output in the same table (by the
+digest in the stub), so it can still be fetched with `get_blob`. Blobs are
+mark-and-swept when the last message row referencing them is pruned or deleted.
+
+Write-behind: with a shared `CheckpointWriteBuffer`, put/put_writes only queue
+their statements. A thread's queue is committed in one transaction when its
+window expires, at the end of the agent turn (`flush`), before any read of
+that thread, and on shutdown.
 """
 
-import pickle
+import re
+import hashlib
+import logging
+import json
+import time
 import sqlite3
 import asyncio
-from typing import Any, Optional, Iterator, AsyncIterator
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Optional, Iterator, AsyncIterator, Sequence
 from contextlib import contextmanager
 
 from langchain_core.runnables import RunnableConfig
-from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointTuple, CheckpointMetadata
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointTuple, CheckpointMetadata, WRITES_IDX_MAP
+from langgraph.checkpoint.base.id import uuid6
+
+from src.core.checkpoint_serde import CheckpointSerializer, CompactSerializer
+from src.core.sqlite_pool import as_connection_manager
+from src.core.checkpoint_cache import CheckpointCache, copy_state
+
+logger = logging.getLogger(__name__)
+
+# Row kinds ('full' rows are self-contained; NULL = legacy full row)
+KIND_FULL = "full"
+KIND_DELTA = "delta"
+
+# Metadata keys usable in list(filter=...) (embedded literally so expression indexes apply)
+_METADATA_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Rows fetched per worker-thread hop in alist()
+ALIST_PAGE_SIZE = 50
+
+_SELECT_COLUMNS = "checkpoint, metadata, parent_ts, thread_ts, kind, depth, thread_id"
+
+# Channel kept in the message store, and the marker replacing its list in stored checkpoints
+MESSAGES_CHANNEL = "messages"
+MESSAGE_REF = "__message_seqs__"
+
+# Tool outputs at least this long (characters) go to the content-addressed blob table
+BLOB_THRESHOLD = 2048
+
+
+def _is_extension(base: list, value: list) -> bool:
+    """True if `value` is `base` with extra items appended (identity fast path)."""
+    if len(value) < len(base):
+        return False
+    return all(a is b or a == b for a, b in zip(base, value))
+
+
+def _to_ranges(seqs: list[int]) -> list[list[int]]:
+    """[1, 2, 3, 7, 8] -> [[1, 3], [7, 8]] (order preserved)."""
+    ranges: list[list[int]] = []
+    for seq in seqs:
+        if ranges and seq == ranges[-1][1] + 1:
+            ranges[-1][1] = seq
+        else:
+            ranges.append([seq, seq])
+    return ranges
+
+
+def _from_ranges(ranges: list[list[int]]) -> list[int]:
+    return [seq for start, end in ranges for seq in range(start, end + 1)]
+
+
+class CheckpointWriteBuffer:
+    """Write-behind queue of checkpoint statements, shared by all savers on one DB."""
+
+    def __init__(self, conn, window_seconds: float = 0.25, max_pending: int = 200):
+        """
+        Args:
+            conn: Same connection / manager the savers use.
+            window_seconds: Commit a thread's queue this long after its first
+                  queued statement. 0 = only at turn end, reads and shutdown.
+            max_pending: Commit immediately once a thread has this many statements.
+        """
+        self.db = as_connection_manager(conn)
+        self.window_seconds = window_seconds
+        self.max_pending = max(max_pending, 1)
+        self._pending: dict[str, list[tuple[str, Any, bool]]] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._errors: dict[str, BaseException] = {}  # failed background commits, raised by the next flush
+        # Savers queueing here; their in-memory state of a thread is dropped when its batch fails
+        self._savers: "weakref.WeakSet" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.stats = {"statements": 0, "transactions": 0, "failed": 0}
+
+    def add(self, thread_id: str, sql: str, params: Any, many: bool = False):
+        """Queue one statement (executemany if `many`). Never waits for a commit."""
+        with self._lock:
+            ops = self._pending.setdefault(thread_id, [])
+            ops.append((sql, params, many))
+            full = len(ops) >= self.max_pending
+            if not full and self.window_seconds > 0 and thread_id not in self._timers:
+                timer = threading.Timer(self.window_seconds, self._flush_background, args=(thread_id,))
+                timer.daemon = True
+                self._timers[thread_id] = timer
+                timer.start()
+        if full:
+            self._flush_background(thread_id)
+
+    def register(self, saver):
+        """Track a saver so a dropped batch also drops what it remembers about the thread."""
+        self._savers.add(saver)
+
+    def _forget(self, thread_ids: list[str]):
+        # The savers' delta base, next seqs and hot cache entry describe the dropped rows;
+        # without them the next put writes a keyframe against what is actually on disk.
+        for saver in list(self._savers):
+            for thread_id in thread_ids:
+                saver.forget_thread(thread_id)
+
+    def _flush_background(self, thread_id: str):
+        """Hand a thread's queue to the writer without waiting (window timer / max_pending)."""
+        try:
+            future, _ = self._submit(thread_id)
+        except Exception as e:
+            self._record_failure(thread_id, e)
+            return
+        if future:
+            def _done(f):
+                if f.exception() is not None:
+                    self._record_failure(thread_id, f.exception())
+
+            future.add_done_callback(_done)
+
+    def _record_failure(self, thread_id: str, error: BaseException):
+        logger.error(f"Write-behind commit for thread {thread_id} failed, batch dropped: {error}")
+        self._forget([thread_id])
+        with self._lock:
+            self.stats["failed"] += 1
+            self._errors.setdefault(thread_id, error)
+
+    def _raise_failure(self, thread_id: Optional[str]):
+        with self._lock:
+            if thread_id:
+                error = self._errors.pop(thread_id, None)
+            else:
+                errors, self._errors = self._errors, {}
+                error = next(iter(errors.values()), None)
+        if error is not None:
+            raise error
+
+    def has_pending(self, thread_id: Optional[str] = None) -> bool:
+        with self._lock:
+            return bool(self._pending.get(thread_id) if thread_id else self._pending)
+
+    def _submit(self, thread_id: Optional[str]):
+        """Take the queued statements and hand them to the writer as one transaction.
+
+        Returns (future or None if nothing was queued, thread ids in the batch).
+
+        Runs under the lock so batches of a thread reach the writer in queue order.
+        """
+        with self._lock:
+            thread_ids = [thread_id] if thread_id else list(self._pending)
+            ops = []
+            for tid in thread_ids:
+                ops.extend(self._pending.pop(tid, []))
+                timer = self._timers.pop(tid, None)
+                if timer:
+                    timer.cancel()
+            if not ops:
+                return None, thread_ids
+
+            def _run(conn: sqlite3.Connection):
+                for sql, params, many in ops:
+                    if many:
+                        conn.executemany(sql, params)
+                    else:
+                        conn.execute(sql, params)
+
+            self.stats["statements"] += len(ops)
+            self.stats["transactions"] += 1
+            return self.db.submit(_run), thread_ids
 
-class CustomSqliteSaver(BaseCheckpointSaver):
+    def flush(self, thread_id: Optional[str] = None):
+        """Commit the queue of one thread (or all threads) and wait for it.
+
+        Also raises the first failed background commit of those threads, so a
+        dropped batch reaches the caller at turn end instead of only the log.
+        """
+        future, thread_ids = self._submit(thread_id)
+        if future:
+            try:
+                future.result()
+            except Exception:
+                self._forget(thread_ids)
+                raise
+        self._raise_failure(thread_id)
+
+    async def aflush(self, thread_id: Optional[str] = None):
+        future, thread_ids = self._submit(thread_id)
+        if future:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                self._forget(thread_ids)
+                raise
+        self._raise_failure(thread_id)
+
+
+class CompactionMixin:
+    """Load-time context management shared by the checkpoint savers.
+
+    Expects `context_manager`, `persist_compaction` and `put()` on the saver.
+    """
+
+    @staticmethod
+    def _make_config(thread_id: str, thread_ts: str) -> RunnableConfig:
+        # checkpoint_id is what LangGraph reads; thread_ts is kept for our own callers
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": "",
+                "checkpoint_id": thread_ts,
+                "thread_ts": thread_ts,
+            }
+        }
+
+    def _apply_context_manager(self, result: CheckpointTuple, is_latest: bool) -> CheckpointTuple:
+        """Apply Context Management (Trimming or Auto-Compacting) at Load Time."""
+        checkpoint = result.checkpoint
+        if not (self.context_manager and "channel_values" in checkpoint and "messages" in checkpoint["channel_values"]):
+            return result
+        try:
+            original_msgs = checkpoint["channel_values"]["messages"]
+            # invoke() handles both LangChain Trimmer and our AutoCompactor
+            if getattr(self.context_manager, "thread_aware", False):
+                # AutoCompactor: background summaries are prepared per thread
+                trimmed_msgs = self.context_manager.invoke(original_msgs, thread_id=result.config["configurable"]["thread_id"])
+            else:
+                trimmed_msgs = self.context_manager.invoke(original_msgs)
+            checkpoint["channel_values"]["messages"] = trimmed_msgs
+
+            # Persist the result so this stretch of history is never summarized again.
+            # Only for the latest checkpoint (not time travel) and when no pending
+            # writes are tied to its id.
+            changed = len(trimmed_msgs) != len(original_msgs) or any(
+                a is not b for a, b in zip(trimmed_msgs, original_msgs)
+            )
+            if self.persist_compaction and changed and is_latest and not result.pending_writes:
+                return self._store_compaction(result)
+        except Exception as e:
+            # Fallback if processing fails
+            logger.warning(f"Context management on load failed for {result.config['configurable']['thread_id']}: {e}")
+        return result
+
+    def _store_compaction(self, loaded: CheckpointTuple) -> CheckpointTuple:
+        """Write the compacted state as a child checkpoint of the one just loaded."""
+        thread_id = loaded.config["configurable"]["thread_id"]
+        parent_ts = loaded.config["configurable"]["checkpoint_id"]
+        step = loaded.metadata.get("step", -1)
+
+        checkpoint = {
+            **loaded.checkpoint,
+            "id": str(uuid6(clock_seq=step)),
+            "ts": datetime.now(timezone.utc).isoformat(),
+        }
+        metadata = {"source": "update", "step": step, "parents": {}, "compaction": True}
+        # Only the messages channel differs from the parent
+        config = self.put(self._make_config(thread_id, parent_ts), checkpoint, metadata, {"messages": None})
+        logger.info(f"Stored compacted history for {thread_id} as checkpoint {checkpoint['id']}")
+        return CheckpointTuple(config, checkpoint, metadata, loaded.config, [])
+
+
+class CustomSqliteSaver(CompactionMixin, BaseCheckpointSaver):
     """A checkpoint saver that stores state in a SQLite database."""
 
-    def __init__(self, conn: sqlite3.Connection, context_manager=None):
+    def __init__(
+        self,
+        conn,
+        context_manager=None,
+        serializer: Optional[CheckpointSerializer] = None,
+        delta_mode: bool = False,
+        keyframe_interval: int = 20,
+        persist_compaction: bool = True,
+        write_buffer: Optional[CheckpointWriteBuffer] = None,
+        cache: Optional[CheckpointCache] = None,
+        message_store: bool = False,
+        blob_threshold: int = BLOB_THRESHOLD,
+        max_threads: int = 64,
+        archive_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            conn: SqliteConnectionManager (writer thread + read pool) or a plain
+                  sqlite3.Connection, which is wrapped in a SharedConnection.
+            persist_compaction: Store the context manager's output as a checkpoint.
+                  Disable for managers that only trim the prompt view.
+            write_buffer: Queue writes instead of committing each one (write-behind).
+                  Must be shared by all savers on the same DB.
+            cache: Hot LRU of the latest checkpoint per thread (write-through).
+                  Must be shared by all savers on the same DB.
+            message_store: Store messages once in the `messages` table and keep
+                  only seq ranges in checkpoints. Rows of either format stay readable.
+            blob_threshold: Store tool outputs of at least this many characters once
+                  per content hash (message store only, 0 = disabled).
+            max_threads: Threads whose delta base (last stored state) is kept. Only
+                  needed from get_tuple to the end of a turn (`release_thread`); this
+                  bounds savers whose callers never release. An evicted thread's next
+                  put is written as a keyframe.
+            archive_dir: Retention's cold-file directory. A thread with no checkpoint
+                  is restored from its archive the next time it is read.
+        """
         super().__init__()
-        self.conn = conn
+        self.db = as_connection_manager(conn)
         self.context_manager = context_manager  # Trimmer or AutoCompactor
+        # Compact msgpack+zstd by default; legacy pickle rows are still readable
+        self.serializer = serializer or CompactSerializer()
+        self.delta_mode = delta_mode
+        self.keyframe_interval = max(keyframe_interval, 1)
+        self.persist_compaction = persist_compaction
+        self.write_buffer = write_buffer
+        if write_buffer:
+            write_buffer.register(self)
+        self.cache = cache
+        self.message_store = message_store
+        self.blob_threshold = blob_threshold
+        # Last stored (uncompacted) state per thread:
+        # thread_id -> (thread_ts, channel_values, depth, message seqs or None)
+        # Deltas are only computed against this, never against the compacted view.
+        self._last_state: "OrderedDict[str, tuple[str, dict, int, Optional[list[int]]]]" = OrderedDict()
+        # Next free message seq per thread (re-read from the DB at every get_tuple)
+        self._next_seqs: "OrderedDict[str, int]" = OrderedDict()
+        self.max_threads = max(max_threads, 1)
+        self.archive_dir = archive_dir
+        # get_tuple/put run on worker threads, release_thread on the event loop
+        self._state_lock = threading.Lock()
         self._setup()
 
     def _setup(self):
-        with self.conn:
-            # Enable WAL mode for better concurrency (Readers don't block Writers)
-            self.conn.execute("PRAGMA journal_mode=WAL;")
-            
-            self.conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS checkpoints (
-                    thread_id TEXT,
-                    thread_ts TEXT,
-                    parent_ts TEXT,
-                    checkpoint BLOB,
-                    metadata BLOB,
-                    PRIMARY KEY (thread_id, thread_ts)
-                );
-                """
+        self.db.write(self._create_schema)
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        # WAL mode lets readers proceed while the writer commits
+        conn.execute("PRAGMA journal_mode=WAL;")
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT,
+                thread_ts TEXT,
+                parent_ts TEXT,
+                checkpoint BLOB,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, thread_ts)
+            );
+            """
+        )
+        # Migrate tables created before delta mode existed
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(checkpoints)")}
+        if "kind" not in columns:
+            conn.execute("ALTER TABLE checkpoints ADD COLUMN kind TEXT")
+        if "depth" not in columns:
+            conn.execute("ALTER TABLE checkpoints ADD COLUMN depth INTEGER DEFAULT 0")
+        if "metadata_json" not in columns:
+            conn.execute("ALTER TABLE checkpoints ADD COLUMN metadata_json TEXT")
+        if "created_at" not in columns:
+            # Unix time of the put; NULL for rows written before retention existed
+            conn.execute("ALTER TABLE checkpoints ADD COLUMN created_at REAL")
+
+        # Metadata is mirrored as JSON so list() filters never decode blobs
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_checkpoints_source ON checkpoints "
+            "(thread_id, json_extract(metadata_json, '$.source'))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_checkpoints_step ON checkpoints "
+            "(thread_id, json_extract(metadata_json, '$.step'))"
+        )
+        self._backfill_metadata_json(conn)
+
+        # Pending writes of (possibly interrupted) super-steps
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT,
+                checkpoint_id TEXT,
+                task_id TEXT,
+                idx INTEGER,
+                channel TEXT,
+                value BLOB,
+                task_path TEXT DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_id, task_id, idx)
+            );
+            """
+        )
+
+        # Append-only message log referenced by seq ranges (message_store)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                thread_id TEXT,
+                seq INTEGER,
+                message_id TEXT,
+                role TEXT,
+                payload BLOB,
+                PRIMARY KEY (thread_id, seq)
+            );
+            """
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "blob_digest" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN blob_digest TEXT")
+        # Stubs of elided tool outputs pin the full output's blob without loading it
+        if "elided_digest" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN elided_digest TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_blob ON messages (blob_digest) WHERE blob_digest IS NOT NULL"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_elided ON messages (elided_digest) WHERE elided_digest IS NOT NULL"
+        )
+
+        # Large tool outputs, shared by every message row (of any thread) with the same content
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                payload BLOB,
+                size INTEGER,
+                created_at REAL
+            );
+            """
+        )
+
+    def _backfill_metadata_json(self, conn: sqlite3.Connection, batch_size: int = 500):
+        """One-time migration: mirror metadata of rows written before metadata_json existed."""
+        while True:
+            rows = conn.execute(
+                "SELECT thread_id, thread_ts, metadata FROM checkpoints WHERE metadata_json IS NULL LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+            if not rows:
+                return
+            updates = []
+            for thread_id, thread_ts, blob in rows:
+                try:
+                    metadata = self.serializer.loads(blob) if blob else {}
+                except Exception:
+                    metadata = {}
+                updates.append((json.dumps(metadata, default=str, ensure_ascii=False), thread_id, thread_ts))
+            conn.executemany(
+                "UPDATE checkpoints SET metadata_json = ? WHERE thread_id = ? AND thread_ts = ?", updates
             )
 
     async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         """Asynchronous version of get_tuple."""
-        import asyncio
         return await asyncio.to_thread(self.get_tuple, config)
 
     async def aput(
@@ -54,18 +496,43 @@ class CustomSqliteSaver(BaseCheckpointSaver):
         new_versions: dict[str, Any],
     ) -> RunnableConfig:
         """Asynchronous version of put."""
+        # Encoding and the first seq read block too, even when writes are only queued
         return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
 
     async def aput_writes(
         self,
         config: RunnableConfig,
-        writes: list[tuple[str, Any]],
+        writes: Sequence[tuple[str, Any]],
         task_id: str,
+        task_path: str = "",
     ) -> None:
         """Store intermediate writes asynchronously."""
-        # For now, we delegate to a sync dummy or just pass as we don't fully support detailed write tracking in this simple SQLite version yet.
-        # But we must implement it to satisfy the abstract base class.
-        pass
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def _execute(self, thread_id: str, statements: list[tuple[str, Any, bool]]):
+        """Run (sql, params, many) statements in one transaction, or queue them in write-behind mode."""
+        if self.write_buffer:
+            for sql, params, many in statements:
+                self.write_buffer.add(thread_id, sql, params, many)
+            return
+
+        def _run(conn: sqlite3.Connection):
+            for sql, params, many in statements:
+                if many:
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params)
+
+        self.db.write(_run)
+
+    def flush(self, thread_id: Optional[str] = None):
+        """Commit queued write-behind statements (no-op without a write buffer)."""
+        if self.write_buffer:
+            self.write_buffer.flush(thread_id)
+
+    async def aflush(self, thread_id: Optional[str] = None):
+        if self.write_buffer:
+            await self.write_buffer.aflush(thread_id)
 
     async def alist(
         self,
@@ -75,55 +542,369 @@ class CustomSqliteSaver(BaseCheckpointSaver):
         before: Optional[RunnableConfig] = None,
         limit: Optional[int] = None,
     ) -> AsyncIterator[CheckpointTuple]:
-        """List checkpoints asynchronously."""
-        import asyncio
-        # We assume the sync .list() is implemented (or empty) and wrap it.
-        # Since .list creates a generator, wrapping it in to_thread is tricky.
-        # For this simple bot, we might not need full history listing. 
-        # But let's return an empty async iterator to satisfy the interface if real list is not critical.
-        async def _empty_gen():
-            if False: yield
-        return _empty_gen()
+        """List checkpoints asynchronously, one page per worker-thread hop."""
+        rows = self.list(config, filter=filter, before=before, limit=limit)
+        try:
+            while True:
+                page = await asyncio.to_thread(lambda: [t for _, t in zip(range(ALIST_PAGE_SIZE), rows)])
+                for item in page:
+                    yield item
+                if len(page) < ALIST_PAGE_SIZE:
+                    return
+        finally:
+            rows.close()
 
     def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
         thread_id = config["configurable"]["thread_id"]
-        thread_ts = config["configurable"].get("thread_ts")
-        
-        cursor = self.conn.cursor()
-        if thread_ts:
-            cursor.execute(
-                "SELECT checkpoint, metadata, parent_ts, thread_ts FROM checkpoints WHERE thread_id = ? AND thread_ts = ?",
-                (thread_id, thread_ts),
-            )
-        else:
-            cursor.execute(
-                "SELECT checkpoint, metadata, parent_ts, thread_ts FROM checkpoints WHERE thread_id = ? ORDER BY thread_ts DESC LIMIT 1",
-                (thread_id,),
+        thread_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        if self.message_store:
+            # Every turn starts here. Other savers on this DB (another persona's agent,
+            # retention restore) may have appended to the thread since our last put.
+            with self._state_lock:
+                self._next_seqs.pop(thread_id, None)
+            self._next_seq(thread_id)
+
+        loaded = self._load_cached(thread_id, thread_ts) or self._load(thread_id, thread_ts)
+        if not loaded and not thread_ts and self._restore_archived(thread_id):
+            loaded = self._load(thread_id, None)
+        if loaded:
+            result, depth, seqs = loaded
+            checkpoint = result.checkpoint
+
+            # Remember the stored state so the next put can be written as a delta
+            self._remember(thread_id, (
+                result.config["configurable"]["checkpoint_id"], dict(checkpoint["channel_values"]), depth, seqs
+            ))
+            return self._apply_context_manager(result, is_latest=not thread_ts)
+        return None
+
+    def _restore_archived(self, thread_id: str) -> bool:
+        """Bring back a thread that retention archived (idle threads are moved to cold files)."""
+        if not self.archive_dir:
+            return False
+        from src.core.retention import restore_archived_thread  # retention imports this module
+        if not restore_archived_thread(self, self.archive_dir, thread_id):
+            return False
+        if self.message_store:
+            # The restored rows are above the seq read at the start of get_tuple
+            with self._state_lock:
+                self._next_seqs.pop(thread_id, None)
+            self._next_seq(thread_id)
+        return True
+
+    def _load_cached(self, thread_id: str, thread_ts: Optional[str]) -> Optional[tuple[CheckpointTuple, int, Optional[list[int]]]]:
+        """Serve the thread's latest checkpoint from the hot cache (no SQL, no decode)."""
+        if not self.cache:
+            return None
+        entry = self.cache.get(thread_id, thread_ts)
+        if entry is None:
+            return None
+        pending_writes = entry.pending_writes
+        if pending_writes is None:
+            self.flush(thread_id)
+            with self.db.read() as conn:
+                pending_writes = self._load_writes(conn, thread_id, entry.thread_ts)
+            self.cache.set_pending_writes(thread_id, entry.thread_ts, pending_writes)
+        result = CheckpointTuple(
+            self._make_config(thread_id, entry.thread_ts),
+            copy_state(entry.checkpoint),
+            dict(entry.metadata),
+            self._make_config(thread_id, entry.parent_ts) if entry.parent_ts else None,
+            list(pending_writes),
+        )
+        return result, entry.depth, entry.message_seqs
+
+    def _load(self, thread_id: str, thread_ts: Optional[str]) -> Optional[tuple[CheckpointTuple, int, Optional[list[int]]]]:
+        self.flush(thread_id)
+        with self.db.read() as conn:
+            if thread_ts:
+                row = conn.execute(
+                    f"SELECT {_SELECT_COLUMNS} FROM checkpoints WHERE thread_id = ? AND thread_ts = ?",
+                    (thread_id, thread_ts),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    f"SELECT {_SELECT_COLUMNS} FROM checkpoints WHERE thread_id = ? ORDER BY thread_ts DESC LIMIT 1",
+                    (thread_id,),
+                ).fetchone()
+            if not row:
+                return None
+            result, seqs = self._decode_row(conn, row)
+
+        depth = row[5] or 0
+        if self.cache and not thread_ts:
+            self.cache.put(
+                thread_id, row[3], row[2], result.checkpoint, result.metadata, depth, list(result.pending_writes), seqs
             )
-        row = cursor.fetchone()
-        
-        if row:
-            checkpoint = pickle.loads(row[0])
-            metadata = pickle.loads(row[1]) if row[1] else {}
-            
-            # Apply Context Management (Trimming or Auto-Compacting) at Load Time
-            if self.context_manager and "channel_values" in checkpoint and "messages" in checkpoint["channel_values"]:
-                try:
-                    original_msgs = checkpoint["channel_values"]["messages"]
-                    # invoke() handles both LangChain Trimmer and our AutoCompactor
-                    trimmed_msgs = self.context_manager.invoke(original_msgs)
-                    checkpoint["channel_values"]["messages"] = trimmed_msgs
-                except Exception as e:
-                    # Fallback if processing fails
-                    pass
-
-            return CheckpointTuple(
-                config,
-                checkpoint,
-                metadata,
-                (config["configurable"]["thread_id"], row[2]) if row[2] else None,
+        return result, depth, seqs
+
+    def _row_to_tuple(self, conn: sqlite3.Connection, row: tuple) -> CheckpointTuple:
+        """Build a CheckpointTuple from a `_SELECT_COLUMNS` row."""
+        return self._decode_row(conn, row)[0]
+
+    def _decode_row(self, conn: sqlite3.Connection, row: tuple) -> tuple[CheckpointTuple, Optional[list[int]]]:
+        blob, metadata_blob, parent_ts, thread_ts, kind, _, thread_id = row
+        checkpoint = self._materialize(conn, thread_id, thread_ts, kind, blob)
+        seqs = self._resolve_messages(conn, thread_id, checkpoint)
+        metadata = self.serializer.loads(metadata_blob) if metadata_blob else {}
+        result = CheckpointTuple(
+            self._make_config(thread_id, thread_ts),
+            checkpoint,
+            metadata,
+            self._make_config(thread_id, parent_ts) if parent_ts else None,
+            self._load_writes(conn, thread_id, thread_ts),
+        )
+        return result, seqs
+
+    def _resolve_messages(self, conn: sqlite3.Connection, thread_id: str, checkpoint: Checkpoint) -> Optional[list[int]]:
+        """Replace a stored seq-range reference with the messages (one range scan per range)."""
+        channel_values = checkpoint.get("channel_values", {})
+        ref = channel_values.get(MESSAGES_CHANNEL)
+        if not (isinstance(ref, dict) and MESSAGE_REF in ref):
+            return None
+        rows = {}
+        for start, end in ref[MESSAGE_REF]:
+            for seq, *row in conn.execute(
+                "SELECT m.seq, m.payload, m.blob_digest, b.payload FROM messages m "
+                "LEFT JOIN blobs b ON b.digest = m.blob_digest "
+                "WHERE m.thread_id = ? AND m.seq BETWEEN ? AND ?",
+                (thread_id, start, end),
+            ):
+                rows[seq] = row
+        seqs = _from_ranges(ref[MESSAGE_REF])
+        messages = []
+        for seq in seqs:
+            if seq not in rows:
+                raise RuntimeError(f"Message {seq} of thread {thread_id} missing from the message store")
+            payload, digest, blob = rows[seq]
+            message = self.serializer.loads(payload)
+            if digest:
+                if blob is None:
+                    raise RuntimeError(f"Blob {digest} of thread {thread_id} missing from the blob table")
+                message.content = self.serializer.loads(blob)
+            messages.append(message)
+        channel_values[MESSAGES_CHANNEL] = messages
+        return seqs
+
+    def _store_messages(
+        self, thread_id: str, parent_ts: Optional[str], messages: list
+    ) -> tuple[dict, list[int], list[tuple], list[tuple]]:
+        """Map messages to seqs, reusing the parent's rows; returns (ref, seqs, new rows, blob rows)."""
+        prev_msgs, prev_seqs = [], []
+        last = self._last_state.get(thread_id)
+        if last and last[0] == parent_ts and last[3] is not None:
+            prev_msgs, prev_seqs = last[1].get(MESSAGES_CHANNEL) or [], last[3]
+        by_id = {m.id: i for i, m in enumerate(prev_msgs) if getattr(m, "id", None)}
+
+        next_seq = self._next_seq(thread_id)
+        seqs, rows, blob_rows = [], [], []
+        for i, message in enumerate(messages):
+            j = by_id.get(getattr(message, "id", None), i)
+            if j < len(prev_msgs) and (prev_msgs[j] is message or prev_msgs[j] == message):
+                seqs.append(prev_seqs[j])
+                continue
+            seqs.append(next_seq)
+            payload, digest, blob_row = self._encode_message(message)
+            elided_digest, elided_row = self._keep_elided(message, prev_msgs[j] if j < len(prev_msgs) else None)
+            rows.append((
+                thread_id,
+                next_seq,
+                getattr(message, "id", None),
+                getattr(message, "type", None),
+                payload,
+                digest,
+                elided_digest,
+            ))
+            blob_rows.extend(row for row in (blob_row, elided_row) if row)
+            next_seq += 1
+        self._set_next_seq(thread_id, next_seq)
+        return {MESSAGE_REF: _to_ranges(seqs)}, seqs, rows, blob_rows
+
+    def _encode_message(self, message: Any) -> tuple[bytes, Optional[str], Optional[tuple]]:
+        """Serialize a message row; large tool output is split off into a blob row by content hash."""
+        content = getattr(message, "content", None)
+        if not (
+            self.blob_threshold
+            and getattr(message, "type", None) == "tool"
+            and isinstance(content, str)
+            and len(content) >= self.blob_threshold
+        ):
+            return self.serializer.dumps(message), None, None
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        stub = message.model_copy(update={"content": ""})
+        return self.serializer.dumps(stub), digest, (digest, self.serializer.dumps(content), len(content), time.time())
+
+    def _keep_elided(self, message: Any, original: Any) -> tuple[Optional[str], Optional[tuple]]:
+        """Digest pinned by an elided tool output stub, and a blob row with the full output.
+
+        Compaction replaces the output in the parent's message list, so the
+        original (same message id) is still at hand when the stub is stored.
+        """
+        elided = (getattr(message, "response_metadata", None) or {}).get("elided")
+        if not elided:
+            return None, None
+        digest = elided["sha256"]
+        content = getattr(original, "content", None)
+        if getattr(original, "id", None) != message.id or not isinstance(content, str):
+            return digest, None  # already stored by an earlier stub of the same output
+        if hashlib.sha256(content.encode("utf-8")).hexdigest() != digest:
+            return digest, None
+        return digest, (digest, self.serializer.dumps(content), len(content), time.time())
+
+    def get_blob(self, digest: str) -> Optional[str]:
+        """Full content stored under a SHA-256 digest (large or elided tool outputs), or None."""
+        self.flush()
+        with self.db.read() as conn:
+            row = conn.execute("SELECT payload FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return self.serializer.loads(row[0]) if row else None
+
+    def _next_seq(self, thread_id: str) -> int:
+        next_seq = self._next_seqs.get(thread_id)
+        if next_seq is None:
+            self.flush(thread_id)
+            with self.db.read() as conn:
+                next_seq = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM messages WHERE thread_id = ?", (thread_id,)
+                ).fetchone()[0]
+            self._set_next_seq(thread_id, next_seq)
+        return next_seq
+
+    def _set_next_seq(self, thread_id: str, next_seq: int):
+        with self._state_lock:
+            self._next_seqs[thread_id] = next_seq
+            self._next_seqs.move_to_end(thread_id)
+            while len(self._next_seqs) > self.max_threads:
+                self._next_seqs.popitem(last=False)
+
+    def _remember(self, thread_id: str, state: tuple):
+        """Record the delta base of a thread, evicting the least recently used beyond max_threads."""
+        with self._state_lock:
+            self._last_state[thread_id] = state
+            self._last_state.move_to_end(thread_id)
+            while len(self._last_state) > self.max_threads:
+                self._last_state.popitem(last=False)
+
+    def release_thread(self, thread_id: str):
+        """Drop the per-thread state kept for the current turn (call when the turn ends).
+
+        The next turn's get_tuple rebuilds it, so a long-lived saver holds
+        state only for threads that are mid-turn.
+        """
+        with self._state_lock:
+            self._last_state.pop(thread_id, None)
+            self._next_seqs.pop(thread_id, None)
+
+    def _sweep_messages(self, conn: sqlite3.Connection, thread_id: str):
+        """Delete messages no remaining checkpoint references (below the newest referenced seq).
+
+        Runs in the prune transaction; seqs above the newest reference may belong
+        to a put that is not committed yet, so they are never touched.
+        """
+        referenced = set()
+        for blob, kind, thread_ts in conn.execute(
+            "SELECT checkpoint, kind, thread_ts FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall():
+            ref = self._materialize(conn, thread_id, thread_ts, kind, blob)["channel_values"].get(MESSAGES_CHANNEL)
+            if isinstance(ref, dict) and MESSAGE_REF in ref:
+                referenced.update(_from_ranges(ref[MESSAGE_REF]))
+        if not referenced:
+            return
+        keep = _to_ranges(sorted(referenced))
+        low = 0
+        digests = set()
+        for start, end in keep:
+            params = (thread_id, low, start)
+            for blob_digest, elided_digest in conn.execute(
+                "SELECT blob_digest, elided_digest FROM messages WHERE thread_id = ? AND seq > ? AND seq < ? "
+                "AND (blob_digest IS NOT NULL OR elided_digest IS NOT NULL)",
+                params,
+            ):
+                digests.update(d for d in (blob_digest, elided_digest) if d)
+            conn.execute("DELETE FROM messages WHERE thread_id = ? AND seq > ? AND seq < ?", params)
+            low = end
+        self._sweep_blobs(conn, digests)
+
+    @staticmethod
+    def _sweep_blobs(conn: sqlite3.Connection, digests: set[str]):
+        """Delete the given blobs unless another message row (of any thread) still references them.
+
+        Elided stubs count as references, so a compacted-away output stays fetchable by digest.
+
+        A queued put that reuses a swept digest re-inserts the blob in its own
+        transaction (INSERT OR IGNORE with the payload), so this never races write-behind.
+        """
+        conn.executemany(
+            "DELETE FROM blobs WHERE digest = ? AND NOT EXISTS "
+            "(SELECT 1 FROM messages WHERE blob_digest = ? UNION ALL SELECT 1 FROM messages WHERE elided_digest = ?)",
+            [(digest, digest, digest) for digest in digests],
+        )
+
+    def _load_writes(self, conn: sqlite3.Connection, thread_id: str, checkpoint_id: str) -> list[tuple[str, str, Any]]:
+        """Pending writes of a checkpoint, in LangGraph's (task_path, task_id, idx) order."""
+        rows = conn.execute(
+            "SELECT task_id, channel, value FROM writes WHERE thread_id = ? AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_id),
+        ).fetchall()
+        return [(task_id, channel, self.serializer.loads(value)) for task_id, channel, value in rows]
+
+    def _materialize(self, conn: sqlite3.Connection, thread_id: str, thread_ts: str, kind: Optional[str], blob: bytes) -> Checkpoint:
+        """Decode a row, rebuilding delta rows from their nearest keyframe."""
+        checkpoint = self.serializer.loads(blob)
+        if kind != KIND_DELTA:
+            return checkpoint
+
+        # Walk parent links back to the keyframe in one query (newest first)
+        rows = conn.execute(
+            """
+            WITH RECURSIVE chain(thread_ts, parent_ts, kind, checkpoint, n) AS (
+                SELECT thread_ts, parent_ts, kind, checkpoint, 0
+                FROM checkpoints WHERE thread_id = ? AND thread_ts = ?
+                UNION ALL
+                SELECT c.thread_ts, c.parent_ts, c.kind, c.checkpoint, chain.n + 1
+                FROM checkpoints c JOIN chain ON c.thread_id = ? AND c.thread_ts = chain.parent_ts
+                WHERE chain.kind = 'delta'
             )
-        return None
+            SELECT kind, checkpoint FROM chain ORDER BY n DESC
+            """,
+            (thread_id, thread_ts, thread_id),
+        ).fetchall()
+
+        if not rows or rows[0][0] == KIND_DELTA:
+            raise RuntimeError(f"Broken delta chain for thread {thread_id} at {thread_ts}: keyframe missing")
+
+        values = self.serializer.loads(rows[0][1])["channel_values"]
+        for _, delta_blob in rows[1:-1]:
+            values = self._apply_delta(values, self.serializer.loads(delta_blob)["channel_values"])
+        checkpoint["channel_values"] = self._apply_delta(values, checkpoint["channel_values"])
+        return checkpoint
+
+    @staticmethod
+    def _apply_delta(base: dict, delta: dict) -> dict:
+        values = {}
+        for key in delta["keys"]:
+            if key in delta["set"]:
+                values[key] = delta["set"][key]
+            elif key in delta["append"]:
+                values[key] = base[key] + delta["append"][key]
+            else:
+                values[key] = base[key]
+        return values
+
+    @staticmethod
+    def _diff(base: dict, values: dict, new_versions: dict) -> dict:
+        """Channel-level diff; only channels with a new version can differ."""
+        delta = {"keys": list(values), "set": {}, "append": {}}
+        for key, value in values.items():
+            if key in base and key not in new_versions:
+                continue
+            old = base.get(key)
+            if isinstance(value, list) and isinstance(old, list) and _is_extension(old, value):
+                if len(value) > len(old):
+                    delta["append"][key] = value[len(old):]
+            elif key not in base or old is not value:
+                delta["set"][key] = value
+        return delta
 
     def list(
         self,
@@ -133,8 +914,160 @@ class CustomSqliteSaver(BaseCheckpointSaver):
         before: Optional[RunnableConfig] = None,
         limit: Optional[int] = None,
     ) -> Iterator[CheckpointTuple]:
-        # Minimal implementation for basic persistence
-        pass
+        """Stream checkpoints newest first, filtering on the metadata_json column."""
+        clauses, params = [], []
+        configurable = (config or {}).get("configurable", {})
+        if configurable.get("thread_id"):
+            clauses.append("thread_id = ?")
+            params.append(configurable["thread_id"])
+            checkpoint_id = configurable.get("checkpoint_id") or configurable.get("thread_ts")
+            if checkpoint_id:
+                clauses.append("thread_ts = ?")
+                params.append(checkpoint_id)
+
+        if before:
+            before_cfg = before["configurable"]
+            clauses.append("thread_ts < ?")
+            params.append(before_cfg.get("checkpoint_id") or before_cfg.get("thread_ts"))
+
+        for key, value in (filter or {}).items():
+            if not _METADATA_KEY.match(key):
+                raise ValueError(f"Unsupported metadata filter key: {key!r}")
+            expr = f"json_extract(metadata_json, '$.{key}')"
+            if value is None:
+                clauses.append(f"{expr} IS NULL")
+            elif isinstance(value, (dict, list)):
+                clauses.append(f"{expr} = json(?)")
+                params.append(json.dumps(value, default=str, ensure_ascii=False))
+            else:
+                clauses.append(f"{expr} = ?")
+                params.append(value)
+
+        query = f"SELECT {_SELECT_COLUMNS} FROM checkpoints"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY thread_id, thread_ts DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        self.flush(configurable.get("thread_id"))
+
+        # Iterate the cursor lazily instead of fetchall(); the read connection
+        # stays borrowed from the pool until the generator is exhausted or closed.
+        with self.db.read() as conn:
+            cursor = conn.cursor()
+            try:
+                for row in cursor.execute(query, params):
+                    yield self._row_to_tuple(conn, row)
+            finally:
+                cursor.close()
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete all checkpoints and writes of a thread."""
+        self.flush(thread_id)
+        self.db.write(lambda conn: self._delete_thread_rows(conn, thread_id))
+        self.forget_thread(thread_id)
+
+    def _delete_thread_rows(self, conn: sqlite3.Connection, thread_id: str):
+        """Delete every row of a thread inside the caller's write transaction."""
+        conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        digests = {row[0] for row in conn.execute(
+            "SELECT blob_digest FROM messages WHERE thread_id = ? AND blob_digest IS NOT NULL "
+            "UNION SELECT elided_digest FROM messages WHERE thread_id = ? AND elided_digest IS NOT NULL",
+            (thread_id, thread_id),
+        )}
+        conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+        self._sweep_blobs(conn, digests)
+
+    def forget_thread(self, thread_id: str):
+        """Drop everything this saver holds in memory for a thread (turn state and hot cache)."""
+        self.release_thread(thread_id)
+        if self.cache:
+            self.cache.invalidate(thread_id)
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest", keep_last: int = 1) -> int:
+        """Drop all but the newest `keep_last` checkpoints of each thread.
+
+        Delta rows that would lose their parent are rewritten as keyframes first,
+        so every kept checkpoint stays readable. Returns the number of deleted rows.
+        """
+        deleted = 0
+        for thread_id in thread_ids:
+            self.flush(thread_id)
+            if strategy == "delete":
+                with self.db.read() as conn:
+                    deleted += conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+                self.delete_thread(thread_id)
+                continue
+
+            with self.db.read() as conn:
+                rows = conn.execute(
+                    f"SELECT {_SELECT_COLUMNS} FROM checkpoints WHERE thread_id = ? ORDER BY thread_ts DESC",
+                    (thread_id,),
+                ).fetchall()
+                kept, dropped = rows[:max(keep_last, 1)], rows[max(keep_last, 1):]
+                if not dropped:
+                    continue
+                kept_ids = {row[3] for row in kept}
+                # Re-anchor kept deltas whose parent is about to disappear
+                rekeyed = [
+                    (self.serializer.dumps(self._materialize(conn, thread_id, row[3], row[4], row[0])), thread_id, row[3])
+                    for row in kept
+                    if row[4] == KIND_DELTA and row[2] not in kept_ids
+                ]
+            dropped_ids = [(thread_id, row[3]) for row in dropped]
+
+            def _prune(conn: sqlite3.Connection):
+                conn.executemany(
+                    "UPDATE checkpoints SET checkpoint = ?, kind = 'full', depth = 0 WHERE thread_id = ? AND thread_ts = ?",
+                    rekeyed,
+                )
+                conn.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND thread_ts = ?", dropped_ids)
+                conn.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_id = ?", dropped_ids)
+                self._sweep_messages(conn, thread_id)
+
+            self.db.write(_prune)
+            if self.cache:
+                self.cache.invalidate(thread_id)
+            deleted += len(dropped_ids)
+        return deleted
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Store the writes of one task in a single transaction."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_id = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        # Special channels (errors, interrupts...) have fixed negative indexes and
+        # overwrite; regular writes are idempotent so a retried task doesn't duplicate them.
+        special = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        rows = [
+            (
+                thread_id,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                self.serializer.dumps(value),
+                task_path,
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        self._execute(thread_id, [(
+            f"INSERT OR {'REPLACE' if special else 'IGNORE'} INTO writes "
+            "(thread_id, checkpoint_id, task_id, idx, channel, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+            True,
+        )])
+        if self.cache:
+            self.cache.set_pending_writes(thread_id, checkpoint_id, None)
 
     def put(
         self,
@@ -145,22 +1078,65 @@ class CustomSqliteSaver(BaseCheckpointSaver):
     ) -> RunnableConfig:
         thread_id = config["configurable"]["thread_id"]
         thread_ts = checkpoint["id"]
-        parent_ts = config["configurable"].get("thread_ts")
+        # LangGraph passes the parent as checkpoint_id; thread_ts is our own legacy key
+        parent_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        channel_values = checkpoint.get("channel_values", {})
+        stored_values = channel_values
+        seqs, message_rows, blob_rows = None, [], []
+        if self.message_store and isinstance(channel_values.get(MESSAGES_CHANNEL), list):
+            ref, seqs, message_rows, blob_rows = self._store_messages(thread_id, parent_ts, channel_values[MESSAGES_CHANNEL])
+            stored_values = {**channel_values, MESSAGES_CHANNEL: ref}
+        stored = {**checkpoint, "channel_values": stored_values}
+        kind, depth = KIND_FULL, 0
+
+        last = self._last_state.get(thread_id)
+        if self.delta_mode and parent_ts and last and last[0] == parent_ts and last[2] + 1 < self.keyframe_interval:
+            kind, depth = KIND_DELTA, last[2] + 1
+            stored = {**checkpoint, "channel_values": self._diff(last[1], stored_values, new_versions)}
         
-        with self.conn:
-            self.conn.execute(
-                "INSERT OR REPLACE INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint, metadata) VALUES (?, ?, ?, ?, ?)",
-                (
-                    thread_id,
-                    thread_ts,
-                    parent_ts,
-                    pickle.dumps(checkpoint),
-                    pickle.dumps(metadata),
-                ),
-            )
-        return {
-            "configurable": {
-                "thread_id": thread_id,
-                "thread_ts": thread_ts,
-            }
-        }
+        # Encode on the calling thread; the writer thread only runs the INSERT
+        row = (
+            thread_id,
+            thread_ts,
+            parent_ts,
+            self.serializer.dumps(stored),
+            self.serializer.dumps(metadata),
+            kind,
+            depth,
+            json.dumps(metadata, default=str, ensure_ascii=False),
+            time.time(),
+        )
+        statements = []
+        if blob_rows:
+            # Same content, same digest: the first writer's row is kept
+            statements.append((
+                "INSERT OR IGNORE INTO blobs (digest, payload, size, created_at) VALUES (?, ?, ?, ?)",
+                blob_rows,
+                True,
+            ))
+        if message_rows:
+            # Plain INSERT: a seq collision must fail loudly rather than rewrite history
+            statements.append((
+                "INSERT INTO messages (thread_id, seq, message_id, role, payload, blob_digest, elided_digest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                message_rows,
+                True,
+            ))
+        statements.append((
+            "INSERT OR REPLACE INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint, metadata, kind, depth, metadata_json, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            row,
+            False,
+        ))
+        self._execute(thread_id, statements)
+
+        # Shallow-copy lists so later in-place changes can't corrupt the next diff
+        self._remember(thread_id, (
+            thread_ts,
+            {k: list(v) if isinstance(v, list) else v for k, v in channel_values.items()},
+            depth,
+            seqs,
+        ))
+        if self.cache:
+            # Write-through: the next turn of this thread reads it back without decoding
+            self.cache.put(thread_id, thread_ts, parent_ts, checkpoint, metadata, depth, [], seqs)
+        return self._make_config(thread_id, thread_ts)
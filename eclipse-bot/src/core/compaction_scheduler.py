@@ -0,0 +1,100 @@
+"""Background pre-compaction for AutoCompactor.
+
+Summarizing inside `get_tuple` blocks the user's first token for a whole LLM
+call. Instead, a compactor that loads a thread past its soft threshold (e.g.
+80% of the safe limit) only registers it here. Once the turn is over the
+dispatcher calls `run_after_turn`, the summary is computed on a worker thread,
+and the next load of the thread swaps it in (see `PreparedSummary.apply`).
+The synchronous path in `AutoCompactor.invoke` is left as the fallback when a
+thread reaches the hard limit before its background summary is ready.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, Union
+
+from src.core.compactor import PreparedSummary
+
+logger = logging.getLogger(__name__)
+
+# Returns the thread's latest uncompacted messages; sync loaders run on a worker thread
+MessageLoader = Callable[[], Union[list, Awaitable[list]]]
+
+
+class CompactionScheduler:
+    """Queues one background summary per thread, with bounded concurrency."""
+
+    def __init__(self, max_concurrency: int = 2):
+        self._requested: dict = {}  # thread_id -> AutoCompactor that crossed the soft threshold
+        self._ready: dict[str, PreparedSummary] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        # request()/take() are called from checkpointer worker threads
+        self._lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+        self.completed = 0
+        self.failed = 0
+        self.taken = 0
+
+    def request(self, thread_id: str, compactor):
+        """Mark a thread for background compaction after its current turn."""
+        with self._lock:
+            if thread_id not in self._tasks and thread_id not in self._ready:
+                self._requested[thread_id] = compactor
+
+    def take(self, thread_id: str) -> Optional[PreparedSummary]:
+        """Pop the prepared summary of a thread, if one is ready."""
+        with self._lock:
+            prepared = self._ready.pop(thread_id, None)
+            if prepared:
+                self.taken += 1
+            return prepared
+
+    def run_after_turn(self, thread_id: str, load_messages: MessageLoader) -> Optional[asyncio.Task]:
+        """Start the thread's summary if it was requested. Does not wait for it."""
+        with self._lock:
+            compactor = self._requested.pop(thread_id, None)
+            if compactor is None or thread_id in self._tasks:
+                return None
+            task = asyncio.create_task(self._run(thread_id, compactor, load_messages))
+            self._tasks[thread_id] = task
+        return task
+
+    async def _run(self, thread_id: str, compactor, load_messages: MessageLoader):
+        try:
+            async with self._semaphore:
+                if asyncio.iscoroutinefunction(load_messages):
+                    messages = await load_messages()
+                else:
+                    messages = await asyncio.to_thread(load_messages)
+                prepared = await asyncio.to_thread(compactor.prepare, messages) if messages else None
+            if prepared:
+                with self._lock:
+                    self._ready[thread_id] = prepared
+                self.completed += 1
+                logger.info(f"Background compaction ready for {thread_id} ({len(prepared.covered)} messages covered)")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Background compaction failed for {thread_id}: {e}")
+        finally:
+            with self._lock:
+                self._tasks.pop(thread_id, None)
+
+    async def aclose(self):
+        """Cancel summaries still running (they are recomputed on demand)."""
+        with self._lock:
+            tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "requested": len(self._requested),
+                "running": len(self._tasks),
+                "ready": len(self._ready),
+                "completed": self.completed,
+                "failed": self.failed,
+                "taken": self.taken,
+            }
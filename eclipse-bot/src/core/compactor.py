@@ -1,12 +1,158 @@
+import hashlib
+import json
 import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import List, Optional, Callable
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.language_models import BaseChatModel
 
 logger = logging.getLogger(__name__)
 
 import asyncio
 from src.core.context import get_context
+from src.core.token_counter import TokenCounter, get_token_counter, estimate_tokens
+from src.core import artifact_index
+
+# Compaction summaries are SystemMessages with this id prefix; response_metadata
+# records how many messages they cover so far (rolling summaries).
+SUMMARY_ID_PREFIX = "compaction-summary-"
+SUMMARY_MARKER = "[PREVIOUS CONVERSATION SUMMARY]"
+
+# Part of the summary cache key: bump whenever a summarization prompt changes
+PROMPT_VERSION = 3
+
+# Upper bound on characters per token, caps the search for a chunk boundary
+MAX_CHARS_PER_TOKEN = 8
+
+# Paths, CLs, function names and queries are kept by the artifact index, not the LLM
+SUMMARY_REQUIREMENTS = (
+    "Key Requirements:\n"
+    "1. Preserve specific technical decisions and their reasons.\n"
+    "2. Note any finished tasks and pending TODOs.\n"
+    "3. Ignore casual chitchat. Do not list file paths, CLs or function names (indexed separately).\n\n"
+)
+
+
+def is_summary_message(message: BaseMessage) -> bool:
+    """True for summaries written by AutoCompactor (including ones from before they had ids)."""
+    if not isinstance(message, SystemMessage):
+        return False
+    if (message.id or "").startswith(SUMMARY_ID_PREFIX):
+        return True
+    return isinstance(message.content, str) and SUMMARY_MARKER in message.content[:64]
+
+
+def _format_call(name: str, args: Optional[dict]) -> str:
+    rendered = ", ".join(f"{k}={json.dumps(v, ensure_ascii=False)}" for k, v in (args or {}).items())
+    return f"{name}({rendered})"
+
+
+def elide_tool_output(message: ToolMessage, args: Optional[dict] = None, preview_chars: int = 160) -> ToolMessage:
+    """Stub of a large tool output: tool, args, size, digest and the first line(s).
+
+    The stub keeps the message id and the full digest in response_metadata.
+    When the stub is persisted through the SQLite message store, the full
+    output is kept in the blob table under that digest (`get_blob`) for as long
+    as the stub exists; otherwise it only survives in parent checkpoints until
+    retention prunes them.
+    """
+    content = message.content
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    preview = content[:preview_chars].rstrip()
+    stub = (
+        f"[Elided tool output] {_format_call(message.name or 'tool', args)} -> {len(content):,} chars, sha256:{digest[:12]}\n"
+        f"{preview}\n...\n"
+        "(Re-run the tool if the full output is needed.)"
+    )
+    return message.model_copy(update={
+        "content": stub,
+        "response_metadata": {
+            **message.response_metadata,
+            "elided": {"sha256": digest, "chars": len(content)},
+            # The references in the elided output stay indexed
+            "artifacts": artifact_index.extract(message),
+        },
+    })
+
+
+def _fingerprint(message: BaseMessage) -> str:
+    # add_messages gives every message an id; legacy summaries may lack one
+    return message.id or f"{message.type}:{hash(str(message.content))}"
+
+
+class SummaryCache:
+    """LRU of summarization results keyed by hash(prompt version, model, full prompt).
+
+    The prompt contains the rendered input messages (and the prior summary), so
+    retries, duplicate loads and replays of the same history reuse the result.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_id: str, prompt: str) -> str:
+        return hashlib.sha256(f"{PROMPT_VERSION}\0{model_id}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def model_id(model: BaseChatModel) -> str:
+    """Identifier of a chat model for cache keys (provider model name when available)."""
+    for attr in ("model_name", "model"):
+        value = getattr(model, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    return f"{type(model).__name__}:{id(model)}"
+
+
+@dataclass
+class PreparedSummary:
+    """A summary and the prefix of the history it replaces."""
+    summary: SystemMessage
+    prior_summaries: tuple  # fingerprints of the summaries folded into this one
+    covered: tuple          # fingerprints of the non-system messages it covers
+
+    def apply(self, messages: List[BaseMessage]) -> Optional[List[BaseMessage]]:
+        """Swap the summary in, or None if the history no longer starts with the covered messages."""
+        prior = [m for m in messages if is_summary_message(m)]
+        non_system = [m for m in messages if not isinstance(m, SystemMessage)]
+        n = len(self.covered)
+        if tuple(map(_fingerprint, prior)) != self.prior_summaries:
+            return None
+        if len(non_system) <= n or tuple(map(_fingerprint, non_system[:n])) != self.covered:
+            return None
+        system_msgs = [m for m in messages if isinstance(m, SystemMessage) and not is_summary_message(m)]
+        return system_msgs + [self.summary] + non_system[n:]
+
 
 class AutoCompactor:
     """Smart Context Compactor inspired by Claude Code strategies."""
@@ -16,7 +162,14 @@ class AutoCompactor:
         model: BaseChatModel, 
         max_tokens: int, 
         summary_ratio: float = 0.5,
-        recent_messages_buffer: int = 10
+        recent_messages_buffer: int = 10,
+        soft_ratio: float = 0.8,
+        scheduler=None,
+        token_counter: Optional[TokenCounter] = None,
+        elide_min_chars: int = 2000,
+        chunk_tokens: int = 24000,
+        max_parallel: int = 4,
+        summary_cache: Optional[SummaryCache] = None,
     ):
         """
         Args:
@@ -24,24 +177,66 @@ class AutoCompactor:
             max_tokens: Threshold to trigger compaction.
             summary_ratio: Target size ratio for the summary (not strictly enforced, but guides logic).
             recent_messages_buffer: Number of recent messages to ALWAYS keep intact.
+            soft_ratio: Fraction of max_tokens past which the summary is prepared in
+                the background (needs `scheduler`). Below max_tokens nothing blocks.
+            scheduler: CompactionScheduler shared by all compactors.
+            token_counter: Local memoized counter (see token_counter). Without
+                one, the model's own counter is used.
+            elide_min_chars: Tool outputs older than the recent buffer and at least
+                this long are replaced by stubs before any LLM summary (0 = off).
+            chunk_tokens: Summarizer input budget. Longer inputs are split into
+                chunks of this size, summarized concurrently and merged (map-reduce).
+            max_parallel: Chunk summaries running at once.
+            summary_cache: Shared cache of summarization results (None = no caching).
         """
         self.model = model
         self.max_tokens = max_tokens
         self.recent_buffer = recent_messages_buffer
+        self.soft_limit = int(max_tokens * soft_ratio)
+        self.scheduler = scheduler
+        self.token_counter = token_counter
+        self.elide_min_chars = elide_min_chars
+        self.chunk_tokens = max(chunk_tokens, 256)
+        self.max_parallel = max(max_parallel, 1)
+        self.summary_cache = summary_cache
+        # Timings of the last summary: {"chunks", "map_seconds", "reduce_seconds"}
+        self.last_timings: dict = {}
 
-    def invoke(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+    # Savers pass the thread id to invoke() (LangChain trimmers only take messages)
+    thread_aware = True
+
+    def invoke(self, messages: List[BaseMessage], thread_id: Optional[str] = None) -> List[BaseMessage]:
         """Apply compaction if token count exceeds limit."""
         try:
-            # 1. Calculate current tokens (Approximate or use model's counter)
-            # We use a simple approximation here if token_counter lacks, 
-            # but ideally should use self.model.get_num_tokens_from_messages(messages)
-            try:
-                current_tokens = self.model.get_num_tokens_from_messages(messages)
-            except Exception:
-                # Fallback: strict char count / 4
-                current_tokens = sum(len(m.content) for m in messages) // 4
-            
+            # 0. A summary prepared in the background after the previous turn
+            if self.scheduler and thread_id:
+                prepared = self.scheduler.take(thread_id)
+                if prepared:
+                    swapped = prepared.apply(messages)
+                    if swapped is not None:
+                        logger.info(f"AutoCompact: background summary swapped in ({len(messages)} -> {len(swapped)} messages)")
+                        return swapped
+                    logger.info("AutoCompact: background summary is stale, discarded")
+
+            # 1. Calculate current tokens (incremental per thread with a TokenCounter)
+            current_tokens = self._count_tokens(messages, thread_id)
+
+            if current_tokens < self.soft_limit:
+                return messages
+
+            # 1b. Tier 1: deterministic elision of old, large tool outputs (no LLM call)
+            elided = self.elide_old_tool_outputs(messages)
+            if elided is not messages:
+                elided_tokens = self._count_tokens(elided)
+                logger.info(f"AutoCompact: tool outputs elided ({current_tokens} -> {elided_tokens})")
+                if elided_tokens < self.soft_limit:
+                    return elided
+                messages, current_tokens = elided, elided_tokens
+
             if current_tokens < self.max_tokens:
+                if self.scheduler and thread_id:
+                    # Tier 2 (LLM summary) after this turn instead of blocking a later one
+                    self.scheduler.request(thread_id, self)
                 return messages
 
             logger.info(f"AutoCompact Triggered: {current_tokens} > {self.max_tokens}")
@@ -66,35 +261,15 @@ class AutoCompactor:
                 logger.warning(f"AutoCompact notification skipped: {notify_err}")
             # ----------------------------------------
 
-            # 2. Identify segments
-            # [System] --- [To Summarize] --- [Recent Buffer]
-            system_msgs = [m for m in messages if isinstance(m, SystemMessage)]
-            non_system = [m for m in messages if not isinstance(m, SystemMessage)]
-
-            if len(non_system) <= self.recent_buffer:
+            # 2-4. Summarize and construct the new history (synchronous fallback)
+            prepared = self.prepare(messages)
+            if prepared is None:
                 # Nothing to compact if we only have recent messages
                 return messages
+            new_history = prepared.apply(messages)
 
-            to_summarize = non_system[:-self.recent_buffer]
-            recent = non_system[-self.recent_buffer:]
-
-            # 3. Generate Summary
-            summary_text = self._generate_summary(to_summarize)
-            
-            # 4. Construct new history
-            # We wrap summary in a SystemMessage or specialized message to inform the agent
-            summary_message = SystemMessage(
-                content=f" [PREVIOUS CONVERSATION SUMMARY]\nThe following is a condensed summary of the earlier conversation. Use this context to understand past decisions:\n\n{summary_text}"
-            )
-
-            new_history = system_msgs + [summary_message] + recent
-            
-            # Log reduction
-            try:
-                new_tokens = self.model.get_num_tokens_from_messages(new_history)
-                logger.info(f"Context Compacted: {current_tokens} -> {new_tokens}")
-            except:
-                pass
+            # Log reduction (recent messages are memo hits)
+            logger.info(f"Context Compacted: {current_tokens} -> {self._count_tokens(new_history)}")
 
             return new_history
 
@@ -103,22 +278,218 @@ class AutoCompactor:
             logger.error(f"AutoCompact Failed: {e}\n{traceback.format_exc()}")
             return messages
 
-    def _generate_summary(self, messages: List[BaseMessage]) -> str:
-        """Call LLM to summarize the message list."""
-        conversation_text = ""
-        for m in messages:
-            role = m.type.upper()
-            conversation_text += f"{role}: {m.content}\n"
+    def elide_old_tool_outputs(self, messages: List[BaseMessage], keep_recent: Optional[int] = None) -> List[BaseMessage]:
+        """Stub large ToolMessages outside the last `keep_recent` non-system messages.
+
+        Returns `messages` itself when nothing was elided.
+        """
+        if not self.elide_min_chars:
+            return messages
+        keep_recent = self.recent_buffer if keep_recent is None else keep_recent
+        non_system = [i for i, m in enumerate(messages) if not isinstance(m, SystemMessage)]
+        old = set(non_system[:len(non_system) - keep_recent] if keep_recent else non_system)
+        call_args = {
+            call["id"]: call.get("args")
+            for m in messages
+            for call in (getattr(m, "tool_calls", None) or [])
+            if call.get("id")
+        }
+        result, elided = [], 0
+        for i, m in enumerate(messages):
+            if (
+                i in old
+                and isinstance(m, ToolMessage)
+                and isinstance(m.content, str)
+                and len(m.content) >= self.elide_min_chars
+                and "elided" not in m.response_metadata
+            ):
+                m = elide_tool_output(m, call_args.get(m.tool_call_id))
+                elided += 1
+            result.append(m)
+        return result if elided else messages
+
+    def _count_tokens(self, messages: List[BaseMessage], thread_id: Optional[str] = None) -> int:
+        if self.token_counter:
+            return self.token_counter.count_messages(messages, thread_id)
+        try:
+            return self.model.get_num_tokens_from_messages(messages)
+        except Exception:
+            # Local estimate; handles list (multimodal) content and non-ASCII text
+            return get_token_counter().count_messages(messages)
+
+    def prepare(self, messages: List[BaseMessage]) -> Optional[PreparedSummary]:
+        """Summarize everything but the recent buffer; None if there is nothing to compact."""
+        # [System] --- [Prior Summary] --- [To Summarize] --- [Recent Buffer]
+        # Everything before the prior summary is already covered by it, so only
+        # messages aged out since the last compaction are sent to the model.
+        prior_summaries = [m for m in messages if is_summary_message(m)]
+        non_system = [m for m in messages if not isinstance(m, SystemMessage)]
+        if len(non_system) <= self.recent_buffer:
+            return None
+        to_summarize = non_system[:-self.recent_buffer]
+        # The summarizer never needs the raw bulk of old tool outputs
+        summary_input = self.elide_old_tool_outputs(to_summarize, keep_recent=0)
+
+        # Rolling: prior summary + newly aged-out messages
+        previous_summary = "\n\n".join(self._summary_text(m) for m in prior_summaries) or None
+        summary_text = self._generate_summary(summary_input, previous_summary)
+        covered = sum(m.response_metadata.get("summarized_messages", 0) for m in prior_summaries) + len(to_summarize)
+        logger.info(f"Rolling summary: +{len(to_summarize)} messages ({covered} covered)")
+
+        # Each message is indexed once, when it ages out; the prior index rolls forward
+        artifacts = artifact_index.merge(
+            *(m.response_metadata.get("artifacts") for m in prior_summaries),
+            artifact_index.index_messages(to_summarize),
+        )
+        rendered = artifact_index.render(artifacts)
+
+        # We wrap summary in a SystemMessage or specialized message to inform the agent
+        summary_message = SystemMessage(
+            content=f" {SUMMARY_MARKER}\nThe following is a condensed summary of the earlier conversation. Use this context to understand past decisions:\n\n{summary_text}"
+            + (f"\n\n{rendered}" if rendered else ""),
+            id=f"{SUMMARY_ID_PREFIX}{uuid.uuid4()}",
+            response_metadata={"summarized_messages": covered, "artifacts": artifacts},
+        )
+        return PreparedSummary(
+            summary_message,
+            tuple(map(_fingerprint, prior_summaries)),
+            tuple(map(_fingerprint, to_summarize)),
+        )
 
+    @staticmethod
+    def _summary_text(message: BaseMessage) -> str:
+        """Summary body without the header added in invoke()."""
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        _, sep, body = content.partition("past decisions:\n\n")
+        body = body if sep else content
+        # The artifact index is rebuilt from response_metadata, not summarized
+        return body.split(f"\n\n{artifact_index.ARTIFACTS_MARKER}")[0]
+
+    def _generate_summary(self, messages: List[BaseMessage], previous_summary: Optional[str] = None) -> str:
+        """Call LLM to summarize the message list, folding it into `previous_summary` if given.
+
+        Inputs over `chunk_tokens` are summarized map-reduce style: chunk summaries
+        run concurrently (bounded by `max_parallel`), then are merged in order.
+        """
+        lines = [f"{m.type.upper()}: {m.content}\n" for m in messages]
+        chunks = self._chunk(lines)
+        if len(chunks) <= 1:
+            self.last_timings = {"chunks": 1}
+            return self._summarize("".join(lines), previous_summary)
+
+        start = time.perf_counter()
+        partials = self._map(chunks)
+        map_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = self._reduce(partials, previous_summary)
+        reduce_seconds = time.perf_counter() - start
+
+        self.last_timings = {"chunks": len(chunks), "map_seconds": round(map_seconds, 3), "reduce_seconds": round(reduce_seconds, 3)}
+        logger.info(f"Map-reduce summary: {len(chunks)} chunks, map {map_seconds:.1f}s, reduce {reduce_seconds:.1f}s")
+        return summary
+
+    def _count_text(self, text: str) -> int:
+        return self.token_counter.count_text(text) if self.token_counter else estimate_tokens(text)
+
+    def _chunk(self, lines: List[str]) -> List[str]:
+        """Group lines into chunks of at most `chunk_tokens`; oversized lines are split."""
+        chunks, current, current_tokens = [], [], 0
+        for line in lines:
+            tokens = self._count_text(line)
+            if tokens > self.chunk_tokens:
+                pieces = self._split_text(line)
+            else:
+                pieces = [line]
+            for piece in pieces:
+                piece_tokens = tokens if len(pieces) == 1 else self._count_text(piece)
+                if current and current_tokens + piece_tokens > self.chunk_tokens:
+                    chunks.append("".join(current))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += piece_tokens
+        if current:
+            chunks.append("".join(current))
+        return chunks
+
+    def _split_text(self, text: str) -> List[str]:
+        """Cut one oversized message into pieces of at most `chunk_tokens` measured tokens.
+
+        Characters per token vary by script (~4 for code and English, ~1 for
+        Hangul/CJK), so each cut is found by binary search on the token count,
+        preferring a line break in the second half of the piece.
+        """
+        pieces, start = [], 0
+        while start < len(text):
+            # No tokenizer packs more than MAX_CHARS_PER_TOKEN chars per token in practice
+            lo, hi = start + 1, min(len(text), start + self.chunk_tokens * MAX_CHARS_PER_TOKEN)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if self._count_text(text[start:mid]) <= self.chunk_tokens:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            end = lo
+            if end < len(text):
+                newline = text.rfind("\n", start, end)
+                if newline > start + (end - start) // 2:
+                    end = newline + 1
+            pieces.append(text[start:end])
+            start = end
+        return pieces
+
+    def _map(self, chunks: List[str]) -> List[str]:
+        """Summarize chunks concurrently; results keep the chunk order."""
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(chunks))) as pool:
+            return list(pool.map(lambda item: self._summarize(item[1], part=(item[0] + 1, len(chunks))), enumerate(chunks)))
+
+    def _reduce(self, partials: List[str], previous_summary: Optional[str], depth: int = 0) -> str:
+        """Merge chunk summaries; if they still exceed the budget, merge groups of them first."""
+        parts = [f"Part {i + 1}:\n{p}\n\n" for i, p in enumerate(partials)]
+        groups = self._chunk(parts)
+        if len(groups) > 1 and depth < 3:
+            return self._reduce(self._map(groups), previous_summary, depth + 1)
         prompt = (
-            "Summarize the following technical conversation concisely.\n"
-            "Key Requirements:\n"
-            "1. **Preserve file paths and directories**: Explicitly list all visited directories and modified files.\n"
-            "2. Preserve function names and specific technical decisions.\n"
-            "3. Note any finished tasks and pending TODOs.\n"
-            "4. Ignore casual chitchat.\n\n"
-            f"Conversation:\n{conversation_text}"
+            "Merge the partial summaries below (consecutive parts of one technical conversation, in order) "
+            "into a single concise summary.\n"
         )
+        if previous_summary:
+            prompt += "Fold them into the existing summary: keep what is still relevant and drop TODOs that are now finished.\n"
+        prompt += SUMMARY_REQUIREMENTS
+        if previous_summary:
+            prompt += f"Existing summary:\n{previous_summary}\n\n"
+        prompt += f"Partial summaries:\n{''.join(parts)}"
+        return self._complete(prompt)
+
+    def _summarize(self, conversation_text: str, previous_summary: Optional[str] = None, part: Optional[tuple] = None) -> str:
+        """One summarization call over rendered messages."""
+        if previous_summary:
+            prompt = (
+                "Update the running summary of a technical conversation with the new messages below.\n"
+                "Keep what is still relevant from the existing summary, add the new information, "
+                "and drop TODOs that are now finished.\n"
+                + SUMMARY_REQUIREMENTS
+                + f"Existing summary:\n{previous_summary}\n\n"
+                f"New messages:\n{conversation_text}"
+            )
+        else:
+            scope = f" (part {part[0]} of {part[1]})" if part else ""
+            prompt = (
+                f"Summarize the following technical conversation{scope} concisely.\n"
+                + SUMMARY_REQUIREMENTS
+                + f"Conversation:\n{conversation_text}"
+            )
+
+        return self._complete(prompt)
 
+    def _complete(self, prompt: str) -> str:
+        """One summarization call, served from the summary cache when the same prompt was seen."""
+        key = SummaryCache.key(model_id(self.model), prompt) if self.summary_cache else None
+        if key:
+            cached = self.summary_cache.get(key)
+            if cached is not None:
+                return cached
         response = self.model.invoke([HumanMessage(content=prompt)])
+        if key:
+            self.summary_cache.put(key, response.content)
         return response.content
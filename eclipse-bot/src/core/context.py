@@ -28,6 +28,9 @@ class AppContext:
     def __init__(self):
         self.slack: Optional[SlackIntegration] = None
         self.p4: Optional[PerforceClient] = None
+        self.retention = None  # RetentionWorker, set in lifespan
+        self.ready = False  # Warmed up and connected to Slack (/ready)
+        self.prewarm: dict = {}  # Prewarm timings per component
 
     @classmethod
     def get_instance(cls) -> 'AppContext':
@@ -2,12 +2,22 @@ import logging
 import time
 from src.config import get_settings
 from src.core.context import get_context
-from src.agents.factory import create_agent
+from src.agents.factory import create_agent, flush_checkpoints, schedule_compaction
 from src.core.slack_streamer import SlackStreamer
+from src.core.session_scheduler import SessionScheduler
+from src.core.admission import AdmissionController, AdmissionRejected
 from src.common.enums import TriggerType, PersonaType
 
 logger = logging.getLogger(__name__)
 
+# Admission priority per trigger (lower runs first): people waiting in a DM
+# before channel mentions, before automation.
+TRIGGER_PRIORITY = {
+    TriggerType.DM: 0,
+    TriggerType.MENTION: 1,
+    TriggerType.API: 2,
+}
+
 async def detect_persona(trigger_type: TriggerType) -> PersonaType:
     """Detect agent persona based on context."""
     if trigger_type == TriggerType.API:
@@ -25,7 +35,95 @@ def create_event_payload(channel: str, text: str, user: str = None, ts: str = No
         "team": team
     }
 
+def session_id_for(event: dict) -> str:
+    """Session Anchor: Thread TS if usually in thread, else Channel ID."""
+    return f"slack_{event.get('thread_ts') or event['channel']}"
+
+def reply_anchor(event: dict):
+    """Slack thread the reply goes to (a top-level message starts its own thread)."""
+    return event.get("thread_ts") or event.get("ts")
+
+def group_by_anchor(batch: list) -> list[list]:
+    """Split a session's queued events by reply anchor, in arrival order.
+
+    Top-level mentions in one channel share a session but each gets its own
+    reply thread, so only events answered in the same place are merged.
+    Events without an anchor (API triggers) are never merged.
+    """
+    groups: dict = {}
+    for item in batch:
+        anchor = reply_anchor(item[0])
+        groups.setdefault(anchor if anchor is not None else object(), []).append(item)
+    return list(groups.values())
+
+def coalesce_events(batch: list) -> tuple:
+    """Merge follow-ups queued during a run into one turn (texts in order, latest event as anchor).
+
+    All events must share a reply anchor (see group_by_anchor).
+    """
+    event, say, trigger_type = batch[-1]
+    texts = []
+    for queued_event, _, _ in batch:
+        text = queued_event.get("text", "")
+        if text and (not texts or texts[-1] != text):  # drop repeated sends
+            texts.append(text)
+    return {**event, "text": "\n\n".join(texts)}, say, trigger_type
+
+_session_scheduler = None
+
+def get_session_scheduler() -> SessionScheduler:
+    global _session_scheduler
+    if _session_scheduler is None:
+        settings = get_settings()
+        _session_scheduler = SessionScheduler(
+            _run_session_batch,
+            max_backlog=settings.session_max_backlog,
+            idle_seconds=settings.session_idle_seconds,
+        )
+    return _session_scheduler
+
+_admission = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission
+    if _admission is None:
+        settings = get_settings()
+        _admission = AdmissionController(
+            max_concurrency=settings.agent_max_concurrency,
+            max_queue=settings.agent_max_queue,
+        )
+    return _admission
+
+async def close_sessions():
+    """Stop session actors (called on shutdown, before persistence is closed)."""
+    if _session_scheduler:
+        await _session_scheduler.aclose()
+
 async def handle_event_trigger(event: dict, say, trigger_type: TriggerType = TriggerType.MENTION):
+    """Queue an event on its session; runs of one session never overlap."""
+    session_id = session_id_for(event)
+    if get_session_scheduler().submit(session_id, (event, say, trigger_type)):
+        return
+
+    ctx = get_context()
+    try:
+        await ctx.slack.send_message(
+            event["channel"],
+            "⏳ 이전 요청들을 처리 중입니다. 잠시 후 다시 요청해주세요.",
+            thread_ts=event.get("thread_ts") or event.get("ts"),
+        )
+    except Exception as send_err:
+        logger.error(f"Failed to send backlog notice to Slack: {send_err}")
+
+async def _run_session_batch(session_id: str, batch: list):
+    # One turn per reply thread, still one at a time (they share the session's checkpoints)
+    for group in group_by_anchor(batch):
+        event, say, trigger_type = coalesce_events(group)
+        if len(group) > 1:
+            logger.info(f"Merged {len(group)} queued events into one turn (session: {session_id})")
+        await run_agent_turn(event, say, trigger_type)
+
+async def run_agent_turn(event: dict, say, trigger_type: TriggerType = TriggerType.MENTION):
     """Unified handler that instantiates a dynamic agent based on context."""
     settings = get_settings()
     ctx = get_context()
@@ -35,9 +133,7 @@ async def handle_event_trigger(event: dict, say, trigger_type: TriggerType = Tri
     thread_ts = event.get("thread_ts")
     text = event.get("text", "")
     
-    # Session Anchor: Thread TS if usually in thread, else Channel ID
-    session_anchor = thread_ts or channel
-    session_id = f"slack_{session_anchor}"
+    session_id = session_id_for(event)
     
     # UI Anchor: Where to show typing status (Thread or Message)
     status_anchor = thread_ts or msg_ts
@@ -54,60 +150,82 @@ async def handle_event_trigger(event: dict, say, trigger_type: TriggerType = Tri
         "컨텍스트를 파악하는 중입니다..."
     ])
 
+    async def report_position(position: int):
+        await streamer.update_status(messages=[f"요청이 대기열에 있습니다 (대기 순서: {position})"])
+
     try:
-        # 1. Detect Persona & Create Agent
-        persona = await detect_persona(trigger_type)
-        agent = create_agent(persona_type=persona)
+        # 0. Wait for a run slot (DM > Mention > API)
+        async with get_admission_controller().slot(
+            TRIGGER_PRIORITY.get(trigger_type, TRIGGER_PRIORITY[TriggerType.API]),
+            on_position=report_position,
+        ):
+            # 1. Detect Persona & Create Agent
+            persona = await detect_persona(trigger_type)
+            agent = create_agent(persona_type=persona)
         
-        logger.info(f"Triggered workflow: {persona} (channel: {channel}, session: {session_id})")
+            logger.info(f"Triggered workflow: {persona} (channel: {channel}, session: {session_id})")
 
-        # 2. Start Stream
-        await streamer.start(event)
+            # 2. Start Stream
+            await streamer.start(event)
         
-        # 3. Execution Loop
-        try:
-            async for event_chunk in agent.astream_events(
-                {"messages": [{"role": "user", "content": text}]},
-                config={
-                    "configurable": {"thread_id": session_id},
-                    "recursion_limit": 100,
-                },
-                version="v2"
-            ):
-                kind = event_chunk["event"]
+            # 3. Execution Loop
+            try:
+                async for event_chunk in agent.astream_events(
+                    {"messages": [{"role": "user", "content": text}]},
+                    config={
+                        "configurable": {"thread_id": session_id},
+                        "recursion_limit": 100,
+                    },
+                    version="v2"
+                ):
+                    kind = event_chunk["event"]
                 
-                # A. Tool Execution Status
-                if kind == "on_tool_start" and not streamer.response_started:
-                    tool_name = event_chunk["name"]
-                    await streamer.update_status(messages=[f"도구 실행 중: {tool_name}"])
+                    # A. Tool Execution Status
+                    if kind == "on_tool_start" and not streamer.response_started:
+                        tool_name = event_chunk["name"]
+                        await streamer.update_status(messages=[f"도구 실행 중: {tool_name}"])
                 
-                # B. Sub-Agent Status
-                elif kind == "on_chain_start" and not streamer.response_started:
-                    name = event_chunk.get("name", "")
-                    if name and "-expert" in name:
-                        await streamer.update_status(messages=[f"Agent 협업 중: {name}"])
-
-                # C. Token Streaming
-                if kind == "on_chat_model_stream":
-                    chunk = event_chunk["data"]["chunk"]
+                    # B. Sub-Agent Status
+                    elif kind == "on_chain_start" and not streamer.response_started:
+                        name = event_chunk.get("name", "")
+                        if name and "-expert" in name:
+                            await streamer.update_status(messages=[f"Agent 협업 중: {name}"])
+
+                    # C. Token Streaming
+                    if kind == "on_chat_model_stream":
+                        chunk = event_chunk["data"]["chunk"]
                     
-                    # C-1. Handle Internal Monologue (Thought) Status
-                    if hasattr(chunk, "additional_kwargs") and "thought" in chunk.additional_kwargs:
-                         await streamer.update_status(status_text=f"추론 중: {chunk.additional_kwargs['thought'][:30]}...")
-                         continue
+                        # C-1. Handle Internal Monologue (Thought) Status
+                        if hasattr(chunk, "additional_kwargs") and "thought" in chunk.additional_kwargs:
+                             await streamer.update_status(status_text=f"추론 중: {chunk.additional_kwargs['thought'][:30]}...")
+                             continue
                     
-                    content = chunk.content
-                    if content and "thought:" in content.lower():
-                        await streamer.update_status(status_text="핵심 로직 분석 중...")
-                        # We still pass content to handler to filter/buffer it
+                        content = chunk.content
+                        if content and "thought:" in content.lower():
+                            await streamer.update_status(status_text="핵심 로직 분석 중...")
+                            # We still pass content to handler to filter/buffer it
                     
-                    # C-2. Pass to Streamer
-                    if content:
-                        await streamer.handle_token(content)
+                        # C-2. Pass to Streamer
+                        if content:
+                            await streamer.handle_token(content)
             
-        finally:
-            await streamer.stop()
+            finally:
+                await streamer.stop()
+                # Write-behind mode: commit this turn's checkpoints in one transaction
+                await flush_checkpoints(session_id)
+                # Summarize off the critical path if this thread is nearing its limit
+                schedule_compaction(session_id)
             
+    except AdmissionRejected as e:
+        logger.warning(f"Run shed for session {session_id}: {e}")
+        try:
+            await ctx.slack.send_message(
+                channel,
+                "⏳ *요청이 많아 지금은 처리할 수 없습니다.* 잠시 후 다시 요청해주세요.",
+                thread_ts=status_anchor or msg_ts,
+            )
+        except Exception as send_err:
+            logger.error(f"Failed to send load-shed notice to Slack: {send_err}")
     except Exception as e:
         import traceback
         logger.error(f"Error during agent trigger: {e}\n{traceback.format_exc()}")
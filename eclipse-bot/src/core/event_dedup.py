@@ -0,0 +1,103 @@
+"""Slack event deduplication.
+
+The same user message can reach the bot more than once:
+
+- a mention in a DM fires both `app_mention` and `message` (different
+  event_ids, same channel + ts),
+- Slack redelivers an event when the ack is late (same event_id),
+- with several replicas, each redelivery may land on another process.
+
+Every duplicate would start a full agent run and post a second reply, so
+events are claimed by their keys first. Keys live in a TTL-bounded set,
+in process or in Redis (SET NX EX) when replicas share the work.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def event_keys(event: dict, event_id: Optional[str] = None) -> list[str]:
+    """Dedup keys of an event: its envelope event_id and the message it is about."""
+    keys = []
+    if event_id:
+        keys.append(f"evt:{event_id}")
+    channel, ts = event.get("channel"), event.get("ts")
+    if channel and ts:
+        keys.append(f"msg:{channel}:{ts}")
+    return keys
+
+
+class EventDeduplicator:
+    """TTL-bounded set of seen event keys (in memory, or Redis when a client is given)."""
+
+    def __init__(self, ttl_seconds: float = 600.0, max_entries: int = 50_000, redis=None, prefix: str = "eclipse:slack-dedup"):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.redis = redis
+        self.prefix = prefix
+        self._seen: "OrderedDict[str, float]" = OrderedDict()  # key -> expiry, oldest first
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.retries = 0
+        self.errors = 0
+
+    async def claim(self, keys: list[str]) -> bool:
+        """Mark keys as seen. False if any of them was already claimed (a duplicate)."""
+        if not keys:
+            return True
+        self.checked += 1
+        if self.redis is not None:
+            try:
+                fresh = await asyncio.to_thread(self._claim_redis, keys)
+            except Exception as e:
+                # Better a rare duplicate reply than a dropped message
+                self.errors += 1
+                logger.warning(f"Slack dedup via Redis failed, letting event through: {e}")
+                fresh = True
+        else:
+            fresh = self._claim_local(keys)
+        if not fresh:
+            self.duplicates += 1
+        return fresh
+
+    def record_retry(self):
+        self.retries += 1
+
+    def _claim_local(self, keys: list[str]) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            # Constant TTL: expiry order is insertion order
+            while self._seen and next(iter(self._seen.values())) <= now:
+                self._seen.popitem(last=False)
+            fresh = not any(key in self._seen for key in keys)
+            for key in keys:
+                self._seen[key] = now + self.ttl_seconds
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return fresh
+
+    def _claim_redis(self, keys: list[str]) -> bool:
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(f"{self.prefix}:{key}", 1, nx=True, ex=max(int(self.ttl_seconds), 1))
+        return all(pipe.execute())
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            entries = len(self._seen)
+        return {
+            "backend": "redis" if self.redis is not None else "memory",
+            "entries": entries,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "retries_dropped": self.retries,
+            "errors": self.errors,
+        }
@@ -4,6 +4,7 @@ Fetches and caches model metadata (like context window size) from OpenRouter.
 """
 
 import logging
+import threading
 import requests
 from functools import lru_cache
 from typing import Optional, Dict, Any
@@ -14,6 +15,8 @@ logger = logging.getLogger(__name__)
 
 # In-memory cache for model info to avoid repeated API calls
 _MODEL_CACHE: Dict[str, Any] = {}
+# Agents compiled concurrently (startup prewarm) share one fetch
+_MODEL_CACHE_LOCK = threading.Lock()
 
 def fetch_openrouter_models() -> Dict[str, Any]:
     """Fetch all available models from OpenRouter API."""
@@ -40,16 +43,22 @@ def fetch_openrouter_models() -> Dict[str, Any]:
 
 def get_model_info(model_id: str) -> Optional[Dict[str, Any]]:
     """Get metadata for a specific model ID."""
-    global _MODEL_CACHE
-    
     # Lazy load cache
     if not _MODEL_CACHE:
-        logger.info("Initializing Model Registry Cache...")
-        _MODEL_CACHE = fetch_openrouter_models()
-        logger.info(f"Cached {_MODEL_CACHE.__len__()} models from OpenRouter.")
+        load_model_registry()
         
     return _MODEL_CACHE.get(model_id)
 
+def load_model_registry() -> int:
+    """Fetch the model list once (no-op if already cached). Returns the number of models."""
+    global _MODEL_CACHE
+    with _MODEL_CACHE_LOCK:
+        if not _MODEL_CACHE:
+            logger.info("Initializing Model Registry Cache...")
+            _MODEL_CACHE = fetch_openrouter_models()
+            logger.info(f"Cached {_MODEL_CACHE.__len__()} models from OpenRouter.")
+        return len(_MODEL_CACHE)
+
 def get_context_window(model_id: str, default: int = 4096) -> int:
     """Get context window size for a model, with safe fallback."""
     info = get_model_info(model_id)
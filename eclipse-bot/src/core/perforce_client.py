@@ -191,6 +191,19 @@ class PerforceClient:
             Info output
         """
         return self._run("info")
+
+    def login_status(self) -> str:
+        """Check the login ticket without prompting (`p4 login -s`).
+
+        `p4 info` succeeds without a valid ticket, so this is the auth check.
+
+        Returns:
+            Ticket status output
+
+        Raises:
+            RuntimeError: If there is no valid ticket
+        """
+        return self._run("login", "-s", timeout=15)
     
     def diff(self, path: str = "//...") -> str:
         """Show diff of opened files.
@@ -0,0 +1,385 @@
+"""PostgreSQL Checkpointer for LangGraph (psycopg 3).
+
+Async-native: a bounded `AsyncConnectionPool` serves all sessions and the hot
+statements (latest checkpoint, checkpoint by id, put) are server-side prepared.
+Pending writes of large tasks are bulk loaded with COPY into a temp staging
+table and merged with one INSERT ... ON CONFLICT.
+
+Blobs are BYTEA. By default they are stored out of line uncompressed
+(EXTERNAL), which is right for the default zstd codec. With
+`toast_compression` the server TOAST-compresses them instead; pair it with
+persistence_codec=none so the bytes aren't compressed twice. Setup only
+alters a column whose storage differs (ALTER TABLE takes an ACCESS EXCLUSIVE
+lock, so it must not run on every start).
+
+The sync BaseCheckpointSaver methods submit to the pool's event loop and
+must be called from another thread (e.g. the context manager's worker thread).
+"""
+
+import json
+import asyncio
+import logging
+from typing import Any, Optional, Iterator, AsyncIterator, Sequence
+
+import psycopg
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointTuple, CheckpointMetadata, WRITES_IDX_MAP
+
+from src.core.checkpoint_serde import CheckpointSerializer, CompactSerializer
+from src.core.checkpointer import CompactionMixin
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        parent_id TEXT,
+        checkpoint BYTEA NOT NULL,
+        metadata BYTEA NOT NULL,
+        metadata_json JSONB NOT NULL DEFAULT '{}',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (thread_id, checkpoint_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS checkpoint_writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        value BYTEA,
+        task_path TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (thread_id, checkpoint_id, task_id, idx)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_checkpoints_metadata ON checkpoints USING GIN (metadata_json jsonb_path_ops)",
+]
+
+_SELECT_COLUMNS = "thread_id, checkpoint_id, parent_id, checkpoint, metadata"
+_SELECT_LATEST = f"SELECT {_SELECT_COLUMNS} FROM checkpoints WHERE thread_id = %s ORDER BY checkpoint_id DESC LIMIT 1"
+_SELECT_BY_ID = f"SELECT {_SELECT_COLUMNS} FROM checkpoints WHERE thread_id = %s AND checkpoint_id = %s"
+_SELECT_WRITES = (
+    "SELECT task_id, channel, value FROM checkpoint_writes "
+    "WHERE thread_id = %s AND checkpoint_id = %s ORDER BY task_path, task_id, idx"
+)
+_UPSERT_CHECKPOINT = (
+    "INSERT INTO checkpoints (thread_id, checkpoint_id, parent_id, checkpoint, metadata, metadata_json) "
+    "VALUES (%s, %s, %s, %s, %s, %s) "
+    "ON CONFLICT (thread_id, checkpoint_id) DO UPDATE SET "
+    "parent_id = EXCLUDED.parent_id, checkpoint = EXCLUDED.checkpoint, "
+    "metadata = EXCLUDED.metadata, metadata_json = EXCLUDED.metadata_json"
+)
+_WRITE_COLUMNS = "thread_id, checkpoint_id, task_id, idx, channel, value, task_path"
+_INSERT_WRITE = f"INSERT INTO checkpoint_writes ({_WRITE_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+_ON_CONFLICT_WRITE = {
+    True: "ON CONFLICT (thread_id, checkpoint_id, task_id, idx) DO UPDATE SET channel = EXCLUDED.channel, value = EXCLUDED.value",
+    False: "ON CONFLICT (thread_id, checkpoint_id, task_id, idx) DO NOTHING",
+}
+
+
+# pg_attribute codes of the TOAST settings managed by setup()
+_STORAGE_NAMES = {"e": "EXTERNAL", "x": "EXTENDED"}
+_COMPRESSION_CODES = {"pglz": "p", "lz4": "l"}
+
+
+async def _column_storage(conn) -> dict[tuple[str, str], tuple[str, str]]:
+    """(table, column) -> (attstorage, attcompression) of the blob columns (PostgreSQL 14+)."""
+    cursor = await conn.execute(
+        "SELECT c.relname, a.attname, a.attstorage, a.attcompression "
+        "FROM pg_attribute a JOIN pg_class c ON c.oid = a.attrelid "
+        "WHERE a.attrelid IN ('checkpoints'::regclass, 'checkpoint_writes'::regclass) "
+        "AND a.attname IN ('checkpoint', 'metadata', 'value')"
+    )
+    return {(table, column): (storage, compression) for table, column, storage, compression in await cursor.fetchall()}
+
+
+class PostgresCheckpointSaver(CompactionMixin, BaseCheckpointSaver):
+    """A checkpoint saver that stores state in PostgreSQL."""
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        context_manager=None,
+        serializer: Optional[CheckpointSerializer] = None,
+        copy_threshold: int = 8,
+        persist_compaction: bool = True,
+    ):
+        """
+        Args:
+            pool: Shared pool (opened by `open_pool`).
+            copy_threshold: Pending writes of one task at or above this count use COPY.
+        """
+        super().__init__()
+        self.pool = pool
+        self.context_manager = context_manager  # Trimmer or AutoCompactor
+        self.serializer = serializer or CompactSerializer()
+        self.copy_threshold = copy_threshold
+        self.persist_compaction = persist_compaction
+        # Loop the pool runs on; sync methods are submitted to it
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    async def setup(pool: AsyncConnectionPool, toast_compression: Optional[str] = None):
+        """Create tables and set the TOAST strategy of the blob columns (idempotent)."""
+        async with pool.connection() as conn:
+            for statement in _SCHEMA:
+                await conn.execute(statement)
+            current = await _column_storage(conn)
+            storage = "x" if toast_compression else "e"
+            for column in ("checkpoint", "metadata"):
+                attstorage, attcompression = current[("checkpoints", column)]
+                if attstorage != storage:
+                    await conn.execute(
+                        f"ALTER TABLE checkpoints ALTER COLUMN {column} SET STORAGE {_STORAGE_NAMES[storage]}"
+                    )
+                if not toast_compression or attcompression == _COMPRESSION_CODES.get(toast_compression.lower()):
+                    continue
+                try:
+                    async with conn.transaction():  # Savepoint: a failure must not abort the setup
+                        await conn.execute(f"ALTER TABLE checkpoints ALTER COLUMN {column} SET COMPRESSION {toast_compression}")
+                except psycopg.errors.FeatureNotSupported as e:
+                    # e.g. server built without lz4: keep the default (pglz)
+                    logger.warning(f"TOAST compression {toast_compression} unavailable for {column}, using server default: {e}")
+            if current[("checkpoint_writes", "value")][0] != "e":
+                await conn.execute("ALTER TABLE checkpoint_writes ALTER COLUMN value SET STORAGE EXTERNAL")
+
+    # --- Sync bridge ---
+
+    def _bind_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+    def _run(self, coro):
+        """Run a coroutine on the event loop that owns the pool, from another thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            coro.close()
+            raise RuntimeError("Sync PostgresCheckpointSaver calls need a worker thread and a prior async call")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._run(self.aget_tuple(config))
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: dict[str, Any],
+    ) -> RunnableConfig:
+        return self._run(self.aput(config, checkpoint, metadata, new_versions))
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        return self._run(self.aput_writes(config, writes, task_id, task_path))
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        async def _collect():
+            return [t async for t in self.alist(config, filter=filter, before=before, limit=limit)]
+
+        yield from self._run(_collect())
+
+    def delete_thread(self, thread_id: str) -> None:
+        return self._run(self.adelete_thread(thread_id))
+
+    # --- Reads ---
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self._bind_loop()
+        thread_id = config["configurable"]["thread_id"]
+        thread_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        async with self.pool.connection() as conn:
+            if thread_ts:
+                cursor = await conn.execute(_SELECT_BY_ID, (thread_id, thread_ts), prepare=True)
+            else:
+                cursor = await conn.execute(_SELECT_LATEST, (thread_id,), prepare=True)
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            result = await self._row_to_tuple(conn, row)
+
+        if not self.context_manager:
+            return result
+        # Summarization calls the LLM synchronously; keep it off the event loop
+        return await asyncio.to_thread(self._apply_context_manager, result, not thread_ts)
+
+    async def _row_to_tuple(self, conn, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_id, parent_id, blob, metadata_blob = row
+        cursor = await conn.execute(_SELECT_WRITES, (thread_id, checkpoint_id), prepare=True)
+        writes = [(task_id, channel, self.serializer.loads(value)) for task_id, channel, value in await cursor.fetchall()]
+        return CheckpointTuple(
+            self._make_config(thread_id, checkpoint_id),
+            self.serializer.loads(blob),
+            self.serializer.loads(metadata_blob),
+            self._make_config(thread_id, parent_id) if parent_id else None,
+            writes,
+        )
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """Stream checkpoints newest first through a server-side cursor."""
+        self._bind_loop()
+        clauses, params = [], []
+        configurable = (config or {}).get("configurable", {})
+        if configurable.get("thread_id"):
+            clauses.append("thread_id = %s")
+            params.append(configurable["thread_id"])
+            checkpoint_id = configurable.get("checkpoint_id") or configurable.get("thread_ts")
+            if checkpoint_id:
+                clauses.append("checkpoint_id = %s")
+                params.append(checkpoint_id)
+        if filter:
+            clauses.append("metadata_json @> %s")  # Served by the GIN index
+            params.append(Jsonb(filter))
+        if before:
+            before_id = before["configurable"].get("checkpoint_id") or before["configurable"].get("thread_ts")
+            if before_id:
+                clauses.append("checkpoint_id < %s")
+                params.append(before_id)
+
+        query = f"SELECT {_SELECT_COLUMNS} FROM checkpoints"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY thread_id, checkpoint_id DESC" if not configurable.get("thread_id") else " ORDER BY checkpoint_id DESC"
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        async with self.pool.connection() as conn:
+            # Named cursors need a transaction; rows of the writes lookups share it
+            async with conn.transaction():
+                async with conn.cursor(name="checkpoint_list") as cursor:
+                    await cursor.execute(query, params)
+                    async for row in cursor:
+                        yield await self._row_to_tuple(conn, row)
+
+    # --- Writes ---
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: dict[str, Any],
+    ) -> RunnableConfig:
+        self._bind_loop()
+        thread_id = config["configurable"]["thread_id"]
+        thread_ts = checkpoint["id"]
+        parent_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        row = (
+            thread_id,
+            thread_ts,
+            parent_ts,
+            self.serializer.dumps(checkpoint),
+            self.serializer.dumps(metadata),
+            Jsonb(metadata, dumps=lambda obj: json.dumps(obj, default=str, ensure_ascii=False)),
+        )
+        async with self.pool.connection() as conn:
+            await conn.execute(_UPSERT_CHECKPOINT, row, prepare=True)
+        return self._make_config(thread_id, thread_ts)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Store the writes of one task in one transaction (COPY for large batches)."""
+        self._bind_loop()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_id = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        # Special channels overwrite; regular writes are idempotent for retried tasks
+        special = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        rows = [
+            (thread_id, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, self.serializer.dumps(value), task_path)
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        if not rows:
+            return
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                if len(rows) < self.copy_threshold:
+                    async with conn.cursor() as cursor:
+                        await cursor.executemany(_INSERT_WRITE + _ON_CONFLICT_WRITE[special], rows)
+                    return
+                await conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS checkpoint_writes_stage "
+                    "(LIKE checkpoint_writes INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                async with conn.cursor() as cursor:
+                    async with cursor.copy(f"COPY checkpoint_writes_stage ({_WRITE_COLUMNS}) FROM STDIN") as copy:
+                        for row in rows:
+                            await copy.write_row(row)
+                await conn.execute(
+                    f"INSERT INTO checkpoint_writes ({_WRITE_COLUMNS}) "
+                    f"SELECT {_WRITE_COLUMNS} FROM checkpoint_writes_stage " + _ON_CONFLICT_WRITE[special]
+                )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """Delete all checkpoints and writes of a thread."""
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM checkpoints WHERE thread_id = %s", (thread_id,))
+                await conn.execute("DELETE FROM checkpoint_writes WHERE thread_id = %s", (thread_id,))
+
+    async def aprune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest", keep_last: int = 1) -> int:
+        """Drop all but the newest `keep_last` checkpoints of each thread. Returns deleted count."""
+        if strategy == "delete":
+            keep_last = 0
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                cursor = await conn.execute(
+                    "WITH ranked AS ("
+                    "  SELECT thread_id, checkpoint_id, row_number() OVER (PARTITION BY thread_id ORDER BY checkpoint_id DESC) AS rn"
+                    "  FROM checkpoints WHERE thread_id = ANY(%s)"
+                    "), dropped AS ("
+                    "  DELETE FROM checkpoints c USING ranked r"
+                    "  WHERE c.thread_id = r.thread_id AND c.checkpoint_id = r.checkpoint_id AND r.rn > %s"
+                    "  RETURNING c.thread_id, c.checkpoint_id"
+                    "), dropped_writes AS ("
+                    "  DELETE FROM checkpoint_writes w USING dropped d"
+                    "  WHERE w.thread_id = d.thread_id AND w.checkpoint_id = d.checkpoint_id"
+                    ") SELECT COUNT(*) FROM dropped",
+                    (list(thread_ids), max(keep_last, 0)),
+                )
+                return (await cursor.fetchone())[0]
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest", keep_last: int = 1) -> int:
+        return self._run(self.aprune(thread_ids, strategy=strategy, keep_last=keep_last))
+
+
+def create_pool(dsn: str, min_size: int = 1, max_size: int = 10) -> AsyncConnectionPool:
+    """Bounded pool; opened later on the app's event loop (see `open_pool`)."""
+    return AsyncConnectionPool(dsn, min_size=min_size, max_size=max(max_size, min_size), open=False)
+
+
+async def open_pool(pool: AsyncConnectionPool, toast_compression: Optional[str] = None):
+    await pool.open(wait=True)
+    await PostgresCheckpointSaver.setup(pool, toast_compression)
+    logger.info(f"PostgreSQL checkpoint pool ready (max {pool.max_size} connections)")
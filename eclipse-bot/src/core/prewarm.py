@@ -0,0 +1,90 @@
+"""Startup prewarm for the FastAPI lifespan.
+
+Without it the first request after a (rolling) restart pays for the lazy
+model-registry fetch, agent graph compilation, LLM client setup and the
+first p4/OpenSearch round trips. These run concurrently on worker threads
+before Socket Mode connects; each component is timed and a failure or
+timeout only logs a warning (the lazy path still works at request time).
+
+Components in REQUIRED_COMPONENTS are checks rather than warm-ups: while one
+of them fails, /ready reports the pod as not ready and re-runs it on each
+probe, so e.g. an expired p4 ticket is visible and recovers once renewed.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Failures of these keep /ready at 503 (every p4 tool needs a valid ticket)
+REQUIRED_COMPONENTS = ("p4_login",)
+
+
+def build_components(ctx, settings) -> dict[str, Callable[[], Any]]:
+    """Warm-up steps for this deployment, by component name."""
+    from src.agents.factory import create_agent
+    from src.common.enums import PersonaType
+    from src.core.model_registry import load_model_registry
+
+    components: dict[str, Callable[[], Any]] = {"model_registry": load_model_registry}
+    for persona in (PersonaType.GENERAL, PersonaType.AUTOMATION):
+        components[f"agent:{persona}"] = lambda persona=persona: create_agent(persona_type=persona)
+    if ctx.p4:
+        components["p4_info"] = ctx.p4.info  # opens the server connection; succeeds without a ticket
+        components["p4_login"] = ctx.p4.login_status  # `p4 login -s`: status only, never prompts
+    if settings.opensearch_url:
+        components["opensearch"] = _ping_opensearch
+    return components
+
+
+def _ping_opensearch() -> bool:
+    from src.tools.opensearch_tools import get_opensearch_client
+    client = get_opensearch_client()
+    if client is None or not client.ping():
+        raise RuntimeError("OpenSearch ping failed")
+    return True
+
+
+async def _run_component(name: str, fn: Callable[[], Any], timeout: float) -> dict:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(asyncio.to_thread(fn), timeout=timeout)
+        status, error = "ok", None
+    except asyncio.TimeoutError:
+        status, error = "timeout", f"exceeded {timeout:g}s"
+    except Exception as e:
+        status, error = "failed", str(e)
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    if error:
+        logger.warning(f"Prewarm {name}: {status} after {elapsed_ms}ms ({error})")
+    else:
+        logger.info(f"Prewarm {name}: {elapsed_ms}ms")
+    return {"status": status, "ms": elapsed_ms, **({"error": error} if error else {})}
+
+
+async def prewarm(components: dict[str, Callable[[], Any]], timeout: float = 60.0) -> dict[str, dict]:
+    """Run every component concurrently; returns {name: {"status", "ms"[, "error"]}}."""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_run_component(name, fn, timeout) for name, fn in components.items()))
+    report = dict(zip(components, results))
+    failed = [name for name, result in report.items() if result["status"] != "ok"]
+    logger.info(
+        f"Prewarm finished in {(time.perf_counter() - start) * 1000:.0f}ms"
+        + (f" (not warmed: {', '.join(failed)})" if failed else "")
+    )
+    return report
+
+
+def readiness_failures(report: dict[str, dict]) -> list[str]:
+    """Required components that did not succeed in the last prewarm / recheck."""
+    return [name for name in REQUIRED_COMPONENTS if name in report and report[name]["status"] != "ok"]
+
+
+async def recheck(report: dict[str, dict], components: dict[str, Callable[[], Any]], timeout: float) -> list[str]:
+    """Re-run failed required components, updating `report` in place. Returns those still failing."""
+    for name in readiness_failures(report):
+        if name in components:
+            report[name] = await _run_component(name, components[name], timeout)
+    return readiness_failures(report)
@@ -0,0 +1,362 @@
+"""Redis Checkpointer for LangGraph.
+
+Stores checkpoints and pending writes in Redis so several eclipse-bot replicas
+can share session state. Key layout (`{t}` is the thread_id as a hash tag, so
+all keys of a thread live in one slot and MULTI works on Redis Cluster too):
+
+    {prefix}:{t}:index      ZSET of checkpoint ids (score 0; ids are uuid6, lexical order = time order)
+    {prefix}:{t}:head       STRING latest checkpoint id (WATCHed for optimistic concurrency)
+    {prefix}:{t}:c:{id}     HASH checkpoint, metadata, metadata_json, parent, created_at
+    {prefix}:{t}:w:{id}     HASH "{task_id}:{idx}" -> pending write
+
+Every put refreshes the TTL of the thread's keys (the index, head and every
+checkpoint still kept), so abandoned threads expire on their own and the
+index never outlives the checkpoints it lists; `keep_last` trims old
+checkpoints of active threads.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Iterator, AsyncIterator, Sequence
+
+import redis
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointTuple, CheckpointMetadata, WRITES_IDX_MAP
+
+from src.core.checkpoint_serde import CheckpointSerializer, CompactSerializer
+from src.core.checkpointer import CompactionMixin, ALIST_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointConflictError(RuntimeError):
+    """Another replica advanced the thread since this saver last saw its head."""
+
+
+class RedisCheckpointSaver(CompactionMixin, BaseCheckpointSaver):
+    """A checkpoint saver that stores state in Redis hashes."""
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        context_manager=None,
+        serializer: Optional[CheckpointSerializer] = None,
+        prefix: str = "eclipse:ckpt",
+        ttl_seconds: Optional[int] = 30 * 86400,
+        keep_last: int = 20,
+        max_retries: int = 5,
+        persist_compaction: bool = True,
+        max_threads: int = 64,
+    ):
+        """
+        Args:
+            client: Sync redis client (decode_responses=False).
+            prefix: Key prefix shared by all replicas.
+            ttl_seconds: Expiry of a thread's keys, refreshed on each put. None = never.
+            keep_last: Checkpoints kept per thread (0 = keep all).
+            max_retries: put() retries when a concurrent write touches the thread head.
+            max_threads: Threads whose head is remembered at once (least recently
+                  used dropped first). Heads are only needed from get_tuple to the
+                  end of a turn (`release_thread`).
+        """
+        super().__init__()
+        self.client = client
+        self.context_manager = context_manager  # Trimmer or AutoCompactor
+        self.serializer = serializer or CompactSerializer()
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.keep_last = keep_last
+        self.max_retries = max(max_retries, 1)
+        self.persist_compaction = persist_compaction
+        # Head this saver last loaded or wrote per thread; a put on top of it
+        # fails if another writer moved the head in between.
+        self._heads: "OrderedDict[str, str]" = OrderedDict()
+        self.max_threads = max(max_threads, 1)
+        self._heads_lock = threading.Lock()
+
+    # --- Keys ---
+
+    def _key(self, thread_id: str, *parts: str) -> str:
+        return ":".join([self.prefix, f"{{{thread_id}}}", *parts])
+
+    def _thread_ids(self) -> Iterator[str]:
+        start = len(self.prefix) + 2
+        for key in self.client.scan_iter(match=f"{self.prefix}:{{*}}:index", count=500):
+            key = key.decode() if isinstance(key, bytes) else key
+            yield key[start:-len("}:index")]
+
+    @staticmethod
+    def _str(value: Optional[bytes]) -> Optional[str]:
+        return value.decode() if isinstance(value, bytes) else value
+
+    # --- Async wrappers ---
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Asynchronous version of get_tuple."""
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: dict[str, Any],
+    ) -> RunnableConfig:
+        """Asynchronous version of put."""
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Store intermediate writes asynchronously."""
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """List checkpoints asynchronously, one page per worker-thread hop."""
+        rows = self.list(config, filter=filter, before=before, limit=limit)
+        try:
+            while True:
+                page = await asyncio.to_thread(lambda: [t for _, t in zip(range(ALIST_PAGE_SIZE), rows)])
+                for item in page:
+                    yield item
+                if len(page) < ALIST_PAGE_SIZE:
+                    return
+        finally:
+            rows.close()
+
+    # --- Reads ---
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        thread_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        checkpoint_id = thread_ts or self._str(self.client.get(self._key(thread_id, "head")))
+        if not checkpoint_id:
+            return None
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key(thread_id, "c", checkpoint_id))
+            pipe.hgetall(self._key(thread_id, "w", checkpoint_id))
+            data, writes = pipe.execute()
+        if not data:
+            return None
+
+        if not thread_ts:
+            self._remember_head(thread_id, checkpoint_id)
+        result = self._to_tuple(thread_id, checkpoint_id, data, writes)
+        return self._apply_context_manager(result, is_latest=not thread_ts)
+
+    def _remember_head(self, thread_id: str, checkpoint_id: str):
+        with self._heads_lock:
+            self._heads[thread_id] = checkpoint_id
+            self._heads.move_to_end(thread_id)
+            while len(self._heads) > self.max_threads:
+                self._heads.popitem(last=False)
+
+    def release_thread(self, thread_id: str):
+        """Forget the head seen for a thread (call when its turn ends)."""
+        with self._heads_lock:
+            self._heads.pop(thread_id, None)
+
+    def _to_tuple(self, thread_id: str, checkpoint_id: str, data: dict, writes: dict) -> CheckpointTuple:
+        parent_ts = self._str(data.get(b"parent")) or None
+        return CheckpointTuple(
+            self._make_config(thread_id, checkpoint_id),
+            self.serializer.loads(data[b"checkpoint"]),
+            self.serializer.loads(data[b"metadata"]),
+            self._make_config(thread_id, parent_ts) if parent_ts else None,
+            self._decode_writes(writes),
+        )
+
+    def _decode_writes(self, writes: dict) -> list[tuple[str, str, Any]]:
+        """Pending writes in LangGraph's (task_path, task_id, idx) order."""
+        decoded = [self.serializer.loads(blob) for blob in writes.values()]
+        decoded.sort(key=lambda w: (w["task_path"], w["task_id"], w["idx"]))
+        return [(w["task_id"], w["channel"], w["value"]) for w in decoded]
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """Stream checkpoints newest first; metadata filters are applied on metadata_json."""
+        configurable = (config or {}).get("configurable", {})
+        thread_ids = [configurable["thread_id"]] if configurable.get("thread_id") else self._thread_ids()
+        checkpoint_id = configurable.get("checkpoint_id") or configurable.get("thread_ts")
+        before_id = (before or {}).get("configurable", {}).get("checkpoint_id") if before else None
+
+        remaining = limit
+        for thread_id in thread_ids:
+            if checkpoint_id:
+                ids = [checkpoint_id]
+            else:
+                ids = [
+                    self._str(i) for i in self.client.zrevrangebylex(
+                        self._key(thread_id, "index"), f"({before_id}" if before_id else "+", "-"
+                    )
+                ]
+            # Fetch hashes one page per round trip
+            for start in range(0, len(ids), ALIST_PAGE_SIZE):
+                page = ids[start:start + ALIST_PAGE_SIZE]
+                with self.client.pipeline(transaction=False) as pipe:
+                    for cid in page:
+                        pipe.hgetall(self._key(thread_id, "c", cid))
+                        pipe.hgetall(self._key(thread_id, "w", cid))
+                    results = pipe.execute()
+                for cid, data, writes in zip(page, results[::2], results[1::2]):
+                    if not data:
+                        continue  # Expired, or trimmed by another replica
+                    if filter:
+                        metadata = json.loads(data.get(b"metadata_json") or b"{}")
+                        if any(metadata.get(k) != v for k, v in filter.items()):
+                            continue
+                    yield self._to_tuple(thread_id, cid, data, writes)
+                    if remaining is not None:
+                        remaining -= 1
+                        if remaining <= 0:
+                            return
+
+    # --- Writes ---
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Store the writes of one task in one pipelined round trip."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_id = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+        key = self._key(thread_id, "w", checkpoint_id)
+
+        # Special channels overwrite; regular writes are idempotent (HSETNX) for retried tasks
+        special = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        with self.client.pipeline(transaction=False) as pipe:
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                blob = self.serializer.dumps(
+                    {"task_id": task_id, "task_path": task_path, "idx": idx, "channel": channel, "value": value}
+                )
+                if special:
+                    pipe.hset(key, f"{task_id}:{idx}", blob)
+                else:
+                    pipe.hsetnx(key, f"{task_id}:{idx}", blob)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+            pipe.execute()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: dict[str, Any],
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        thread_ts = checkpoint["id"]
+        parent_ts = config["configurable"].get("checkpoint_id") or config["configurable"].get("thread_ts")
+
+        data = {
+            "checkpoint": self.serializer.dumps(checkpoint),
+            "metadata": self.serializer.dumps(metadata),
+            "metadata_json": json.dumps(metadata, default=str, ensure_ascii=False),
+            "parent": parent_ts or "",
+            "created_at": time.time(),
+        }
+        head_key = self._key(thread_id, "head")
+        index_key = self._key(thread_id, "index")
+        ckpt_key = self._key(thread_id, "c", thread_ts)
+
+        for _ in range(self.max_retries):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(head_key)
+                    head = self._str(pipe.get(head_key))
+                    # Checkpoints that survive this put's trim: their TTL is refreshed with the index
+                    kept = (
+                        [self._str(i) for i in pipe.zrange(index_key, -self.keep_last if self.keep_last else 0, -1)]
+                        if self.ttl_seconds else []
+                    )
+                    with self._heads_lock:
+                        expected = self._heads.get(thread_id)
+                    # Continuing from the head we saw, but someone else moved it: lost update
+                    if expected and parent_ts == expected and head and head != expected:
+                        raise CheckpointConflictError(
+                            f"Thread {thread_id} advanced to {head} while this replica was at {expected}"
+                        )
+                    pipe.multi()
+                    pipe.hset(ckpt_key, mapping=data)
+                    pipe.zadd(index_key, {thread_ts: 0})
+                    if not head or thread_ts > head:
+                        pipe.set(head_key, thread_ts)
+                    if self.ttl_seconds:
+                        for key in (ckpt_key, index_key, head_key):
+                            pipe.expire(key, self.ttl_seconds)
+                        for cid in kept:
+                            pipe.expire(self._key(thread_id, "c", cid), self.ttl_seconds)
+                            pipe.expire(self._key(thread_id, "w", cid), self.ttl_seconds)
+                    pipe.zcard(index_key)
+                    count = pipe.execute()[-1]
+                    break
+                except redis.WatchError:
+                    continue
+        else:
+            raise CheckpointConflictError(f"Gave up writing {thread_id} after {self.max_retries} concurrent updates")
+
+        self._remember_head(thread_id, thread_ts)
+        if self.keep_last and count > self.keep_last:
+            self._trim(thread_id, self.keep_last)
+        return self._make_config(thread_id, thread_ts)
+
+    def _trim(self, thread_id: str, keep_last: int) -> int:
+        """Delete all but the newest `keep_last` checkpoints of a thread."""
+        index_key = self._key(thread_id, "index")
+        old = [self._str(i) for i in self.client.zrange(index_key, 0, -(keep_last + 1))]
+        if not old:
+            return 0
+        with self.client.pipeline() as pipe:
+            for cid in old:
+                pipe.delete(self._key(thread_id, "c", cid), self._key(thread_id, "w", cid))
+            pipe.zrem(index_key, *old)
+            pipe.execute()
+        return len(old)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete all checkpoints and writes of a thread."""
+        index_key = self._key(thread_id, "index")
+        ids = [self._str(i) for i in self.client.zrange(index_key, 0, -1)]
+        with self.client.pipeline() as pipe:
+            for cid in ids:
+                pipe.delete(self._key(thread_id, "c", cid), self._key(thread_id, "w", cid))
+            pipe.delete(index_key, self._key(thread_id, "head"))
+            pipe.execute()
+        self.release_thread(thread_id)
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest", keep_last: int = 1) -> int:
+        """Drop all but the newest `keep_last` checkpoints of each thread. Returns deleted count."""
+        deleted = 0
+        for thread_id in thread_ids:
+            if strategy == "delete":
+                deleted += self.client.zcard(self._key(thread_id, "index"))
+                self.delete_thread(thread_id)
+            else:
+                deleted += self._trim(thread_id, max(keep_last, 1))
+        return deleted
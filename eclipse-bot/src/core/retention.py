@@ -0,0 +1,424 @@
+"""Checkpoint retention for the SQLite and PostgreSQL persistence backends.
+
+Only the latest checkpoint of a thread is read in normal operation, but every
+LangGraph step is stored. This background job keeps the DB small enough to
+stay in page cache:
+
+1. Prune: keep the newest `keep_last` checkpoints per thread.
+2. Archive: move threads idle longer than `idle_days` to a zstd cold file.
+   A saver created with the same `archive_dir` restores the thread the
+   next time it is read, so a user returning to an old Slack thread keeps
+   its history.
+3. Vacuum: return free pages to the OS with `PRAGMA incremental_vacuum`.
+   Needs auto_vacuum=INCREMENTAL: new DBs get it when opened through
+   SqliteConnectionManager; existing ones are converted once, offline, with
+   `python -m src.core.retention migrate-vacuum <db path>` (a full VACUUM).
+
+PostgreSQL (`PostgresRetentionWorker`) only prunes: every thread is cut to
+`keep_last` checkpoints and autovacuum reuses the freed space. Threads are
+not archived there, so idle history stays readable without a restore step.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from src.core.checkpointer import CustomSqliteSaver
+from src.core.checkpoint_serde import CompactSerializer
+
+logger = logging.getLogger(__name__)
+
+# Archives are always zstd, regardless of the row codec
+_ARCHIVE_SERIALIZER = CompactSerializer("zstd")
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def archive_path(archive_dir: str, thread_id: str) -> str:
+    return os.path.join(archive_dir, f"{_UNSAFE_FILENAME.sub('_', thread_id)}.ckpt.zst")
+
+
+def restore_archived_thread(saver: CustomSqliteSaver, archive_dir: str, thread_id: str) -> int:
+    """Load an archived thread back into the DB and delete its cold file. Returns rows restored.
+
+    Refused (0, file kept) if the thread already has rows again: archived seqs
+    and checkpoint ids would collide with the new history.
+    """
+    path = archive_path(archive_dir, thread_id)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        archive = _ARCHIVE_SERIALIZER.loads(f.read())
+
+    def _restore(conn) -> bool:
+        live = conn.execute(
+            "SELECT 1 FROM checkpoints WHERE thread_id = ? UNION ALL SELECT 1 FROM messages WHERE thread_id = ? LIMIT 1",
+            (thread_id, thread_id),
+        ).fetchone()
+        if live:
+            return False
+        conn.executemany(
+            "INSERT INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint, metadata, kind, depth, metadata_json, created_at) "
+            "VALUES (:thread_id, :thread_ts, :parent_ts, :checkpoint, :metadata, :kind, :depth, :metadata_json, :created_at)",
+            [{**row, "thread_id": thread_id} for row in archive["checkpoints"]],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO writes (thread_id, checkpoint_id, task_id, idx, channel, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(thread_id, *w) for w in archive["writes"]],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO blobs (digest, payload, size, created_at) VALUES (?, ?, ?, ?)",
+            archive.get("blobs", []),
+        )
+        # Older archives lack the blob_digest / elided_digest columns
+        conn.executemany(
+            "INSERT INTO messages (thread_id, seq, message_id, role, payload, blob_digest, elided_digest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(thread_id, *m[:6], *([None] * (6 - len(m)))) for m in archive.get("messages", [])],
+        )
+        return True
+
+    saver.flush(thread_id)
+    if not saver.db.write(_restore):
+        logger.warning(f"Not restoring archived thread {thread_id}: it has new rows since it was archived ({path})")
+        return 0
+    os.remove(path)
+    logger.info(f"Restored archived thread {thread_id} ({len(archive['checkpoints'])} checkpoints)")
+    return len(archive["checkpoints"])
+
+
+def migrate_incremental_vacuum(db_path: str):
+    """One-time switch of an existing DB to auto_vacuum=INCREMENTAL (full VACUUM; run with the bot stopped)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            logger.info(f"{db_path} already uses auto_vacuum=INCREMENTAL")
+            return
+        start = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"Switched {db_path} to auto_vacuum=INCREMENTAL in {time.perf_counter() - start:.1f}s")
+    finally:
+        conn.close()
+
+
+class RetentionWorker:
+    """Periodic prune / archive / incremental vacuum of the checkpoints table."""
+
+    def __init__(
+        self,
+        saver: CustomSqliteSaver,
+        keep_last: int = 20,
+        idle_days: float = 30.0,
+        archive_dir: Optional[str] = None,
+        interval_seconds: float = 3600.0,
+        vacuum_pages: int = 2000,
+    ):
+        """
+        Args:
+            saver: Checkpointer whose tables are maintained.
+            keep_last: Checkpoints kept per thread (>= 1, extra ones allow time travel).
+            idle_days: Threads with no checkpoint for this long are archived. 0 disables.
+            archive_dir: Directory for cold files. None disables archiving.
+            interval_seconds: Delay between runs of the background loop.
+            vacuum_pages: Max pages released per incremental_vacuum call.
+        """
+        self.saver = saver
+        self.keep_last = max(keep_last, 1)
+        self.idle_days = idle_days
+        self.archive_dir = archive_dir
+        self.interval_seconds = interval_seconds
+        self.vacuum_pages = vacuum_pages
+        self._archive_serializer = _ARCHIVE_SERIALIZER
+        self._vacuum_warned = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.last_run: dict = {}
+        self.totals = {"runs": 0, "rows_deleted": 0, "threads_archived": 0, "bytes_reclaimed": 0, "seconds": 0.0}
+
+    # --- Background loop ---
+
+    def start(self):
+        """Schedule the background loop on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Checkpoint retention failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    # --- One pass ---
+
+    def run_once(self) -> dict:
+        """Prune, archive and vacuum once. Returns the stats of this run."""
+        start = time.perf_counter()
+        self.saver.flush()  # Write-behind rows must be visible to the counts below
+
+        with self.saver.db.read() as conn:
+            thread_ids = [
+                row[0] for row in conn.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING COUNT(*) > ?",
+                    (self.keep_last,),
+                )
+            ]
+        rows_deleted = self.saver.prune(thread_ids, keep_last=self.keep_last)
+
+        archived = 0
+        if self.archive_dir and self.idle_days > 0:
+            for thread_id in self._idle_threads():
+                moved = self.archive_thread(thread_id)
+                rows_deleted += moved
+                archived += 1 if moved else 0
+
+        bytes_reclaimed = self._incremental_vacuum()
+
+        stats = {
+            "rows_deleted": rows_deleted,
+            "threads_archived": archived,
+            "bytes_reclaimed": bytes_reclaimed,
+            "seconds": round(time.perf_counter() - start, 3),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.last_run = stats
+        self.totals["runs"] += 1
+        for key in ("rows_deleted", "threads_archived", "bytes_reclaimed", "seconds"):
+            self.totals[key] += stats[key]
+        logger.info(
+            f"Checkpoint retention: deleted {rows_deleted} rows, archived {archived} threads, "
+            f"reclaimed {bytes_reclaimed} bytes in {stats['seconds']}s"
+        )
+        return stats
+
+    # --- Archiving ---
+
+    def _idle_threads(self) -> list[str]:
+        cutoff = time.time() - self.idle_days * 86400
+        self._backfill_created_at()
+        with self.saver.db.read() as conn:
+            return [
+                row[0] for row in conn.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?",
+                    (cutoff,),
+                )
+            ]
+
+    def _backfill_created_at(self):
+        """Rows written before created_at existed: take the time from the latest checkpoint's `ts`."""
+        with self.saver.db.read() as conn:
+            rows = conn.execute(
+                "SELECT thread_id, MAX(thread_ts) FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) IS NULL"
+            ).fetchall()
+            updates = []
+            for thread_id, thread_ts in rows:
+                blob = conn.execute(
+                    "SELECT checkpoint FROM checkpoints WHERE thread_id = ? AND thread_ts = ?", (thread_id, thread_ts)
+                ).fetchone()[0]
+                try:
+                    ts = datetime.fromisoformat(self.saver.serializer.loads(blob)["ts"]).timestamp()
+                except Exception:
+                    ts = time.time()  # Unknown age: start the idle clock now
+                updates.append((ts, thread_id, thread_ts))
+        if updates:
+            self.saver.db.write(lambda conn: conn.executemany(
+                "UPDATE checkpoints SET created_at = ? WHERE thread_id = ? AND thread_ts = ?", updates
+            ))
+
+    def _archive_path(self, thread_id: str) -> str:
+        return archive_path(self.archive_dir, thread_id)
+
+    @staticmethod
+    def _thread_version(conn: sqlite3.Connection, thread_id: str) -> tuple:
+        """Row counts and newest keys of a thread; changes with any put / put_writes."""
+        return (
+            *conn.execute("SELECT COUNT(*), MAX(thread_ts) FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchone(),
+            *conn.execute("SELECT COUNT(*), MAX(seq) FROM messages WHERE thread_id = ?", (thread_id,)).fetchone(),
+            conn.execute("SELECT COUNT(*) FROM writes WHERE thread_id = ?", (thread_id,)).fetchone()[0],
+        )
+
+    def archive_thread(self, thread_id: str) -> int:
+        """Write all rows of a thread to its cold file, then delete them. Returns rows moved.
+
+        The delete re-checks in its write transaction that the thread is
+        unchanged since it was read; a put that landed in between aborts the
+        archive (file removed) instead of being deleted unarchived.
+        """
+        self.saver.flush(thread_id)
+        with self.saver.db.read() as conn:
+            version = self._thread_version(conn, thread_id)
+            columns = "thread_ts, parent_ts, checkpoint, metadata, kind, depth, metadata_json, created_at"
+            rows = [
+                dict(zip(columns.split(", "), row))
+                for row in conn.execute(f"SELECT {columns} FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            ]
+            writes = conn.execute(
+                "SELECT checkpoint_id, task_id, idx, channel, value, task_path FROM writes WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchall()
+            messages = conn.execute(
+                "SELECT seq, message_id, role, payload, blob_digest, elided_digest FROM messages WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            blobs = conn.execute(
+                "SELECT digest, payload, size, created_at FROM blobs WHERE digest IN "
+                "(SELECT blob_digest FROM messages WHERE thread_id = ? AND blob_digest IS NOT NULL "
+                "UNION SELECT elided_digest FROM messages WHERE thread_id = ? AND elided_digest IS NOT NULL)",
+                (thread_id, thread_id),
+            ).fetchall()
+        if not rows:
+            return 0
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self._archive_path(thread_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._archive_serializer.dumps({
+                "thread_id": thread_id,
+                "checkpoints": rows,
+                "writes": [list(w) for w in writes],
+                "messages": [list(m) for m in messages],
+                "blobs": [list(b) for b in blobs],
+            }))
+        os.replace(tmp_path, path)  # Only delete from the DB once the file is complete
+
+        write_buffer = self.saver.write_buffer
+
+        def _delete(conn: sqlite3.Connection) -> bool:
+            if self._thread_version(conn, thread_id) != version or (write_buffer and write_buffer.has_pending(thread_id)):
+                return False
+            self.saver._delete_thread_rows(conn, thread_id)
+            return True
+
+        if not self.saver.db.write(_delete):
+            os.remove(path)
+            logger.info(f"Not archiving thread {thread_id}: it was written to while being archived")
+            return 0
+        self.saver.forget_thread(thread_id)
+        return len(rows)
+
+    def restore_thread(self, thread_id: str) -> int:
+        """Load an archived thread back into the DB. Returns rows restored."""
+        if not self.archive_dir:
+            return 0
+        return restore_archived_thread(self.saver, self.archive_dir, thread_id)
+
+    # --- Vacuum ---
+
+    def _incremental_vacuum(self) -> int:
+        with self.saver.db.read() as conn:
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            # Never VACUUM here: it rewrites the whole DB and blocks every checkpoint write
+            if not self._vacuum_warned:
+                logger.warning(
+                    "Persistence DB does not use auto_vacuum=INCREMENTAL; free pages are not returned to the OS. "
+                    "Run `python -m src.core.retention migrate-vacuum <db path>` during maintenance."
+                )
+                self._vacuum_warned = True
+            return 0
+
+        def _vacuum(conn):
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return (before - after) * page_size
+
+        return self.saver.db.write(_vacuum)
+
+    def get_stats(self) -> dict:
+        return {"last_run": self.last_run, "totals": self.totals}
+
+
+class PostgresRetentionWorker:
+    """Periodic prune of the PostgreSQL checkpoints table (same loop and stats as RetentionWorker)."""
+
+    def __init__(self, saver, keep_last: int = 20, interval_seconds: float = 3600.0, batch_size: int = 500):
+        """
+        Args:
+            saver: PostgresCheckpointSaver whose tables are maintained.
+            keep_last: Checkpoints kept per thread (>= 1).
+            interval_seconds: Delay between runs of the background loop.
+            batch_size: Threads pruned per transaction.
+        """
+        self.saver = saver
+        self.keep_last = max(keep_last, 1)
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(batch_size, 1)
+        self._task: Optional[asyncio.Task] = None
+
+        self.last_run: dict = {}
+        self.totals = {"runs": 0, "rows_deleted": 0, "seconds": 0.0}
+
+    def start(self):
+        """Schedule the background loop on the running event loop (the pool's loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Checkpoint retention failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self) -> dict:
+        """Prune every thread over `keep_last` checkpoints once. Returns the stats of this run."""
+        start = time.perf_counter()
+        async with self.saver.pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING COUNT(*) > %s", (self.keep_last,)
+            )
+            thread_ids = [row[0] for row in await cursor.fetchall()]
+        rows_deleted = 0
+        for i in range(0, len(thread_ids), self.batch_size):
+            rows_deleted += await self.saver.aprune(thread_ids[i:i + self.batch_size], keep_last=self.keep_last)
+
+        stats = {
+            "rows_deleted": rows_deleted,
+            "threads_pruned": len(thread_ids),
+            "seconds": round(time.perf_counter() - start, 3),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.last_run = stats
+        self.totals["runs"] += 1
+        for key in ("rows_deleted", "seconds"):
+            self.totals[key] += stats[key]
+        logger.info(f"Checkpoint retention: pruned {len(thread_ids)} threads, deleted {rows_deleted} rows in {stats['seconds']}s")
+        return stats
+
+    def get_stats(self) -> dict:
+        return {"last_run": self.last_run, "totals": self.totals}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) != 3 or sys.argv[1] != "migrate-vacuum":
+        sys.exit("usage: python -m src.core.retention migrate-vacuum <db path>")
+    migrate_incremental_vacuum(sys.argv[2])
@@ -0,0 +1,112 @@
+"""Per-session actors for the dispatcher.
+
+Every Slack thread (session_id) maps to one checkpoint thread, so two agent
+runs for the same session race on its checkpoints and pay for the same
+context twice. Each session gets a single consumer instead:
+
+- events for a session are queued and handled one run at a time,
+- follow-ups that arrive while a run is in flight are handed to the next run
+  as one batch (the dispatcher merges them into a single turn),
+- the backlog is bounded; `submit` refuses events beyond it,
+- an actor exits after `idle_seconds` without events and is recreated on
+  the next one.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SessionScheduler:
+    """One single-consumer queue per session, with batched follow-ups."""
+
+    def __init__(
+        self,
+        handler: Callable[[str, list], Awaitable[Any]],
+        max_backlog: int = 8,
+        idle_seconds: float = 300.0,
+    ):
+        self.handler = handler  # handler(session_id, items) runs one turn for a batch of items
+        self.max_backlog = max(max_backlog, 1)
+        self.idle_seconds = idle_seconds
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._actors: dict[str, asyncio.Task] = {}
+        self._running: set[str] = set()
+        self.submitted = 0
+        self.batches = 0
+        self.merged = 0
+        self.rejected = 0
+        self.failed = 0
+        self.reaped = 0
+
+    def submit(self, session_id: str, item: Any) -> bool:
+        """Queue an item for the session's actor. False if its backlog is full."""
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = asyncio.Queue(maxsize=self.max_backlog)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Session {session_id} backlog full ({self.max_backlog}), event rejected")
+            return False
+        self.submitted += 1
+        if session_id not in self._actors:
+            self._actors[session_id] = asyncio.create_task(self._actor(session_id, queue))
+        return True
+
+    def is_busy(self, session_id: str) -> bool:
+        """True while a run for the session is in flight."""
+        return session_id in self._running
+
+    async def _actor(self, session_id: str, queue: asyncio.Queue):
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=self.idle_seconds)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        self.reaped += 1
+                        return
+                    continue
+                # Everything that queued up during the previous run goes into this one
+                batch = [item]
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+                self.batches += 1
+                self.merged += len(batch) - 1
+                self._running.add(session_id)
+                try:
+                    await self.handler(session_id, batch)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Session {session_id} run failed: {e}")
+                finally:
+                    self._running.discard(session_id)
+        finally:
+            self._actors.pop(session_id, None)
+            if self._queues.get(session_id) is queue and queue.empty():
+                del self._queues[session_id]
+
+    async def aclose(self):
+        """Cancel every actor (in-flight runs included) and drop queued events."""
+        actors = list(self._actors.values())
+        for task in actors:
+            task.cancel()
+        await asyncio.gather(*actors, return_exceptions=True)
+        self._queues.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "sessions": len(self._actors),
+            "running": len(self._running),
+            "queued": sum(q.qsize() for q in self._queues.values()),
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "merged": self.merged,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "reaped": self.reaped,
+        }
@@ -5,17 +5,27 @@ from typing import Callable, Optional
 from slack_bolt.async_app import AsyncApp
 from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 
+from .event_dedup import EventDeduplicator, event_keys
+
 logger = logging.getLogger(__name__)
 
 
 class SlackIntegration:
     """Slack Bot integration for Eclipse Bot."""
 
-    def __init__(self, bot_token: str, app_token: str):
+    def __init__(
+        self,
+        bot_token: str,
+        app_token: str,
+        dedup: Optional[EventDeduplicator] = None,
+        drop_retries: bool = True,
+    ):
         self.app = AsyncApp(token=bot_token)
         self.app_token = app_token
         self.handler: Optional[AsyncSocketModeHandler] = None
         self._bot_user_id: Optional[str] = None
+        self.dedup = dedup or EventDeduplicator()
+        self.drop_retries = drop_retries
         self._setup_handlers()
 
     def _setup_handlers(self):
@@ -29,18 +39,54 @@ class SlackIntegration:
             self._bot_user_id = auth_test["user_id"]
         return self._bot_user_id
 
+    async def _is_duplicate(self, event: dict, body: dict, request, by_message: bool = True) -> bool:
+        """True for Slack retries and for events already claimed (by event_id or channel + ts)."""
+        # Socket Mode sends retry_attempt 0 (header "0") on every first delivery
+        retry_num = (request.headers.get("x-slack-retry-num") or [None])[0] if request else None
+        try:
+            retry_num = int(retry_num or 0)
+        except ValueError:
+            retry_num = 0
+        if retry_num > 0 and self.drop_retries:
+            self.dedup.record_retry()
+            logger.info(f"Dropping Slack retry #{retry_num} of {body.get('event_id')} ({(request.headers.get('x-slack-retry-reason') or ['?'])[0]})")
+            return True
+        keys = event_keys(event if by_message else {}, body.get("event_id"))
+        if not await self.dedup.claim(keys):
+            logger.info(f"Dropping duplicate Slack event {body.get('event_id')} ({event.get('channel')}/{event.get('ts')})")
+            return True
+        return False
+
     def on_mention(self, handler: Callable):
         """Register a handler for app mentions."""
         @self.app.event("app_mention")
-        async def internal_handler(event, say):
-            await handler(event, say)
+        async def internal_handler(event, say, body, request):
+            if not await self._is_duplicate(event, body, request):
+                await handler(event, say)
 
     def on_message(self, handler: Callable):
-        """Register a handler for direct messages."""
+        """Register a handler for every message event (deduplicated by event_id only)."""
         @self.app.event("message")
-        async def internal_handler(event, say):
+        async def internal_handler(event, say, body, request):
             # Bolt handles filtering (e.g. only DMs) if needed via matchers
-            await handler(event, say)
+            if not await self._is_duplicate(event, body, request, by_message=False):
+                await handler(event, say)
+
+    def on_direct_message(self, handler: Callable):
+        """Register a handler for direct messages.
+
+        DM mentions also fire `app_mention`; whichever arrives first handles
+        the message (same channel + ts), the other is dropped.
+        """
+        @self.app.event("message")
+        async def internal_handler(event, say, body, request):
+            if not event.get("channel", "").startswith("D"):
+                return
+            if not await self._is_duplicate(event, body, request):
+                await handler(event, say)
+
+    def get_dedup_stats(self) -> dict:
+        return self.dedup.get_stats()
 
     async def send_message(
         self,
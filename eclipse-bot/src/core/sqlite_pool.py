@@ -0,0 +1,235 @@
+"""SQLite connection management for the checkpointer.
+
+SQLite allows one writer at a time, so all writes go through a single
+connection owned by a dedicated writer thread (fed by a queue). Reads use a
+small pool of WAL connections and never wait for the writer.
+
+`SharedConnection` adapts a plain `sqlite3.Connection` (e.g. ':memory:' in
+tests) to the same interface, guarding writes with a lock.
+"""
+
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def apply_pragmas(conn: sqlite3.Connection, mmap_size: int, cache_size_kb: int, synchronous: str = "NORMAL"):
+    """Performance PRAGMAs shared by writer and reader connections."""
+    synchronous = synchronous.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown synchronous mode: {synchronous}")
+    # NORMAL is safe with WAL and skips the fsync per commit; FULL fsyncs every commit
+    conn.execute(f"PRAGMA synchronous={synchronous};")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)};")
+    conn.execute(f"PRAGMA cache_size={-int(cache_size_kb)};")  # Negative = KiB
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA busy_timeout=5000;")
+
+
+class SharedConnection:
+    """Single shared connection (legacy mode). Writes are serialized by a lock."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._write_lock = threading.Lock()
+
+    def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `fn(conn)` inside a transaction."""
+        with self._write_lock:
+            with self.conn:
+                return fn(self.conn)
+
+    async def awrite(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        return await asyncio.to_thread(self.write, fn)
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+        """Run `fn(conn)` now; returns an already completed Future (same API as the manager)."""
+        future: Future = Future()
+        try:
+            future.set_result(self.write(fn))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        # sqlite3 serializes statements on one connection; only transactions need the lock
+        yield self.conn
+
+    def close(self):
+        self.conn.close()
+
+
+class SqliteConnectionManager:
+    """One writer thread + a pool of read connections on a WAL database."""
+
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int = 4,
+        mmap_size: int = 256 * 1024 * 1024,
+        cache_size_kb: int = 64 * 1024,
+        synchronous: str = "NORMAL",
+    ):
+        """
+        Args:
+            db_path: Path of the SQLite file (':memory:' is not supported, use SharedConnection).
+            pool_size: Maximum number of read connections.
+            mmap_size: PRAGMA mmap_size in bytes.
+            cache_size_kb: PRAGMA cache_size in KiB (per connection).
+            synchronous: PRAGMA synchronous of the writer (OFF / NORMAL / FULL / EXTRA).
+        """
+        self.db_path = db_path
+        self.pool_size = max(pool_size, 1)
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+
+        # Writer connection is opened here so PermissionError etc. surface to the caller
+        self._writer_conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Takes effect only on a new (empty) DB; existing ones need the offline
+        # migration in src.core.retention. Lets retention release free pages.
+        self._writer_conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        self._writer_conn.execute("PRAGMA journal_mode=WAL;")
+        apply_pragmas(self._writer_conn, mmap_size, cache_size_kb, synchronous)
+
+        self._jobs: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+        # Every reader this pool opened (idle or borrowed); borrowing waits on the condition
+        self._readers: set[sqlite3.Connection] = set()
+        self._idle_readers: list[sqlite3.Connection] = []
+        self._readers_cond = threading.Condition()
+        self._opening = 0  # slots reserved by readers being opened
+        self._closed = False
+
+    # --- Writes ---
+
+    def _writer_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is _STOP:
+                break
+            fn, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self._writer_conn:
+                    result = fn(self._writer_conn)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+        self._writer_conn.close()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+        """Queue `fn(conn)` to run in its own transaction on the writer thread."""
+        if self._closed:
+            raise RuntimeError("SqliteConnectionManager is closed")
+        future: Future = Future()
+        self._jobs.put((fn, future))
+        return future
+
+    def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `fn(conn)` on the writer thread and wait for the result."""
+        if threading.current_thread() is self._writer:
+            raise RuntimeError("Nested write() from the writer thread would deadlock")
+        return self.submit(fn).result()
+
+    async def awrite(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Async variant of write(); no worker-thread hop, just awaits the writer."""
+        return await asyncio.wrap_future(self.submit(fn))
+
+    # --- Reads ---
+
+    def _open_reader(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        apply_pragmas(conn, self.mmap_size, self.cache_size_kb)
+        conn.execute("PRAGMA query_only=ON;")
+        return conn
+
+    @contextmanager
+    def read(self, timeout: float = 30.0) -> Iterator[sqlite3.Connection]:
+        """Borrow a read connection from the pool (waits up to `timeout` for a free one)."""
+        conn = self._acquire_reader(timeout)
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    def _acquire_reader(self, timeout: float) -> sqlite3.Connection:
+        with self._readers_cond:
+            # A slot is reserved (added to the count) before the connection exists
+            if not self._readers_cond.wait_for(
+                lambda: self._closed or self._idle_readers or len(self._readers) + self._opening < self.pool_size,
+                timeout,
+            ):
+                raise TimeoutError(f"No SQLite read connection free after {timeout:g}s")
+            if self._closed:
+                raise RuntimeError("SqliteConnectionManager is closed")
+            if self._idle_readers:
+                return self._idle_readers.pop()
+            self._opening += 1
+        try:
+            conn = self._open_reader()
+        except BaseException:
+            # Give the slot back, or the pool shrinks for good
+            with self._readers_cond:
+                self._opening -= 1
+                self._readers_cond.notify()
+            raise
+        with self._readers_cond:
+            self._opening -= 1
+            self._readers.add(conn)
+        return conn
+
+    def _release_reader(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        finally:
+            with self._readers_cond:
+                if self._closed:
+                    # Borrowed across close(): close it on return instead of leaking it
+                    self._readers.discard(conn)
+                    conn.close()
+                else:
+                    self._idle_readers.append(conn)
+                self._readers_cond.notify()
+
+    # --- Lifecycle ---
+
+    def close(self, timeout: float = 10.0):
+        """Drain pending writes and close all connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(_STOP)
+        self._writer.join(timeout)
+        with self._readers_cond:
+            for conn in self._idle_readers:
+                self._readers.discard(conn)
+                conn.close()
+            self._idle_readers.clear()
+            self._readers_cond.notify_all()
+        logger.info(f"Closed SQLite connections for {self.db_path}")
+
+
+def as_connection_manager(conn: Any):
+    """Accept either a manager or a raw sqlite3.Connection."""
+    if isinstance(conn, sqlite3.Connection):
+        return SharedConnection(conn)
+    return conn
@@ -0,0 +1,194 @@
+"""Local token accounting for context management.
+
+`AutoCompactor` checks the thread size on every load. Re-tokenizing a 100k+
+token history each time (through the chat model's counter) dominates that
+check, so counts are kept per message instead:
+
+- a local tiktoken encoding chosen per model family (OpenRouter ids such as
+  "openai/gpt-4o" or "moonshotai/kimi-k2.5"); a script-aware character
+  estimate when tiktoken is not installed,
+- counts memoized by message content hash, shared by every thread,
+- running totals per thread, so a load that only appended messages only
+  tokenizes the new ones. Only (message id, content digest) fingerprints are
+  kept per thread, never the messages themselves, and the entry is dropped
+  when the thread's turn ends (`release_thread`).
+
+Counts of non-OpenAI families are approximations (their tokenizers are not
+public), which is fine for threshold checks that keep a safety margin.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional tokenizer
+    tiktoken = None
+
+# Model name prefixes (after the "vendor/" part) tokenized with o200k_base;
+# everything else uses cl100k_base.
+O200K_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5", "o1", "o3", "o4", "chatgpt")
+
+# Chat format overhead per message (role, separators), as in OpenAI's cookbook
+TOKENS_PER_MESSAGE = 4
+# Flat cost of a non-text content block (image, file)
+TOKENS_PER_MEDIA_BLOCK = 85
+
+
+def encoding_name_for(model_name: Optional[str]) -> str:
+    """tiktoken encoding used for a model id ("vendor/model", "provider:model" or bare)."""
+    name = (model_name or "").lower().split("/")[-1].split(":")[-1]
+    return "o200k_base" if name.startswith(O200K_PREFIXES) else "cl100k_base"
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free estimate: ~4 chars per token for ASCII, ~1 per char otherwise (Hangul, CJK)."""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def content_digest(text: str) -> bytes:
+    """Stable 128-bit digest of a message's text (memo keys, thread fingerprints)."""
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def message_text(message: BaseMessage) -> tuple[str, int]:
+    """Text the model sees for a message, plus the number of non-text content blocks."""
+    content = message.content
+    media = 0
+    if isinstance(content, str):
+        text = content
+    else:
+        parts = []
+        for block in content or []:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and isinstance(block.get("text"), str):
+                parts.append(block["text"])
+            else:
+                media += 1
+        text = "\n".join(parts)
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        text += json.dumps([{"name": c.get("name"), "args": c.get("args")} for c in tool_calls], ensure_ascii=False)
+    return text, media
+
+
+class TokenCounter:
+    """Memoized per-message token counts with incremental per-thread totals."""
+
+    def __init__(self, model_name: Optional[str] = None, max_entries: int = 50_000, max_threads: int = 1024):
+        self.model_name = model_name
+        self.encoding_name = encoding_name_for(model_name)
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:  # encoding files unavailable (offline)
+                logger.warning(f"tiktoken encoding {self.encoding_name} unavailable, estimating tokens: {e}")
+        self.max_entries = max_entries
+        self.max_threads = max_threads
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        # thread_id -> ((message id, content digest) per message of the last count, total),
+        # least recently counted first
+        self._totals: "OrderedDict[str, tuple[list[tuple], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def count_message(self, message: BaseMessage) -> int:
+        text, media = message_text(message)
+        return self._count(message.type, text, content_digest(text), media)
+
+    def _count(self, role: str, text: str, digest: bytes, media: int) -> int:
+        key = (role, digest, media)
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = self.count_text(text) + media * TOKENS_PER_MEDIA_BLOCK + TOKENS_PER_MESSAGE
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: Sequence[BaseMessage], thread_id: Optional[str] = None) -> int:
+        """Total tokens; with `thread_id`, only messages appended since the last call are counted."""
+        if thread_id is None:
+            return sum(self.count_message(m) for m in messages)
+        texts = [message_text(m) for m in messages]
+        digests = [content_digest(text) for text, _ in texts]
+        fingerprints = [(m.id, digest) for m, digest in zip(messages, digests)]
+        with self._lock:
+            previous = self._totals.get(thread_id)
+        start, total = 0, 0
+        if previous:
+            prev_fingerprints, prev_total = previous
+            # Same messages in the same order: the history was only appended to
+            if fingerprints[:len(prev_fingerprints)] == prev_fingerprints:
+                start, total = len(prev_fingerprints), prev_total
+        total += sum(
+            self._count(m.type, text, digest, media)
+            for m, (text, media), digest in zip(messages[start:], texts[start:], digests[start:])
+        )
+        with self._lock:
+            self._totals[thread_id] = (fingerprints, total)
+            self._totals.move_to_end(thread_id)
+            if len(self._totals) > self.max_threads:
+                self._totals.popitem(last=False)
+        return total
+
+    def release_thread(self, thread_id: str):
+        """Drop the running total of a thread (its turn ended)."""
+        with self._lock:
+            self._totals.pop(thread_id, None)
+
+    def get_stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "encoding": self.encoding_name if self._encoding is not None else "estimate",
+                "entries": len(self._counts),
+                "threads": len(self._totals),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_counters: dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model_name: Optional[str] = None) -> TokenCounter:
+    """Shared counter per encoding, so every agent instance reuses the same memo."""
+    encoding_name = encoding_name_for(model_name)
+    with _counters_lock:
+        if encoding_name not in _counters:
+            _counters[encoding_name] = TokenCounter(model_name)
+        return _counters[encoding_name]
+
+
+def release_thread(thread_id: str):
+    """Drop a thread's running total from every shared counter."""
+    with _counters_lock:
+        counters = list(_counters.values())
+    for counter in counters:
+        counter.release_thread(thread_id)
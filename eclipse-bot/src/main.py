@@ -3,15 +3,17 @@
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 from src.config import get_settings
 from src.core import SlackIntegration, PerforceClient
 from src.core.context import get_context
 # Import Dispatcher
-from src.core.dispatcher import handle_event_trigger
+from src.core.dispatcher import handle_event_trigger, close_sessions
 # Import API Router
 from src.api.routes import router as api_router
 from src.common.enums import TriggerType
+from src.core.event_dedup import EventDeduplicator
 
 # Configure logging
 logging.basicConfig(
@@ -22,6 +24,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def create_event_deduplicator(settings) -> EventDeduplicator:
+    """Seen-event set for Slack dedup; Redis-backed so replicas share it (Settings.slack_dedup_*)."""
+    redis_client = None
+    if settings.slack_dedup_backend == "redis":
+        import redis
+        redis_client = redis.Redis.from_url(settings.persistence_redis_url, health_check_interval=30)
+    return EventDeduplicator(ttl_seconds=settings.slack_dedup_ttl_seconds, redis=redis_client)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler for startup/shutdown."""
@@ -34,6 +45,8 @@ async def lifespan(app: FastAPI):
     ctx.slack = SlackIntegration(
         bot_token=settings.slack_bot_token,
         app_token=settings.slack_app_token,
+        dedup=create_event_deduplicator(settings),
+        drop_retries=settings.slack_drop_retries,
     )
     ctx.p4 = PerforceClient()
     
@@ -42,15 +55,39 @@ async def lifespan(app: FastAPI):
     async def handle_mention(event: dict, say):
         await handle_event_trigger(event, say, trigger_type=TriggerType.MENTION)
 
-    @ctx.slack.on_message
+    @ctx.slack.on_direct_message
     async def handle_any_message(event: dict, say):
-        channel = event.get("channel", "")
-        if channel.startswith("D"): # Handle DMs
-            await handle_event_trigger(event, say, trigger_type=TriggerType.DM)
+        await handle_event_trigger(event, say, trigger_type=TriggerType.DM)
+
+    # Persistence pools bound to the event loop (PostgreSQL)
+    from src.agents.factory import open_persistence
+    await open_persistence()
+
+    # Checkpoint retention (prune / archive / incremental vacuum)
+    if settings.retention_enabled:
+        from src.agents.factory import create_retention_worker
+        ctx.retention = create_retention_worker()
+        if ctx.retention:
+            ctx.retention.start()
+
+    # Warm caches and clients before taking traffic (first request stays fast)
+    if settings.prewarm_enabled:
+        from src.core.prewarm import build_components, prewarm
+        ctx.prewarm = await prewarm(build_components(ctx, settings), timeout=settings.prewarm_timeout_seconds)
 
     await ctx.slack.start()
+    ctx.ready = True
     yield
+    ctx.ready = False
     await ctx.slack.stop()
+    await close_sessions()
+
+    if ctx.retention:
+        await ctx.retention.stop()
+
+    # Flush pending checkpoint writes before the process exits
+    from src.agents.factory import close_persistence
+    await close_persistence()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -61,3 +98,18 @@ app.include_router(api_router, prefix="/api/v1")
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "platform": "eclipse-orchestrator"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once prewarm is done and Socket Mode is connected (unlike /health, which is liveness)."""
+    ctx = get_context()
+    if not ctx.ready:
+        return JSONResponse(status_code=503, content={"status": "starting", "prewarm": ctx.prewarm})
+    from src.core.prewarm import build_components, readiness_failures, recheck
+    if readiness_failures(ctx.prewarm):
+        settings = get_settings()
+        failed = await recheck(ctx.prewarm, build_components(ctx, settings), timeout=min(settings.prewarm_timeout_seconds, 10.0))
+        if failed:
+            return JSONResponse(status_code=503, content={"status": "degraded", "failed": failed, "prewarm": ctx.prewarm})
+    return {"status": "ready", "prewarm": ctx.prewarm}
@@ -0,0 +1,140 @@
+import sys
+import os
+import time
+import sqlite3
+import tempfile
+import random
+import statistics
+
+# Add src to path
+sys.path.append("/app")
+
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
+from src.core.checkpointer import CustomSqliteSaver
+from src.core.checkpoint_serde import PickleSerializer, CompactSerializer, get_serializer
+from src.core.checkpoint_cache import CheckpointCache
+
+# Synthetic review thread: p4_describe diffs and p4_print bodies dominate real threads
+IDENTIFIERS = ["Manager", "Inventory", "Quest", "Guild", "Party", "Mail", "Trade", "Ranking", "Battle", "Dungeon"]
+
+
+def make_diff(seed: int) -> str:
+    rng = random.Random(seed)
+    lines = []
+    for i in range(150):
+        name = rng.choice(IDENTIFIERS)
+        line_no = rng.randint(1, 5000)
+        lines.append(
+            f"@@ -{line_no},7 +{line_no},8 @@\n"
+            f"-    auto Result = {name}->Find(Id{rng.randint(0, 99999)});\n"
+            f"+    auto Result = {name}->FindChecked(Id{rng.randint(0, 99999)}, /*bStrict*/ {rng.choice(['true', 'false'])});"
+        )
+    return "\n".join(lines)
+
+
+def build_history(turns: int) -> list:
+    messages = [SystemMessage(content="You are Eclipse Bot.")]
+    for t in range(turns):
+        messages.append(HumanMessage(content=f"CL {100000 + t} 리뷰 부탁드립니다.", id=f"h{t}"))
+        messages.append(AIMessage(
+            content="",
+            id=f"a{t}",
+            tool_calls=[{"name": "p4_describe", "args": {"changelist": str(100000 + t), "show_diff": True}, "id": f"call_{t}"}],
+        ))
+        messages.append(ToolMessage(content=make_diff(t)[:10000], tool_call_id=f"call_{t}", name="p4_describe", id=f"t{t}"))
+        messages.append(AIMessage(content=f"*결과*: ✅ 승인\n*요약*: CL {100000 + t} 변경 사항 확인 완료.", id=f"r{t}"))
+    return messages
+
+
+def make_checkpoint(idx: int, messages: list) -> dict:
+    return {
+        "v": 1,
+        "id": f"{idx:08d}",
+        "ts": "2026-01-01T00:00:00+00:00",
+        "channel_values": {"messages": messages, "todos": [], "files": {}},
+        "channel_versions": {"messages": idx},
+        "versions_seen": {},
+    }
+
+
+def bench(
+    serializer,
+    steps: int = 40,
+    turns_per_step: int = 1,
+    delta_mode: bool = False,
+    cache: bool = False,
+    message_store: bool = False,
+) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"), check_same_thread=False)
+        saver = CustomSqliteSaver(
+            conn,
+            serializer=serializer,
+            delta_mode=delta_mode,
+            cache=CheckpointCache() if cache else None,
+            message_store=message_store,
+        )
+        config = {"configurable": {"thread_id": "bench"}}
+
+        put_times, get_times = [], []
+        for step in range(1, steps + 1):
+            history = build_history(step * turns_per_step)
+            checkpoint = make_checkpoint(step, history)
+
+            start = time.perf_counter()
+            config = saver.put(config, checkpoint, {"source": "loop", "step": step}, {"messages": step})
+            put_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            loaded = saver.get_tuple({"configurable": {"thread_id": "bench"}})
+            get_times.append(time.perf_counter() - start)
+            assert loaded.checkpoint["channel_values"]["messages"] == history
+
+        total_bytes = conn.execute("SELECT SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints").fetchone()[0]
+        total_bytes += conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages").fetchone()[0]
+        total_bytes += conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM blobs").fetchone()[0]
+        conn.close()
+
+    return {
+        "bytes_per_checkpoint": total_bytes / steps,
+        "put_ms": statistics.mean(put_times) * 1000,
+        "get_ms": statistics.mean(get_times) * 1000,
+    }
+
+
+def verify_legacy_rows():
+    """Rows written by the old pickle saver must stay readable after switching codecs."""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    legacy = CustomSqliteSaver(conn, serializer=PickleSerializer())
+    legacy.put({"configurable": {"thread_id": "legacy"}}, make_checkpoint(1, build_history(2)), {"step": 1}, {})
+
+    compact = CustomSqliteSaver(conn, serializer=CompactSerializer("zstd"))
+    loaded = compact.get_tuple({"configurable": {"thread_id": "legacy"}})
+    assert loaded.checkpoint["channel_values"]["messages"] == build_history(2)
+    print("✅ Legacy pickle rows readable by compact serializer")
+
+
+if __name__ == "__main__":
+    print("📊 Checkpoint serializer benchmark (40 steps, growing review thread, 160 messages)")
+    verify_legacy_rows()
+
+    results = {"pickle": bench(PickleSerializer())}
+    for codec in ["none", "zlib", "zstd", "lz4"]:
+        serializer = get_serializer(codec)
+        if serializer.name != codec:
+            print(f"⚠️ {codec} unavailable, skipped")
+            continue
+        results[codec] = bench(serializer)
+    # 100+ message thread (4 messages per step) to show write amplification
+    results["zstd+delta"] = bench(get_serializer("zstd"), delta_mode=True)
+    results["+hot cache"] = bench(get_serializer("zstd"), delta_mode=True, cache=True)
+    results["zstd+msgs"] = bench(get_serializer("zstd"), message_store=True)
+
+    baseline = results["pickle"]["bytes_per_checkpoint"]
+    print("\n" + "=" * 64)
+    print(f"{'Serializer':<12} | {'Bytes/ckpt':>12} | {'Ratio':>6} | {'Put (ms)':>9} | {'Get (ms)':>9}")
+    print("=" * 64)
+    for name, r in results.items():
+        ratio = r["bytes_per_checkpoint"] / baseline
+        print(f"{name:<12} | {r['bytes_per_checkpoint']:>12,.0f} | {ratio:>6.2f} | {r['put_ms']:>9.2f} | {r['get_ms']:>9.2f}")
+    print("=" * 64 + "\n")
@@ -0,0 +1,504 @@
+import sys
+import os
+import asyncio
+import sqlite3
+import tempfile
+import time
+from unittest.mock import MagicMock
+from typing import Annotated, TypedDict
+
+# Add src to path
+sys.path.append("/app")
+
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+
+from src.core.checkpointer import CustomSqliteSaver, CheckpointWriteBuffer
+from src.core.sqlite_pool import SqliteConnectionManager, as_connection_manager
+from src.core.retention import RetentionWorker, migrate_incremental_vacuum
+from src.core.compactor import AutoCompactor, elide_tool_output
+from src.core.checkpoint_cache import CheckpointCache
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def build_graph():
+    def agent(state):
+        return {"messages": [AIMessage(content=f"reply {len(state['messages'])}")]}
+
+    def tool(state):
+        return {"messages": [AIMessage(content="tool done")]}
+
+    graph = StateGraph(State)
+    graph.add_node("agent", agent)
+    graph.add_node("tool", tool)
+    graph.add_edge(START, "agent")
+    graph.add_edge("agent", "tool")
+    graph.add_edge("tool", END)
+    return graph
+
+
+async def verify_checkpointer(conn):
+    print(f"🧪 Testing CustomSqliteSaver ({type(conn).__name__})...")
+
+    config = {"configurable": {"thread_id": "slack_verify"}}
+    graph = build_graph()
+
+    # 1. Several turns, each with a fresh saver (like create_agent per event)
+    for i in range(5):
+        app = graph.compile(checkpointer=CustomSqliteSaver(conn, delta_mode=True, keyframe_interval=4))
+        result = await app.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+    assert len(result["messages"]) == 15, f"Expected 15 messages, got {len(result['messages'])}"
+
+    with as_connection_manager(conn).read() as reader:
+        kinds = dict(reader.execute("SELECT kind, COUNT(*) FROM checkpoints GROUP BY kind").fetchall())
+    assert kinds.get("delta") and kinds.get("full"), f"Expected delta and keyframe rows, got {kinds}"
+    print(f"✅ Delta rows rebuilt correctly ({kinds})")
+
+    # 2. History listing with metadata filter / before / limit
+    saver = CustomSqliteSaver(conn, delta_mode=True)
+    history = list(saver.list(config))
+    assert len(history) == 20
+    inputs = list(saver.list(config, filter={"source": "input"}))
+    assert [t.metadata["step"] for t in inputs] == [15, 11, 7, 3, -1]
+    page = list(saver.list(config, before=history[1].config, limit=3))
+    assert [t.config["configurable"]["checkpoint_id"] for t in page] == [
+        t.config["configurable"]["checkpoint_id"] for t in history[2:5]
+    ]
+    streamed = [t async for t in saver.alist(config)]
+    assert len(streamed) == len(history)
+    print("✅ list()/alist() honor filter, before and limit")
+
+    # 3. Time travel: fork from an older checkpoint
+    old = history[10]
+    app = graph.compile(checkpointer=saver)
+    forked = await app.ainvoke({"messages": [HumanMessage(content="fork")]}, old.config)
+    assert len(forked["messages"]) == len(old.checkpoint["channel_values"]["messages"]) + 3
+    print("✅ Fork from historical checkpoint")
+
+    print("✅ Checkpointer Verified!")
+
+
+async def verify_concurrent_sessions(db: SqliteConnectionManager, sessions: int = 20):
+    print(f"🧪 Testing {sessions} concurrent sessions on writer thread + read pool...")
+    graph = build_graph()
+
+    async def run_session(i: int):
+        config = {"configurable": {"thread_id": f"slack_{i}"}}
+        for turn in range(3):
+            app = graph.compile(checkpointer=CustomSqliteSaver(db, delta_mode=True))
+            result = await app.ainvoke({"messages": [HumanMessage(content=f"s{i} t{turn}")]}, config)
+        return len(result["messages"])
+
+    start = time.perf_counter()
+    counts = await asyncio.gather(*(run_session(i) for i in range(sessions)))
+    assert counts == [9] * sessions, counts
+    print(f"✅ {sessions} sessions x 3 turns in {time.perf_counter() - start:.2f}s")
+
+
+async def verify_retention(db: SqliteConnectionManager, archive_dir: str):
+    print("🧪 Testing checkpoint retention...")
+    graph = build_graph()
+    saver = CustomSqliteSaver(db, delta_mode=True, keyframe_interval=5)
+    app = graph.compile(checkpointer=saver)
+    for thread in ("slack_active", "slack_idle"):
+        for i in range(6):
+            await app.ainvoke({"messages": [HumanMessage(content=f"{thread} {i}")]}, {"configurable": {"thread_id": thread}})
+    latest = saver.get_tuple({"configurable": {"thread_id": "slack_active"}}).checkpoint["channel_values"]["messages"]
+
+    # Age the idle thread past the cutoff
+    db.write(lambda conn: conn.execute("UPDATE checkpoints SET created_at = 0 WHERE thread_id = 'slack_idle'"))
+
+    worker = RetentionWorker(saver, keep_last=3, idle_days=1, archive_dir=archive_dir)
+    stats = worker.run_once()
+    assert stats["threads_archived"] == 1, stats
+    assert len(list(saver.list({"configurable": {"thread_id": "slack_active"}}))) == 3
+    reloaded = CustomSqliteSaver(db).get_tuple({"configurable": {"thread_id": "slack_active"}})
+    assert reloaded.checkpoint["channel_values"]["messages"] == latest, "Kept delta rows must stay readable"
+    assert saver.get_tuple({"configurable": {"thread_id": "slack_idle"}}) is None
+
+    # A saver that knows the archive restores the thread when the user comes back
+    restoring = CustomSqliteSaver(db, delta_mode=True, keyframe_interval=5, archive_dir=archive_dir)
+    restored = restoring.get_tuple({"configurable": {"thread_id": "slack_idle"}})
+    assert len(restored.checkpoint["channel_values"]["messages"]) == 18
+    assert not os.path.exists(worker._archive_path("slack_idle"))
+    assert len(list(saver.list({"configurable": {"thread_id": "slack_idle"}}))) == 3
+
+    # A thread restarted after archiving is never overwritten by its archive
+    worker.archive_thread("slack_idle")
+    await app.ainvoke({"messages": [HumanMessage(content="new start")]}, {"configurable": {"thread_id": "slack_idle"}})
+    assert worker.restore_thread("slack_idle") == 0
+    assert os.path.exists(worker._archive_path("slack_idle"))
+    assert len(saver.get_tuple({"configurable": {"thread_id": "slack_idle"}}).checkpoint["channel_values"]["messages"]) == 3
+    os.remove(worker._archive_path("slack_idle"))
+
+    # A turn that lands while the archive file is written is kept in the DB, not deleted unarchived
+    serializer = worker._archive_serializer
+
+    class TurnDuringArchive:
+        def dumps(self, obj):
+            data = serializer.dumps(obj)
+            asyncio.run(app.ainvoke({"messages": [HumanMessage(content="late reply")]}, {"configurable": {"thread_id": "slack_idle"}}))
+            return data
+
+    worker._archive_serializer = TurnDuringArchive()
+    assert await asyncio.to_thread(worker.archive_thread, "slack_idle") == 0
+    worker._archive_serializer = serializer
+    assert not os.path.exists(worker._archive_path("slack_idle"))
+    assert len(saver.get_tuple({"configurable": {"thread_id": "slack_idle"}}).checkpoint["channel_values"]["messages"]) == 6
+
+    # No full VACUUM at run time: a DB without incremental auto_vacuum is only reported
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = sqlite3.connect(os.path.join(tmp, "legacy.db"), check_same_thread=False)
+        legacy_worker = RetentionWorker(CustomSqliteSaver(legacy), keep_last=3)
+        assert legacy_worker.run_once()["bytes_reclaimed"] == 0
+        assert legacy.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        legacy.close()
+        migrate_incremental_vacuum(os.path.join(tmp, "legacy.db"))
+        legacy = sqlite3.connect(os.path.join(tmp, "legacy.db"))
+        assert legacy.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        legacy.close()
+    print(f"✅ Retention run: {stats}")
+
+
+async def verify_compaction_persisted(conn):
+    print("🧪 Testing compacted history is stored, not recomputed...")
+    model = MagicMock()
+    model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+    model.invoke.return_value = AIMessage(content="[Summary] Earlier turns reviewed.")
+    compactor = AutoCompactor(model=model, max_tokens=1000, recent_messages_buffer=2)
+
+    config = {"configurable": {"thread_id": "slack_compact"}}
+    graph = build_graph()
+    app = graph.compile(checkpointer=CustomSqliteSaver(conn, delta_mode=True))
+    await app.ainvoke({"messages": [HumanMessage(content="long question " * 400)]}, config)
+
+    saver = CustomSqliteSaver(conn, context_manager=compactor, delta_mode=True)
+    first = saver.get_tuple(config)
+    assert first.metadata.get("compaction") and model.invoke.call_count == 1
+    for _ in range(3):
+        again = CustomSqliteSaver(conn, context_manager=compactor, delta_mode=True).get_tuple(config)
+        assert again.config == first.config
+    assert model.invoke.call_count == 1, "History must not be summarized again on reload"
+
+    # The next turn continues from the compacted checkpoint
+    app = graph.compile(checkpointer=saver)
+    result = await app.ainvoke({"messages": [HumanMessage(content="next")]}, config)
+    assert len(result["messages"]) == len(first.checkpoint["channel_values"]["messages"]) + 3
+    assert model.invoke.call_count == 1
+    print("✅ Compaction stored once and reused")
+
+
+async def verify_write_behind(db: SqliteConnectionManager):
+    print("🧪 Testing write-behind batching...")
+    graph = build_graph()
+    buffer = CheckpointWriteBuffer(db, window_seconds=0)
+    config = {"configurable": {"thread_id": "slack_write_behind"}}
+
+    for i in range(3):
+        saver = CustomSqliteSaver(db, delta_mode=True, write_buffer=buffer)
+        app = graph.compile(checkpointer=saver)
+        result = await app.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+        assert buffer.has_pending("slack_write_behind")
+        await buffer.aflush("slack_write_behind")  # End of turn (dispatcher)
+    assert len(result["messages"]) == 9
+    assert buffer.stats["transactions"] == 3, buffer.stats
+    assert buffer.stats["statements"] > 3 * 4, buffer.stats
+
+    # Reads flush first, so queued rows are never invisible
+    saver = CustomSqliteSaver(db, delta_mode=True, write_buffer=buffer)
+    await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="unflushed")]}, config)
+    reader = CustomSqliteSaver(db, write_buffer=buffer)
+    assert len(reader.get_tuple(config).checkpoint["channel_values"]["messages"]) == 12
+    assert not buffer.has_pending()
+
+    # Window expiry commits without an explicit flush
+    timed = CheckpointWriteBuffer(db, window_seconds=0.05)
+    saver = CustomSqliteSaver(db, delta_mode=True, write_buffer=timed)
+    await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="timed")]}, config)
+    await asyncio.sleep(0.3)
+    assert not timed.has_pending() and timed.stats["transactions"] >= 1
+
+    # Background commits (window / max_pending) that fail are counted and raised by the next flush
+    failing = CheckpointWriteBuffer(db, window_seconds=0, max_pending=1)
+    failing.add("slack_write_behind", "INSERT INTO no_such_table VALUES (?)", (1,))
+    await asyncio.sleep(0.1)
+    assert failing.stats["failed"] == 1, failing.stats
+    try:
+        await failing.aflush("slack_write_behind")
+        raise AssertionError("failed background commit was not surfaced")
+    except sqlite3.OperationalError:
+        pass
+    failing.flush()  # reported once
+
+    # After a dropped batch the next put is a keyframe against what is on disk, not a delta on the lost row
+    recovering = CheckpointWriteBuffer(db, window_seconds=0)
+    saver = CustomSqliteSaver(
+        db, delta_mode=True, message_store=True, write_buffer=recovering, cache=CheckpointCache(max_bytes=1 << 20)
+    )
+    app = graph.compile(checkpointer=saver)
+    dropped = {"configurable": {"thread_id": "slack_dropped_batch"}}
+    await app.ainvoke({"messages": [HumanMessage(content="kept")]}, dropped)
+    await recovering.aflush("slack_dropped_batch")
+    await app.ainvoke({"messages": [HumanMessage(content="lost")]}, dropped)
+    recovering.add("slack_dropped_batch", "INSERT INTO no_such_table VALUES (?)", (1,))
+    recovering._flush_background("slack_dropped_batch")
+    await asyncio.sleep(0.1)
+    assert recovering.stats["failed"] == 1 and "slack_dropped_batch" not in saver._last_state
+    try:
+        await recovering.aflush("slack_dropped_batch")
+    except sqlite3.OperationalError:
+        pass
+    result = await app.ainvoke({"messages": [HumanMessage(content="after")]}, dropped)
+    await recovering.aflush("slack_dropped_batch")
+    assert [m.content for m in result["messages"]][::3] == ["kept", "after"], result["messages"]
+    reloaded = CustomSqliteSaver(db, delta_mode=True, message_store=True).get_tuple(dropped)
+    assert len(reloaded.checkpoint["channel_values"]["messages"]) == 6
+    print(f"✅ Write-behind: {buffer.stats['statements']} statements in {buffer.stats['transactions']} transactions")
+
+
+async def verify_hot_cache(db: SqliteConnectionManager):
+    print("🧪 Testing hot checkpoint cache...")
+    graph = build_graph()
+    cache = CheckpointCache(max_bytes=1024 * 1024)
+    config = {"configurable": {"thread_id": "slack_cached"}}
+
+    # Fresh saver per turn sharing one cache, like create_agent
+    for i in range(4):
+        app = graph.compile(checkpointer=CustomSqliteSaver(db, delta_mode=True, cache=cache))
+        result = await app.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+    assert cache.hits >= 3, cache.get_stats()
+
+    # Cached state matches what a cache-less saver decodes from SQLite
+    cached = CustomSqliteSaver(db, cache=cache).get_tuple(config)
+    stored = CustomSqliteSaver(db).get_tuple(config)
+    assert cached.config == stored.config
+    assert cached.checkpoint["channel_values"] == stored.checkpoint["channel_values"]
+    assert cached.checkpoint["channel_values"]["messages"] == result["messages"]
+
+    # Mutating a returned checkpoint must not leak into the cache
+    cached.checkpoint["channel_values"]["messages"].append(HumanMessage(content="scratch"))
+    assert len(CustomSqliteSaver(db, cache=cache).get_tuple(config).checkpoint["channel_values"]["messages"]) == 12
+
+    # Size-based eviction
+    small = CheckpointCache(max_bytes=8 * 1024)
+    saver = CustomSqliteSaver(db, cache=small)
+    for i in range(5):
+        saver.get_tuple({"configurable": {"thread_id": f"slack_{i}"}})
+    assert small.evictions > 0 and small.get_stats()["bytes"] <= 8 * 1024, small.get_stats()
+
+    saver = CustomSqliteSaver(db, cache=cache)
+    saver.delete_thread("slack_cached")
+    assert saver.get_tuple(config) is None
+    print(f"✅ Hot cache: {cache.get_stats()}")
+
+
+async def verify_message_store(db: SqliteConnectionManager, archive_dir: str):
+    print("🧪 Testing append-only message store...")
+    graph = build_graph()
+    config = {"configurable": {"thread_id": "slack_msgstore"}}
+
+    def stored_messages() -> int:
+        with db.read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE thread_id = 'slack_msgstore'").fetchone()[0]
+
+    for i in range(5):
+        saver = CustomSqliteSaver(db, delta_mode=True, keyframe_interval=4, message_store=True)
+        result = await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+    assert len(result["messages"]) == 15
+    # Every message stored exactly once, however many checkpoints reference it
+    assert stored_messages() == 15
+    history = list(CustomSqliteSaver(db, message_store=True).list(config))
+    assert len(history) == 20 and history[0].checkpoint["channel_values"]["messages"] == result["messages"]
+
+    # Fork from an older checkpoint appends only the new branch's messages
+    old = history[10]
+    forked = await graph.compile(checkpointer=CustomSqliteSaver(db, message_store=True)).ainvoke(
+        {"messages": [HumanMessage(content="fork")]}, old.config
+    )
+    assert len(forked["messages"]) == len(old.checkpoint["channel_values"]["messages"]) + 3
+    assert stored_messages() == 18
+
+    # Compaction: only the summary is new; pruning sweeps the summarized prefix
+    model = MagicMock()
+    model.get_num_tokens_from_messages.side_effect = lambda msgs: len(msgs) * 100
+    model.invoke.return_value = AIMessage(content="[Summary] Earlier turns reviewed.")
+    compactor = AutoCompactor(model=model, max_tokens=1000, recent_messages_buffer=2)
+    compacted = CustomSqliteSaver(db, context_manager=compactor, message_store=True).get_tuple(config)
+    assert compacted.metadata.get("compaction")
+    assert stored_messages() == 19
+    saver = CustomSqliteSaver(db, message_store=True)
+    saver.prune(["slack_msgstore"], keep_last=1)
+    assert stored_messages() == 3
+    reloaded = saver.get_tuple(config).checkpoint["channel_values"]["messages"]
+    assert [m.content for m in reloaded] == [m.content for m in compacted.checkpoint["channel_values"]["messages"]]
+
+    # Archive round trip keeps the message rows
+    worker = RetentionWorker(saver, keep_last=3, idle_days=1, archive_dir=archive_dir)
+    worker.archive_thread("slack_msgstore")
+    assert worker.restore_thread("slack_msgstore") == 1
+    assert len(CustomSqliteSaver(db, message_store=True).get_tuple(config).checkpoint["channel_values"]["messages"]) == 3
+    print("✅ Message store: O(new messages) per step, prefix swept after compaction")
+
+
+async def verify_shared_thread_savers(db: SqliteConnectionManager, write_buffer=None):
+    print(f"🧪 Testing two long-lived savers on one thread (write-behind: {bool(write_buffer)})...")
+    graph = build_graph()
+    thread_id = f"slack_personas_{bool(write_buffer)}"
+    config = {"configurable": {"thread_id": thread_id}}
+    # One saver per cached persona agent (general / automation), both kept across turns
+    general = graph.compile(checkpointer=CustomSqliteSaver(db, delta_mode=True, message_store=True, write_buffer=write_buffer))
+    automation = graph.compile(checkpointer=CustomSqliteSaver(db, delta_mode=True, message_store=True, write_buffer=write_buffer))
+
+    for i, agent in enumerate([general, automation, general, automation, general]):
+        result = await agent.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+        if write_buffer:
+            await write_buffer.aflush(thread_id)
+    assert len(result["messages"]) == 15
+    with db.read() as conn:
+        seqs = [row[0] for row in conn.execute("SELECT seq FROM messages WHERE thread_id = ? ORDER BY seq", (thread_id,))]
+    assert seqs == list(range(1, 16)), seqs
+    print("✅ Message seqs stay unique when personas alternate on a thread")
+
+    # Long-lived savers keep turn state only until the turn ends, and never beyond max_threads
+    saver = CustomSqliteSaver(db, delta_mode=True, message_store=True, write_buffer=write_buffer, max_threads=3)
+    agent = graph.compile(checkpointer=saver)
+    for i in range(5):
+        await agent.ainvoke({"messages": [HumanMessage(content="hi")]}, {"configurable": {"thread_id": f"{thread_id}_{i}"}})
+    assert len(saver._last_state) == 3 and len(saver._next_seqs) == 3
+    saver.release_thread(f"{thread_id}_4")
+    assert f"{thread_id}_4" not in saver._last_state and f"{thread_id}_4" not in saver._next_seqs
+    result = await agent.ainvoke({"messages": [HumanMessage(content="again")]}, {"configurable": {"thread_id": f"{thread_id}_4"}})
+    assert len(result["messages"]) == 6
+
+
+def verify_reader_pool(db_path: str):
+    print("🧪 Testing SQLite read pool...")
+    manager = SqliteConnectionManager(db_path, pool_size=1)
+
+    # A reader that fails to open gives its slot back
+    open_reader = manager._open_reader
+    manager._open_reader = MagicMock(side_effect=sqlite3.OperationalError("unable to open database file"))
+    for _ in range(3):
+        try:
+            with manager.read():
+                raise AssertionError("reader should not open")
+        except sqlite3.OperationalError:
+            pass
+    manager._open_reader = open_reader
+    with manager.read(timeout=1) as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+
+    # The only reader is borrowed: others wait, then time out
+    with manager.read():
+        try:
+            with manager.read(timeout=0.05):
+                raise AssertionError("pool of one handed out two readers")
+        except TimeoutError:
+            pass
+
+    # A reader borrowed across close() is closed when it comes back
+    with manager.read() as borrowed:
+        manager.close()
+    try:
+        borrowed.execute("SELECT 1")
+        raise AssertionError("borrowed reader left open after close()")
+    except sqlite3.ProgrammingError:
+        pass
+    assert not manager._readers
+    print("✅ Read pool keeps its slots and closes every reader")
+
+
+def verify_blob_dedup(db: SqliteConnectionManager, archive_dir: str):
+    print("🧪 Testing content-addressed blobs...")
+    diff = "\n".join(f"-    auto Result = Inventory->Find(Id{i});\n+    auto Result = Inventory->FindChecked(Id{i});" for i in range(200))
+
+    def review(thread_id: str, idx: int, messages: list) -> dict:
+        return {
+            "v": 1,
+            "id": f"{idx:08d}",
+            "ts": "2026-01-01T00:00:00+00:00",
+            "channel_values": {"messages": messages},
+            "channel_versions": {"messages": idx},
+            "versions_seen": {},
+        }
+
+    def count(table: str) -> int:
+        with db.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    # Two threads reviewing the same CL share one copy of the diff
+    saver = CustomSqliteSaver(db, message_store=True)
+    for thread_id in ("slack_blob_a", "slack_blob_b"):
+        history = [
+            HumanMessage(content="CL 123456 리뷰 부탁드립니다.", id=f"{thread_id}_h"),
+            AIMessage(content="", id=f"{thread_id}_a", tool_calls=[{"name": "p4_describe", "args": {"changelist": "123456"}, "id": "call_1"}]),
+            ToolMessage(content=diff, tool_call_id="call_1", name="p4_describe", id=f"{thread_id}_t"),
+        ]
+        saver.put({"configurable": {"thread_id": thread_id}}, review(thread_id, 1, history), {"step": 1}, {"messages": 1})
+    assert count("blobs") == 1
+    with db.read() as conn:
+        stub_size = conn.execute("SELECT MAX(LENGTH(payload)) FROM messages WHERE blob_digest IS NOT NULL").fetchone()[0]
+    assert stub_size < 1000, stub_size
+
+    loaded = CustomSqliteSaver(db, message_store=True).get_tuple({"configurable": {"thread_id": "slack_blob_b"}})
+    tool_message = loaded.checkpoint["channel_values"]["messages"][-1]
+    assert tool_message.content == diff and tool_message.name == "p4_describe"
+
+    # The blob outlives one referencing thread, survives archiving and goes with the last reference
+    saver.delete_thread("slack_blob_a")
+    assert count("blobs") == 1
+    worker = RetentionWorker(saver, keep_last=3, idle_days=1, archive_dir=archive_dir)
+    worker.archive_thread("slack_blob_b")
+    assert count("blobs") == 0
+    assert worker.restore_thread("slack_blob_b") == 1 and count("blobs") == 1
+    config = {"configurable": {"thread_id": "slack_blob_b", "checkpoint_id": loaded.checkpoint["id"]}}
+    summary = [AIMessage(content="[Summary] CL 123456 reviewed.", id="slack_blob_b_s")]
+    saver.put(config, review("slack_blob_b", 2, summary), {"step": 2, "compaction": True}, {"messages": 2})
+    saver.prune(["slack_blob_b"], keep_last=1)
+    assert count("blobs") == 0
+
+    # An elided tool output stays fetchable by digest after its original rows are pruned
+    saver = CustomSqliteSaver(db, message_store=True, blob_threshold=0)
+    output = "\n".join(f"//depot/Game/Source/Inventory{i}.cpp#12 - edit" for i in range(80))
+    history = [
+        HumanMessage(content="CL 123457 파일 목록", id="elide_h"),
+        AIMessage(content="", id="elide_a", tool_calls=[{"name": "p4_describe", "args": {"changelist": "123457"}, "id": "call_2"}]),
+        ToolMessage(content=output, tool_call_id="call_2", name="p4_describe", id="elide_t"),
+    ]
+    saver.put({"configurable": {"thread_id": "slack_elide"}}, review("slack_elide", 1, history), {"step": 1}, {"messages": 1})
+    assert count("blobs") == 0
+    loaded = saver.get_tuple({"configurable": {"thread_id": "slack_elide"}})
+    stub = elide_tool_output(history[-1], {"changelist": "123457"})
+    config = {"configurable": {"thread_id": "slack_elide", "checkpoint_id": loaded.checkpoint["id"]}}
+    saver.put(config, review("slack_elide", 2, [*history[:2], stub]), {"step": 2, "compaction": True}, {"messages": 2})
+    saver.prune(["slack_elide"], keep_last=1)
+    digest = stub.response_metadata["elided"]["sha256"]
+    assert saver.get_blob(digest) == output
+    loaded = saver.get_tuple({"configurable": {"thread_id": "slack_elide"}})
+    assert loaded.checkpoint["channel_values"]["messages"][-1].content == stub.content
+    saver.delete_thread("slack_elide")
+    assert saver.get_blob(digest) is None
+    print("✅ Blobs: one copy per content hash, swept with the last reference")
+
+
+if __name__ == "__main__":
+    asyncio.run(verify_checkpointer(sqlite3.connect(":memory:", check_same_thread=False)))
+    asyncio.run(verify_compaction_persisted(sqlite3.connect(":memory:", check_same_thread=False)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = SqliteConnectionManager(os.path.join(tmp, "verify.db"), pool_size=4)
+        asyncio.run(verify_checkpointer(manager))
+        verify_reader_pool(os.path.join(tmp, "pool.db"))
+        asyncio.run(verify_concurrent_sessions(manager))
+        asyncio.run(verify_write_behind(manager))
+        asyncio.run(verify_hot_cache(manager))
+        asyncio.run(verify_message_store(manager, os.path.join(tmp, "archive")))
+        verify_blob_dedup(manager, os.path.join(tmp, "archive"))
+        asyncio.run(verify_shared_thread_savers(manager))
+        asyncio.run(verify_shared_thread_savers(manager, CheckpointWriteBuffer(manager, window_seconds=0)))
+        asyncio.run(verify_retention(manager, os.path.join(tmp, "archive")))
+        manager.close()
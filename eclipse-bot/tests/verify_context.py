@@ -2,17 +2,20 @@
 import sys
 import os
 import asyncio
+import time
 from unittest.mock import MagicMock, patch
 
 # Add src to path
 sys.path.append("/app")
 
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 
 # Mock the model registry to return predictable limits
 with patch("src.agents.factory.get_context_window", return_value=128000):
     from src.agents.factory import create_agent
-    from src.core.compactor import AutoCompactor
+    from src.core.compactor import AutoCompactor, SummaryCache, elide_tool_output
+    from src.core.compaction_scheduler import CompactionScheduler
+    from src.core.token_counter import TokenCounter
 
 async def test_auto_compact():
     print("🧪 Testing Auto Compact Logic...")
@@ -58,5 +61,311 @@ async def test_auto_compact():
     
     print("✅ Auto Compact Logic Verified!")
 
+    # 6. Rolling summary: only messages aged out since the last compaction are sent
+    mock_model.invoke.return_value = AIMessage(content="[Summary] Architecture approved, CL 12345 reviewed.")
+    history = compacted + [
+        HumanMessage(content="Newer message " * 200),
+        AIMessage(content="Newer response " * 200),
+        HumanMessage(content="Latest message"),
+        AIMessage(content="Latest response"),
+    ]
+    rolled = compactor.invoke(history)
+    prompt = mock_model.invoke.call_args[0][0][0].content
+    assert "Existing summary:\n[Summary] User discussed architecture." in prompt, prompt[:200]
+    assert "Newer message" in prompt and "Old message 1" not in prompt and "Recent message" in prompt
+    summaries = [m for m in rolled if "PREVIOUS CONVERSATION SUMMARY" in m.content]
+    assert len(summaries) == 1 and summaries[0].response_metadata["summarized_messages"] == 6
+    assert [m.content for m in rolled[-2:]] == ["Latest message", "Latest response"]
+    print("✅ Rolling summary folds in only newly aged-out messages")
+
+
+async def test_background_compaction():
+    print("🧪 Testing background pre-compaction...")
+    mock_model = MagicMock()
+    mock_model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+    mock_model.invoke.return_value = AIMessage(content="[Summary] Old turns reviewed.")
+    scheduler = CompactionScheduler()
+    compactor = AutoCompactor(model=mock_model, max_tokens=1000, recent_messages_buffer=2, scheduler=scheduler)
+
+    # ~850 tokens: past the soft threshold (800), below the hard limit
+    history = [
+        SystemMessage(content="You are Eclipse Bot.", id="sys"),
+        HumanMessage(content="Old message " * 140, id="h1"),
+        AIMessage(content="Old response " * 130, id="a1"),
+        HumanMessage(content="Recent message", id="h2"),
+        AIMessage(content="Recent response", id="a2"),
+    ]
+    assert compactor.invoke(history, thread_id="slack_bg") is history
+    assert mock_model.invoke.call_count == 0
+
+    # After the turn the summary is computed off the request path...
+    history = history + [HumanMessage(content="Next question", id="h3"), AIMessage(content="Next answer", id="a3")]
+    await scheduler.run_after_turn("slack_bg", lambda: history)
+    assert mock_model.invoke.call_count == 1 and scheduler.get_stats()["ready"] == 1
+
+    # ...and swapped in at the next load, keeping messages appended since
+    later = history + [HumanMessage(content="Follow-up", id="h4")]
+    swapped = compactor.invoke(later, thread_id="slack_bg")
+    assert [m.id for m in swapped][2:] == ["h3", "a3", "h4"], [m.id for m in swapped]
+    assert "PREVIOUS CONVERSATION SUMMARY" in swapped[1].content and mock_model.invoke.call_count == 1
+
+    # A summary whose covered prefix no longer matches is discarded
+    scheduler.request("slack_bg", compactor)
+    await scheduler.run_after_turn("slack_bg", lambda: later)
+    assert compactor.invoke(swapped, thread_id="slack_bg") is swapped
+    print(f"✅ Background compaction: {scheduler.get_stats()}")
+
+    # The factory loads through its shared saver (async, no new saver per summary)
+    from src.agents import factory
+    factory._checkpointer.put(
+        {"configurable": {"thread_id": "slack_bgload"}},
+        {"v": 1, "id": "00000001", "ts": "2026-01-01T00:00:00+00:00",
+         "channel_values": {"messages": later}, "channel_versions": {"messages": 1}, "versions_seen": {}},
+        {"source": "loop", "step": 1},
+        {"messages": 1},
+    )
+    factory._checkpointer.flush("slack_bgload")
+    scheduler.request("slack_bgload", compactor)
+    completed = scheduler.get_stats()["completed"]
+    with patch("src.agents.factory._compaction_scheduler", scheduler), \
+            patch("src.agents.factory._new_saver", side_effect=AssertionError("new saver per load")):
+        await factory.schedule_compaction("slack_bgload")
+    assert scheduler.get_stats()["completed"] == completed + 1 and scheduler.get_stats()["failed"] == 0
+    assert scheduler.take("slack_bgload").apply(later) is not None
+    print("✅ Background summaries load through the shared saver")
+
+async def test_token_counter():
+    print("🧪 Testing token accounting...")
+    counter = TokenCounter("moonshotai/kimi-k2.5")
+    history = [
+        SystemMessage(content="You are Eclipse Bot.", id="sys"),
+        HumanMessage(content=[{"type": "text", "text": "CL 123456 리뷰"}, {"type": "image_url", "image_url": {"url": "x"}}], id="h1"),
+        AIMessage(content="", id="a1", tool_calls=[{"name": "p4_describe", "args": {"changelist": "123456"}, "id": "c1"}]),
+    ]
+    total = counter.count_messages(history, thread_id="slack_tokens")
+    assert total > 85 and counter.get_stats()["misses"] == 3
+
+    # Appending counts only the new message; a reloaded (equal) history hits the memo
+    history = history + [AIMessage(content="Looks good " * 100, id="a2")]
+    assert counter.count_messages(history, thread_id="slack_tokens") > total
+    assert counter.get_stats()["misses"] == 4 and counter.get_stats()["hits"] == 0
+    reloaded = [m.model_copy() for m in history]
+    assert counter.count_messages(reloaded, thread_id="slack_tokens") == counter.count_messages(history)
+    assert counter.get_stats()["misses"] == 4
+
+    # Threads keep fingerprints only (no message objects), dropped when the turn ends
+    fingerprints, _ = counter._totals["slack_tokens"]
+    assert all(isinstance(fp, tuple) and isinstance(fp[1], bytes) for fp in fingerprints)
+    edited = history[:-1] + [AIMessage(content="Looks bad " * 100, id="a2")]
+    assert counter.count_messages(edited, thread_id="slack_tokens") == counter.count_messages(edited)
+    counter.release_thread("slack_tokens")
+    assert counter.get_stats()["threads"] == 0
+
+    # Model counters that fail on list content fall back to the local estimate
+    broken = MagicMock()
+    broken.get_num_tokens_from_messages.side_effect = TypeError("content must be str")
+    compactor = AutoCompactor(model=broken, max_tokens=1000, recent_messages_buffer=2)
+    assert compactor.invoke(history) is history
+    print(f"✅ Token counts memoized and incremental: {counter.get_stats()}")
+
+
+async def test_tool_elision():
+    print("🧪 Testing tool-output elision...")
+    mock_model = MagicMock()
+    mock_model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+    mock_model.invoke.return_value = AIMessage(content="[Summary] CL 123456 reviewed.")
+    diff = "-    auto Result = Inventory->Find(Id);\n+    auto Result = Inventory->FindChecked(Id);\n" * 120
+
+    def review(n: int) -> list:
+        return [
+            HumanMessage(content=f"CL {n} 리뷰 부탁드립니다.", id=f"h{n}"),
+            AIMessage(content="", id=f"a{n}", tool_calls=[{"name": "p4_describe", "args": {"changelist": str(n)}, "id": f"c{n}"}]),
+            ToolMessage(content=diff, tool_call_id=f"c{n}", name="p4_describe", id=f"t{n}"),
+            AIMessage(content=f"CL {n} 승인", id=f"r{n}"),
+        ]
+
+    history = [SystemMessage(content="You are Eclipse Bot.")] + review(1) + review(2)
+
+    # Elision alone brings the thread under the soft threshold: no LLM call
+    compactor = AutoCompactor(model=mock_model, max_tokens=4000, recent_messages_buffer=2)
+    elided = compactor.invoke(history)
+    assert mock_model.invoke.call_count == 0 and len(elided) == len(history)
+    stub = elided[3].content
+    assert stub.startswith(f'[Elided tool output] p4_describe(changelist="1") -> {len(diff):,} chars, sha256:'), stub
+    assert elided[3].id == "t1" and elided[3].response_metadata["elided"]["chars"] == len(diff)
+    assert elided[7].content == diff  # Inside the recent buffer
+    # A second load finds nothing left to elide
+    assert compactor.invoke(elided) is elided
+
+    # Not enough: the summarizer only ever sees stubs
+    compactor = AutoCompactor(model=mock_model, max_tokens=1000, recent_messages_buffer=2)
+    compacted = compactor.invoke(history)
+    prompt = mock_model.invoke.call_args[0][0][0].content
+    assert "[Elided tool output] p4_describe(changelist=\"1\")" in prompt and diff not in prompt
+    assert [m.id for m in compacted[2:]] == ["t2", "r2"]
+    print("✅ Old tool outputs elided before any LLM summary")
+
+
+async def test_map_reduce_summary():
+    print("🧪 Testing map-reduce summarization...")
+    import threading
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def summarize(prompt_messages):
+        prompt = prompt_messages[0].content
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        if prompt.startswith("Merge"):
+            return AIMessage(content="[Summary] Final merged summary.")
+        return AIMessage(content=f"[Part] {prompt.split('concisely')[0][-14:]}")
+
+    mock_model = MagicMock()
+    mock_model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+    mock_model.invoke.side_effect = summarize
+    compactor = AutoCompactor(model=mock_model, max_tokens=1000, recent_messages_buffer=2, chunk_tokens=500, max_parallel=3)
+    history = [SystemMessage(content="You are Eclipse Bot.")]
+    for i in range(12):
+        history.append(HumanMessage(content=f"Question {i} " + "about //depot/Main/Source/Inventory.cpp " * 40))
+        history.append(AIMessage(content=f"Answer {i} " + "checked FindChecked call sites " * 40))
+    compacted = compactor.invoke(history)
+
+    timings = compactor.last_timings
+    assert timings["chunks"] > 3 and "map_seconds" in timings and "reduce_seconds" in timings, timings
+    assert mock_model.invoke.call_count == timings["chunks"] + 1
+    assert 1 < peak[0] <= 3, peak
+    assert "Final merged summary" in compacted[1].content
+    print(f"✅ Map-reduce summary: {timings}, peak concurrency {peak[0]}")
+
+    # An oversized Korean message is split by measured tokens, not a fixed character step
+    korean = "\n".join(f"{i}번 체인지리스트에서 인벤토리 슬롯 계산 로직을 수정했습니다." for i in range(300))
+    pieces = compactor._split_text(korean)
+    assert "".join(pieces) == korean
+    assert all(compactor._count_text(piece) <= compactor.chunk_tokens for piece in pieces), [compactor._count_text(p) for p in pieces]
+    assert len(pieces) >= compactor._count_text(korean) // compactor.chunk_tokens
+    chunks = compactor._chunk([f"TOOL: {korean}\n"])
+    assert all(compactor._count_text(chunk) <= compactor.chunk_tokens for chunk in chunks)
+    print(f"✅ Korean message split into {len(pieces)} pieces within {compactor.chunk_tokens} tokens")
+
+
+async def test_artifact_index():
+    print("🧪 Testing artifact index...")
+    mock_model = MagicMock()
+    mock_model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+    mock_model.invoke.return_value = AIMessage(content="[Summary] Inventory crash investigated.")
+    compactor = AutoCompactor(model=mock_model, max_tokens=1000, recent_messages_buffer=2, elide_min_chars=0)
+    diff = "==== //depot/Main/Source/Inventory.cpp#12 (text) ====\n" + "+    UInventory::FindChecked(Id);\n" * 200
+    history = [
+        SystemMessage(content="You are Eclipse Bot."),
+        HumanMessage(content="CL 123456 이후로 인벤토리 크래시가 납니다.", id="h1"),
+        AIMessage(content="", id="a1", tool_calls=[
+            {"name": "p4_describe", "args": {"changelist": "123456", "show_diff": True}, "id": "c1"},
+            {"name": "search_logs", "args": {"query": "level:error AND Inventory, Guild"}, "id": "c2"},
+        ]),
+        ToolMessage(content=diff, tool_call_id="c1", name="p4_describe", id="t1"),
+        ToolMessage(content="3 hits", tool_call_id="c2", name="search_logs", id="t2"),
+        HumanMessage(content="Recent message", id="h2"),
+        AIMessage(content="Recent response", id="a2"),
+    ]
+    # Elided tool outputs keep their references
+    stub = elide_tool_output(history[3], {"changelist": "123456"})
+    assert stub.response_metadata["artifacts"]["functions"] == ["UInventory::FindChecked"]
+
+    compacted = compactor.invoke(history)
+    summary = compacted[1]
+    assert "[ARTIFACT INDEX]" in summary.content, summary.content
+    assert "- Depot paths: //depot/Main/Source/Inventory.cpp#12" in summary.content
+    assert "- CLs: 123456" in summary.content and "- Functions: UInventory::FindChecked" in summary.content
+    assert '- OpenSearch queries: "level:error AND Inventory, Guild"' in summary.content
+    prompt = mock_model.invoke.call_args[0][0][0].content
+    assert "file paths" not in prompt.split("Conversation:")[0].replace("Do not list file paths", "")
+
+    # Rolling: the index carries over, the previous summary text is sent without it
+    history = compacted + [
+        HumanMessage(content="p4_print //depot/Main/Source/Guild.cpp " * 100, id="h3"),
+        AIMessage(content="Checked.", id="a3"),
+        HumanMessage(content="Latest", id="h4"),
+        AIMessage(content="Latest answer", id="a4"),
+    ]
+    rolled = compactor.invoke(history)
+    prompt = mock_model.invoke.call_args[0][0][0].content
+    assert "[ARTIFACT INDEX]" not in prompt
+    paths = rolled[1].response_metadata["artifacts"]["depot_paths"]
+    assert paths == ["//depot/Main/Source/Inventory.cpp#12", "//depot/Main/Source/Guild.cpp"], paths
+    print("✅ Artifact index survives compaction")
+
+
+async def test_summary_cache():
+    print("🧪 Testing summary cache...")
+    cache = SummaryCache(max_entries=8)
+    history = [
+        SystemMessage(content="You are Eclipse Bot."),
+        HumanMessage(content="Old message 1 " * 200, id="h1"),
+        AIMessage(content="Old response 1 " * 200, id="a1"),
+        HumanMessage(content="Recent message", id="h2"),
+        AIMessage(content="Recent response", id="a2"),
+    ]
+
+    def make_model(name: str):
+        model = MagicMock()
+        model.model_name = name
+        model.get_num_tokens_from_messages.side_effect = lambda msgs: sum(len(m.content) for m in msgs) // 4
+        model.invoke.return_value = AIMessage(content=f"[Summary] by {name}")
+        return model
+
+    cheap = make_model("openai/gpt-4o-mini")
+    # A retried / duplicate load of the same history reuses the summary
+    for _ in range(3):
+        compacted = AutoCompactor(model=cheap, max_tokens=1000, recent_messages_buffer=2, summary_cache=cache).invoke(history)
+        assert "[Summary] by openai/gpt-4o-mini" in compacted[1].content
+    assert cheap.invoke.call_count == 1
+
+    # Another model (or changed input) is a different key
+    other = make_model("moonshotai/kimi-k2.5")
+    AutoCompactor(model=other, max_tokens=1000, recent_messages_buffer=2, summary_cache=cache).invoke(history)
+    assert other.invoke.call_count == 1
+    assert cache.get_stats() == {"entries": 2, "hits": 2, "misses": 2}, cache.get_stats()
+    print(f"✅ Summary cache: {cache.get_stats()}")
+
+
+def test_agent_cache():
+    print("🧪 Testing compiled agent cache...")
+    from src.agents import factory
+    from src.config import get_settings
+
+    factory.clear_agent_cache()
+    with patch("src.agents.factory._build_agent", side_effect=lambda *args: object()) as build:
+        general = factory.create_agent("general")
+        assert factory.create_agent("general") is general
+        assert factory.create_agent("code_review") is general  # unknown personas share the general agent
+        automation = factory.create_agent("automation")
+        assert automation is not general
+        assert build.call_count == 2, build.call_count
+
+        # A settings change invalidates every cached agent
+        settings = get_settings()
+        original = settings.compaction_chunk_tokens
+        settings.compaction_chunk_tokens = original + 1
+        try:
+            assert factory.create_agent("general") is not general
+        finally:
+            settings.compaction_chunk_tokens = original
+        stats = factory.get_agent_cache_stats()
+        assert stats["hits"] == 2 and stats["invalidations"] == 1, stats
+    factory.clear_agent_cache()
+    print("✅ Agents compiled once per persona and rebuilt on settings change")
+
+
 if __name__ == "__main__":
     asyncio.run(test_auto_compact())
+    asyncio.run(test_background_compaction())
+    asyncio.run(test_token_counter())
+    asyncio.run(test_tool_elision())
+    asyncio.run(test_map_reduce_summary())
+    asyncio.run(test_artifact_index())
+    asyncio.run(test_summary_cache())
+    test_agent_cache()
@@ -0,0 +1,247 @@
+import sys
+import asyncio
+import time
+
+# Add src to path
+sys.path.append("/app")
+
+from src.core.session_scheduler import SessionScheduler
+from src.core.admission import AdmissionController, AdmissionRejected
+from src.core.dispatcher import coalesce_events, group_by_anchor, session_id_for
+from src.core.prewarm import prewarm, readiness_failures, recheck
+from src.core.event_dedup import EventDeduplicator, event_keys
+from src.core.slack_client import SlackIntegration
+
+
+async def test_session_scheduler():
+    print("🧪 Testing Session Scheduler...")
+
+    runs = []
+    active = {"now": 0, "max": 0}
+    release = asyncio.Event()
+
+    async def handler(session_id, batch):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        runs.append((session_id, list(batch)))
+        if len(runs) == 1:
+            await release.wait()  # keep the first run in flight
+        active["now"] -= 1
+
+    scheduler = SessionScheduler(handler, max_backlog=3, idle_seconds=0.2)
+
+    # 1. First event starts a run; follow-ups queue behind it
+    assert scheduler.submit("s1", "first")
+    await asyncio.sleep(0.01)
+    assert scheduler.is_busy("s1")
+    assert scheduler.submit("s1", "second")
+    assert scheduler.submit("s1", "third")
+    assert scheduler.submit("s1", "fourth")
+    # 2. Backlog is bounded
+    assert not scheduler.submit("s1", "fifth"), "Backlog beyond max_backlog should be rejected"
+
+    # 3. Other sessions are not blocked by s1
+    assert scheduler.submit("s2", "other")
+    await asyncio.sleep(0.01)
+    assert ("s2", ["other"]) in runs
+
+    # 4. Follow-ups arrive in the next run as one batch
+    release.set()
+    await asyncio.sleep(0.05)
+    s1_runs = [batch for sid, batch in runs if sid == "s1"]
+    assert s1_runs == [["first"], ["second", "third", "fourth"]], s1_runs
+    assert active["max"] <= 2  # at most one run per session (s1 + s2)
+    stats = scheduler.get_stats()
+    assert stats["merged"] == 2 and stats["rejected"] == 1, stats
+    print("✅ Per-session runs are serialized and follow-ups merged")
+
+    # 5. Idle actors are reaped and recreated on demand
+    await asyncio.sleep(0.4)
+    stats = scheduler.get_stats()
+    assert stats["sessions"] == 0 and stats["reaped"] == 2, stats
+    assert scheduler.submit("s1", "again")
+    await asyncio.sleep(0.01)
+    assert runs[-1] == ("s1", ["again"])
+    print("✅ Idle session actors reaped")
+
+    await scheduler.aclose()
+    assert scheduler.get_stats()["sessions"] == 0
+
+
+def test_coalesce_events():
+    print("🧪 Testing Event Coalescing...")
+    say = object()
+    batch = [
+        ({"channel": "C1", "thread_ts": "1.0", "ts": "1.1", "text": "check CL 1234"}, say, "mention"),
+        ({"channel": "C1", "thread_ts": "1.0", "ts": "1.2", "text": "check CL 1234"}, say, "mention"),
+        ({"channel": "C1", "thread_ts": "1.0", "ts": "1.3", "text": "and 1235 too"}, say, "mention"),
+    ]
+    event, merged_say, trigger_type = coalesce_events(batch)
+    assert event["text"] == "check CL 1234\n\nand 1235 too", event["text"]
+    assert event["ts"] == "1.3" and merged_say is say and trigger_type == "mention"
+    assert session_id_for(event) == "slack_1.0"
+    assert session_id_for({"channel": "D1", "ts": "2.0"}) == "slack_D1"
+
+    # Top-level mentions share the channel session but each is answered in its own thread
+    top_level = [
+        ({"channel": "C1", "ts": "5.1", "user": "U1", "text": "deploy status?"}, say, "mention"),
+        ({"channel": "C1", "ts": "5.2", "user": "U2", "text": "who broke the build?"}, say, "mention"),
+        ({"channel": "C1", "user": "API_TRIGGER", "text": "nightly report"}, say, "api"),
+        ({"channel": "C1", "user": "API_TRIGGER", "text": "nightly report"}, say, "api"),
+    ]
+    assert len({session_id_for(e) for e, _, _ in top_level}) == 1
+    turns = [coalesce_events(group)[0] for group in group_by_anchor(top_level)]
+    assert [(t.get("ts"), t["text"]) for t in turns] == [
+        ("5.1", "deploy status?"),
+        ("5.2", "who broke the build?"),
+        (None, "nightly report"),
+        (None, "nightly report"),
+    ], turns
+    print("✅ Queued events merged into one turn")
+
+
+async def test_admission_control():
+    print("🧪 Testing Admission Control...")
+
+    admission = AdmissionController(max_concurrency=1, max_queue=2)
+    order, positions = [], {}
+    release = asyncio.Event()
+
+    async def run(name, priority):
+        async def report(position):
+            positions.setdefault(name, []).append(position)
+        try:
+            async with admission.slot(priority, on_position=report):
+                order.append(name)
+                if name == "first":
+                    await release.wait()
+        except AdmissionRejected:
+            order.append(f"shed:{name}")
+
+    # 1. One slot: later runs queue, API (2) behind mention (1) behind DM (0)
+    tasks = [asyncio.create_task(run("first", 1))]
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(run("api", 2)))
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(run("mention", 1)))
+    await asyncio.sleep(0.01)
+    assert admission.get_stats()["waiting"] == 2
+    assert positions["api"] == [1, 2], positions  # pushed back by the mention
+
+    # 2. Queue full: a DM preempts the lowest-priority waiter, another API run is shed
+    tasks.append(asyncio.create_task(run("dm", 0)))
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(run("api2", 2)))
+    await asyncio.sleep(0.01)
+    assert "shed:api" in order and "shed:api2" in order, order
+    assert positions["dm"] == [1]
+
+    # 3. Released slots go to waiters by priority
+    release.set()
+    await asyncio.gather(*tasks)
+    admitted = [name for name in order if not name.startswith("shed:")]
+    assert admitted == ["first", "dm", "mention"], order
+    stats = admission.get_stats()
+    assert stats["active"] == 0 and stats["waiting"] == 0 and stats["shed"] == 2, stats
+    print("✅ Concurrency capped, priorities respected, overflow shed")
+
+    # 4. A cancelled waiter leaves the queue without leaking its slot
+    release.clear()
+    holder = asyncio.create_task(run("first", 1))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(run("cancelled", 1))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    release.set()
+    await holder
+    assert admission.get_stats()["active"] == 0 and admission.get_stats()["waiting"] == 0
+    print("✅ Cancelled waiters release their place")
+
+
+async def test_prewarm():
+    print("🧪 Testing Startup Prewarm...")
+
+    def slow():
+        time.sleep(0.2)
+
+    def broken():
+        raise RuntimeError("p4 login expired")
+
+    def stuck():
+        time.sleep(1.0)
+
+    start = time.perf_counter()
+    report = await prewarm({"registry": slow, "agent": slow, "p4_info": broken, "opensearch": stuck}, timeout=0.5)
+    elapsed = time.perf_counter() - start
+
+    # 1. Components run concurrently; a stuck one is cut off at the timeout
+    assert elapsed < 0.9, f"Prewarm took {elapsed:.2f}s"
+    assert report["registry"]["status"] == "ok" and report["registry"]["ms"] >= 200
+    assert report["agent"]["status"] == "ok"
+    # 2. Failures are reported, not raised
+    assert report["p4_info"] == {"status": "failed", "ms": report["p4_info"]["ms"], "error": "p4 login expired"}
+    assert report["opensearch"]["status"] == "timeout"
+    print(f"✅ Prewarm ran concurrently in {elapsed:.2f}s with per-component timings")
+
+    # 3. A failed required check (p4 ticket) keeps readiness down until a recheck passes
+    ticket = {"valid": False}
+
+    def login_status():
+        if not ticket["valid"]:
+            raise RuntimeError("Your session has expired, please login again.")
+        return "User eclipse ticket expires in 12 hours."
+
+    report = await prewarm({"p4_info": lambda: "Server version: P4D/LINUX26X86_64", "p4_login": login_status}, timeout=0.5)
+    assert report["p4_info"]["status"] == "ok" and readiness_failures(report) == ["p4_login"]
+    assert await recheck(report, {"p4_login": login_status}, timeout=0.5) == ["p4_login"]
+    ticket["valid"] = True
+    assert await recheck(report, {"p4_login": login_status}, timeout=0.5) == []
+    assert report["p4_login"]["status"] == "ok"
+    print("✅ Expired p4 ticket fails readiness until renewed")
+
+
+async def test_event_dedup():
+    print("🧪 Testing Slack Event Dedup...")
+
+    class FakeRequest:
+        def __init__(self, retry_num=None):
+            self.headers = {"x-slack-retry-num": [retry_num], "x-slack-retry-reason": ["http_timeout"]} if retry_num is not None else {}
+
+    slack = SlackIntegration(bot_token="xoxb-test", app_token="xapp-test", dedup=EventDeduplicator(ttl_seconds=0.2))
+    dm = {"channel": "D123", "ts": "1700000000.000100", "text": "<@U1> hi"}
+
+    # 1. A DM mention arrives as app_mention and message: only the first is handled
+    assert not await slack._is_duplicate(dm, {"event_id": "Ev1"}, FakeRequest())
+    assert await slack._is_duplicate(dm, {"event_id": "Ev2"}, FakeRequest())
+    # 2. Redeliveries: flagged retries are dropped, unflagged ones caught by event_id
+    assert await slack._is_duplicate(dm, {"event_id": "Ev1"}, FakeRequest(retry_num="1"))
+    assert await slack._is_duplicate({"channel": "C1", "ts": "2"}, {"event_id": "Ev1"}, FakeRequest())
+    # 3. Other messages and expired keys pass; Socket Mode first deliveries carry retry num "0"
+    assert not await slack._is_duplicate({"channel": "D123", "ts": "1700000001.0"}, {"event_id": "Ev3"}, FakeRequest())
+    assert not await slack._is_duplicate({"channel": "C9", "ts": "1700000002.0"}, {"event_id": "Ev4"}, FakeRequest(retry_num="0"))
+    await asyncio.sleep(0.25)
+    assert not await slack._is_duplicate(dm, {"event_id": "Ev1"}, FakeRequest())
+    stats = slack.get_dedup_stats()
+    assert stats["duplicates"] == 2 and stats["retries_dropped"] == 1 and stats["checked"] == 6, stats
+    print(f"✅ Duplicate and retried events dropped: {stats}")
+
+    # 4. Redis backend shares claims between replicas
+    import fakeredis
+    server = fakeredis.FakeServer()
+    replica_a = EventDeduplicator(redis=fakeredis.FakeRedis(server=server))
+    replica_b = EventDeduplicator(redis=fakeredis.FakeRedis(server=server))
+    keys = event_keys(dm, "Ev9")
+    assert keys == ["evt:Ev9", "msg:D123:1700000000.000100"]
+    assert await replica_a.claim(keys)
+    assert not await replica_b.claim(keys)
+    assert replica_b.get_stats()["backend"] == "redis"
+    print("✅ Redis-backed dedup shared across replicas")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_session_scheduler())
+    test_coalesce_events()
+    asyncio.run(test_admission_control())
+    asyncio.run(test_prewarm())
+    asyncio.run(test_event_dedup())
@@ -0,0 +1,102 @@
+import sys
+import os
+import asyncio
+
+# Add src to path
+sys.path.append("/app")
+
+from langchain_core.messages import HumanMessage
+
+from src.core.redis_checkpointer import RedisCheckpointSaver, CheckpointConflictError
+from verify_checkpointer import build_graph
+
+
+def get_client():
+    """Local redis-server if REDIS_URL is set, otherwise in-process fakeredis."""
+    if os.environ.get("REDIS_URL"):
+        import redis
+        client = redis.Redis.from_url(os.environ["REDIS_URL"])
+    else:
+        import fakeredis
+        client = fakeredis.FakeRedis()
+    client.flushdb()
+    return client
+
+
+async def verify_redis_checkpointer(client):
+    print(f"🧪 Testing RedisCheckpointSaver ({type(client).__name__})...")
+    config = {"configurable": {"thread_id": "slack_redis"}}
+    graph = build_graph()
+
+    # 1. Several turns, each with a fresh saver (like create_agent per event)
+    for i in range(5):
+        app = graph.compile(checkpointer=RedisCheckpointSaver(client, keep_last=0, ttl_seconds=3600))
+        result = await app.ainvoke({"messages": [HumanMessage(content=f"turn {i}")]}, config)
+    assert len(result["messages"]) == 15
+    assert 0 < client.ttl("eclipse:ckpt:{slack_redis}:head") <= 3600
+
+    # Kept checkpoints get their TTL refreshed with the index, so listed ids never dangle
+    saver = RedisCheckpointSaver(client, keep_last=0, ttl_seconds=3600, max_threads=2)
+    ttl_config = {"configurable": {"thread_id": "slack_redis_ttl"}}
+    await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="first")]}, ttl_config)
+    oldest = client.zrange("eclipse:ckpt:{slack_redis_ttl}:index", 0, 0)[0].decode()
+    client.expire(f"eclipse:ckpt:{{slack_redis_ttl}}:c:{oldest}", 5)
+    await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="refresh")]}, ttl_config)
+    assert client.ttl(f"eclipse:ckpt:{{slack_redis_ttl}}:c:{oldest}") > 5
+    saver.delete_thread("slack_redis_ttl")
+
+    # Heads are turn state: released at turn end and capped per saver
+    empty = {"v": 1, "ts": "", "channel_values": {}, "channel_versions": {}, "versions_seen": {}}
+    for i in range(3):
+        saver.put({"configurable": {"thread_id": f"slack_redis_{i}"}}, {**empty, "id": f"0000000{i}"}, {"step": 0}, {})
+    assert list(saver._heads) == ["slack_redis_1", "slack_redis_2"]
+    saver.release_thread("slack_redis_2")
+    assert list(saver._heads) == ["slack_redis_1"]
+    for i in range(3):
+        saver.delete_thread(f"slack_redis_{i}")
+    print("✅ Turns persisted with TTL")
+
+    # 2. History listing with metadata filter / before / limit
+    saver = RedisCheckpointSaver(client, keep_last=0)
+    history = list(saver.list(config))
+    assert len(history) == 20
+    inputs = list(saver.list(config, filter={"source": "input"}))
+    assert [t.metadata["step"] for t in inputs] == [15, 11, 7, 3, -1]
+    page = list(saver.list(config, before=history[1].config, limit=3))
+    assert [t.config for t in page] == [t.config for t in history[2:5]]
+    assert len([t async for t in saver.alist(config)]) == 20
+    assert len(list(saver.list(None, limit=5))) == 5
+    print("✅ list()/alist() honor filter, before and limit")
+
+    # 3. Time travel: fork from an older checkpoint
+    old = history[10]
+    forked = await graph.compile(checkpointer=saver).ainvoke({"messages": [HumanMessage(content="fork")]}, old.config)
+    assert len(forked["messages"]) == len(old.checkpoint["channel_values"]["messages"]) + 3
+    print("✅ Fork from historical checkpoint")
+
+    # 4. Optimistic concurrency: two replicas load the same head, the second write loses
+    replica_a = RedisCheckpointSaver(client, keep_last=0)
+    replica_b = RedisCheckpointSaver(client, keep_last=0)
+    head_a = replica_a.get_tuple(config)
+    head_b = replica_b.get_tuple(config)
+    await graph.compile(checkpointer=replica_a).ainvoke({"messages": [HumanMessage(content="a")]}, config)
+    try:
+        replica_b.put(head_b.config, {**head_b.checkpoint, "id": "ffffffff-ffff-6fff-ffff-ffffffffffff"}, {"step": 99}, {})
+        raise AssertionError("Stale replica overwrote the thread head")
+    except CheckpointConflictError:
+        pass
+    assert head_a.config == head_b.config
+    print("✅ Concurrent write from a stale replica rejected")
+
+    # 5. Trimming and deletion
+    trimmer = RedisCheckpointSaver(client, keep_last=3)
+    await graph.compile(checkpointer=trimmer).ainvoke({"messages": [HumanMessage(content="trim")]}, config)
+    assert len(list(trimmer.list(config))) == 3
+    trimmer.delete_thread("slack_redis")
+    assert trimmer.get_tuple(config) is None
+    assert not client.keys("eclipse:ckpt:{slack_redis}:*")
+    print("✅ Redis Checkpointer Verified!")
+
+
+if __name__ == "__main__":
+    asyncio.run(verify_redis_checkpointer(get_client()))